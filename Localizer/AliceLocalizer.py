@@ -1,42 +1,54 @@
 from __future__ import absolute_import, division
 
-from psychopy import locale_setup
-from psychopy import prefs
-from psychopy import gui, visual, core, data, event, logging, clock
-from psychopy.constants import (NOT_STARTED, STARTED, PLAYING, PAUSED,
-                                STOPPED, FINISHED, PRESSED, RELEASED, FOREVER)
-
 import numpy as np  # whole numpy lib is available, prepend 'np.'
-from numpy import (sin, cos, tan, log, log10, pi, average,
-                   sqrt, std, deg2rad, rad2deg, linspace, asarray)
-from numpy.random import random, randint, normal, shuffle
 import os  # handy system and path functions
 import sys  # to get file system encoding
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+
+from Prefetcher import Prefetcher
+from AudioCache import loadSound
+from StimulusBank import StimulusBank, bakeFile
+from Triggers import TriggerScheduler, openTriggerPort
+from Timing import waitUntil
+from PassageSampler import PassageSampler, getParticipantSeed
+from WavManifest import WavManifest
+from StreamingSound import StreamingSound, getResidentMemory
+from ContinuousStream import ContinuousStream
+from Timeline import Timeline
+from ScannerPulses import ScannerPulseReader, openScannerPort
+from FrameProfiler import FrameProfiler
+from ResponseCollector import getSoundOnset
+from RunCheckpoint import RunCheckpoint, readCheckpoint, getListHash
+from PsychopyImport import importPsychopy
 
-sys.path.append("../Utils/")
-
-from psychopy import prefs
-prefs.hardware['audioLib'] = ['PTB']
-from psychopy import sound
-
-from psychopy.hardware import keyboard
-import serial
-from psychopy import parallel
-
-import random
-
-from ctypes import *
 
 # Alice in Wonderland localizer according to Fedorenko et al., EEG version
 # Issues to add/decide:
 # - PsychoPy ties its timing to the framerate of the presenting monitor/projector. Since this paradigm is 
 #   auditory only (except for the constantly shown fixation cross), we may want to drop this. Then again,
 #   it probably doesn't cause any issues, as this might induce only a slight variation of a few milliseconds.
-# - Waiting for scanner triggers to synchronize the presentation of blocks is not implemented yet
-# - Buffering: The wav-files are loaded into memory at the start of the respective block. This should be rather quick,
-#   however, Fedorenko et al. do this at the end of the previous block. We may to adjust this or take yet
-#   another approach and load all required wav-files into memory during setup. The total amount of required 
-#   memory should not be too bad, as we're looking at ~4.5Mb per intact/degraded pair, so 12*4.5Mb = 540Mb.
+#   The 'scheduled' playback mode drops the frame loop: the run is compiled into a timeline (see Utils/Timeline.py),
+#   each block's sound is started by the PTB audio backend at its precomputed absolute time and the window is only
+#   redrawn when its content changes.
+# - Scanner synchronization: if a scanner backend is set, the pulses are read and timestamped by a background thread
+#   (see Utils/ScannerPulses.py). Every playback mode starts the run with the scannerPulse-th pulse after the
+#   instructions, the 'frame' and 'streaming' modes can additionally start every block with the next pulse (syncBlocks). The latency between
+#   the pulses and the block onsets is written to the log.
+# - Resuming: every completed block is recorded in an append-only checkpoint (see Utils/RunCheckpoint.py). If a run
+#   is interrupted, it can be restarted with 'resume' = 'yes' in the dialog: the same passages and ITIs (seed of the
+#   interrupted run) are presented from the next block on and the data is merged into the files of the interrupted
+#   run. The 'continuous' mode plays the run as one stream and does not record the blocks while it is running.
+# - Buffering: Similar to Fedorenko et al., the wav-file of the next block is loaded by a background thread
+#   (see Utils/Prefetcher.py) while the current block or fixation is running. At most two decoded files are held
+#   in memory (current and next block) instead of ~4.5Mb per intact/degraded pair, i.e. 12*4.5Mb = 540Mb for
+#   loading everything during setup. Decoding times and the time available for them are written to the log.
+#   The 'streaming' playback mode does not decode at all: the samples are streamed from the memory-mapped wav-file
+#   (see Utils/StreamingSound.py), holding only a read-ahead window of ~1s in memory.
+#   The 'continuous' playback mode preloads the passages of the run and plays the whole run (passages, ITIs and
+#   fixation blocks as silence) as one output stream (see Utils/ContinuousStream.py): the device is started once,
+#   block onsets are sample offsets and the triggers are scheduled from the sample clock of the stream.
 
 # Language of the stimuli
 language = 'GermanMono'
@@ -51,6 +63,8 @@ TRIGGER_BASELINE = 128
 TRIGGER_INTACT = 64
 TRIGGER_DEGRADED = 32
 
+FIXATION_DURATION = 12  # duration of a fixation block in seconds
+
 BLOCK_INTACT = 1
 BLOCK_DEGRADED = 2
 
@@ -65,17 +79,30 @@ class AliceLocalizer:
         stimuliDir : string
             path to the directory containing the stimulus files/subdirecories
         """
+        importPsychopy(globals())
         self.pauseClock = core.Clock()        
         self.psychopyVersion = '3.2.4'
         self.globalClock = core.Clock()  # to track the time since experiment started
         self.routineTimer = core.CountdownTimer()
         self.defaultKeyboard = keyboard.Keyboard()
         self.frameTolerance = 0.001 
+        self.spinWindow = 0.002  # final part of a wait (in seconds) which is busy-waited instead of slept
+        self.pollInterval = 0.02  # maximum interval (in seconds) between two checks for the escape key while waiting
         self.endExpNow = False
         self.language = 'German'
-        #self.serialPort = 'COM1'
+        self.scannerBackend = None  # scanner pulses: None (no synchronization), 'serial' (pyserial), 'tty' (POSIX device) or 'simulated' (see Utils/ScannerPulses.py)
+        self.scannerPort = 'COM1'  # serial port or device of the scanner pulses
+        self.scannerTR = 2.0  # TR in seconds of the 'simulated' scanner
+        self.scannerPulse = 1  # the run starts with this scanner pulse after the instructions (e.g. 1 + number of dummy scans)
+        self.syncBlocks = False  # 'frame' and 'streaming' playback with scanner: every block starts with the next scanner pulse
         self.triggerValue = 0
+        self.triggerBackend = 'parallel'  # 'parallel' (PsychoPy), 'parport' (Linux /dev/parport0) or 'simulated'
         self.mode = MODE_EXP
+        self.playback = 'frame'  # 'frame' (frame-locked loops), 'scheduled' (PTB audio scheduling), 'streaming' (memory-mapped) or 'continuous' (one stream per run)
+        self.streamReadAhead = 1.0  # read-ahead window in seconds of the 'streaming' playback mode
+        self.scheduleLead = 0.5  # time in seconds between scheduling the first block and its onset
+        self.continuousRampDuration = 0.015  # onset/offset ramps in seconds of passages preloaded for the 'continuous' mode
+        self.profileFrames = False  # record the timing of the frame loops and write a report (see Utils/FrameProfiler.py)
         
     def setup(self):
         """
@@ -83,17 +110,35 @@ class AliceLocalizer:
         """
         self._thisDir = os.path.dirname(os.path.abspath(__file__))
         os.chdir(self._thisDir)
+        self.setupStimulusBank()
         self.stimuliDir = os.path.join(self._thisDir, 'stimuli')
         expName = 'AliceLocalizer'
-        expInfo = {'participant': '', 'session': '001', 'Send triggers': 'yes', 'language': 'German'}
+        expInfo = {'participant': '', 'session': '001', 'seed': '', 'Send triggers': 'yes', 'language': 'German', 'playback': ['frame', 'scheduled', 'streaming', 'continuous'], 'resume': ['no', 'yes']}
 
         dlg = gui.DlgFromDict(dictionary=expInfo, sortKeys=False, title=expName)
         if dlg.OK == False:
             core.quit()  # user pressed cancel
+        if not expInfo['seed']:
+            expInfo['seed'] = str(getParticipantSeed(expInfo['participant']))  # reproducible per participant
         expInfo['date'] = data.getDateStr()  # add a simple timestamp
         expInfo['expName'] = expName
         expInfo['psychopyVersion'] = self.psychopyVersion
         filename = self._thisDir + os.sep + u'data/%s_%s_%s' % (expInfo['participant'], expName, expInfo['date'])
+        self.expName = expName
+        self.checkpoint = None
+        self.resumeState = None
+        if expInfo['resume'] == 'yes':
+            state = readCheckpoint(self.getCheckpointFile(expInfo, self.run))
+            if state is None or state['finished']:
+                logging.log(level = logging.WARNING, msg = 'No interrupted run %d to resume, starting from the beginning' % self.run)
+            else:
+                # the resumed run presents the passages of the interrupted run and is merged into its data files
+                self.resumeState = state
+                filename = state['info']['dataFile']
+                expInfo['seed'] = str(state['info']['seed'])
+                expInfo['playback'] = state['info']['playback']
+        self.dataFileName = filename
+        self.expInfo = expInfo
         self.thisExp = data.ExperimentHandler(name=expName, version='',
             extraInfo=expInfo, runtimeInfo=None,
             originPath=self._thisDir + os.sep + 'SemanticIntegration.py',
@@ -102,8 +147,6 @@ class AliceLocalizer:
         self.logFile = logging.LogFile(filename+'.log', level=logging.EXP)
         logging.console.setLevel(logging.WARNING) 
 
-        #self.serial = serial.Serial(self.serialPort, 19200, timeout=1)
-
         self.win = visual.Window(
             size=(1024, 768), fullscr=False, screen=0, 
             winType='pyglet', allowGUI=False, allowStencil=False,
@@ -131,13 +174,19 @@ class AliceLocalizer:
         self.fixation.autoDraw = False
 
         self.language = expInfo['language']
+        self.seed = int(expInfo['seed'])
         
         if expInfo['Send triggers'] == 'yes':
             self.mode = MODE_EXP
         else:
             self.mode = MODE_DEV
+        self.playback = expInfo['playback']
         
         self.setupTriggers()
+        self.setupScanner()
+        # same clock as the trigger scheduler, so the triggers can be matched to the audio starts
+        self.profiler = FrameProfiler(enabled=self.profileFrames, framePeriod=self.win.monitorFramePeriod or 1 / 60,
+                                      clock=self.triggers.clock)
         
         # block sequence
         # X = fixate
@@ -146,18 +195,64 @@ class AliceLocalizer:
     
         self.blocks = [['X', 'I', 'D', 'I', 'D', 'X', 'I', 'D', 'D', 'I', 'X', 'D', 'I', 'D', 'I', 'X'],
             ['X', 'D', 'I', 'D', 'I', 'X', 'D', 'I', 'I', 'D', 'X', 'I', 'D', 'I', 'D', 'X']]
+        self.passageSampler = PassageSampler(self.blocks, numPassages=24)
+
+    def setupStimulusBank(self):
+        """
+        Load the sounds from the prebaked stimulus bank (resampled, stereo and with ramps, see Utils/StimulusBank.py)
+        if it has been created. Files which are not in the bank are decoded as usual.
+        """
+        self.soundLoader = loadSound
+        self.stimulusBank = None
+        bank = StimulusBank(os.path.join(self._thisDir, '..', 'stimulus_bank'))
+        if bank.exists():
+            self.soundLoader = bank.getLoader(loadSound)
+            self.stimulusBank = bank
 
     def setupTriggers(self):
+        """
+        Set up the trigger port and the scheduler which resets trigger pulses after 100ms.
+        Without triggers (development mode), an in-memory port is used which only records the pulses.
+        """
         if self.mode == MODE_EXP:
-            self.port = parallel.ParallelPort(address=0x0378)
-            self.port.setData(0)
+            port = openTriggerPort(self.triggerBackend, address=0x0378)
+        else:
+            port = openTriggerPort('simulated')
+        clock = time.perf_counter
+        if self.playback == 'scheduled':
+            import psychtoolbox as ptb
+            clock = ptb.GetSecs  # same time base as the audio scheduling
+        self.triggers = TriggerScheduler(port, pulseWidth=0.1, clock=clock)
+        self.triggers.start()
+
+    def setupScanner(self):
+        """
+        Start the reader thread of the scanner pulses (see Utils/ScannerPulses.py) if the run is synchronized to the
+        scanner. The pulses are timestamped with the clock of the trigger scheduler.
+        """
+        self.scanner = None
+        self.fakeScanner = None
+        if self.scannerBackend is None:
+            return
+        port, self.fakeScanner = openScannerPort(self.scannerBackend, self.scannerPort, tr=self.scannerTR)
+        self.scanner = ScannerPulseReader(port, clock=self.triggers.clock).start()
 
     def finish(self):
         """
         Clean up the experiment (close serial port, etc.).
         Output files (data, logs, etc.) are automatically handled by PsychoPy (ExperimentHandler)
         """
-        #self.serial.close()
+        if self.scanner is not None:
+            self.scanner.stop()
+            if self.fakeScanner is not None:
+                self.fakeScanner.stop()
+            logging.log(level = logging.EXP, msg = self.scanner.summary())
+        self.triggers.stop()
+        logging.log(level = logging.EXP, msg = self.triggers.summary())
+        if self.profiler.enabled:
+            self.profiler.addTriggerLog('presentSound', self.triggers.log)
+            self.profiler.save(self.dataFileName)
+            logging.log(level = logging.EXP, msg = self.profiler.summary())
             
     def startExperiment(self, run = 1):
         """
@@ -171,14 +266,20 @@ class AliceLocalizer:
             Within this subfolder, stimuli are organized in subfolders according to the language, e.g. "German"
         language : string
             language of the stimuli to use (default: 'German')
+
+        If an interrupted run is resumed, it continues with the block after the last completed one (see setup and
+        Utils/RunCheckpoint.py).
         """
+        self.run = run
         self.setup()
         self.setupStimuli(self.language, run)
+        start = self.startCheckpoint(run)
         
-        msg = 'Ihnen werden nun Ausschnitte aus der Geschichte "Alice im Wunderland" vorgespielt. Bitte hören Sie sich diese möglichst aufmerksam an. Wundern Sie sich nicht, wenn manche Passagen völlig unverständlich und voller Rauschen sind.'
-        if self.language == "English":
-            msg = 'We will now play excerpts from the story "Alice in Wonderland". Please listen carefully and don\'t be surprised if some parts are incomprehensible or noisy.'
-        self.waitForButton(msg, ['space'])
+        if start == 0:
+            msg = 'Ihnen werden nun Ausschnitte aus der Geschichte "Alice im Wunderland" vorgespielt. Bitte hören Sie sich diese möglichst aufmerksam an. Wundern Sie sich nicht, wenn manche Passagen völlig unverständlich und voller Rauschen sind.'
+            if self.language == "English":
+                msg = 'We will now play excerpts from the story "Alice in Wonderland". Please listen carefully and don\'t be surprised if some parts are incomprehensible or noisy.'
+            self.waitForButton(msg, ['space'])
 
         msg = 'Gleich geht es los...'
         if self.language == "English":
@@ -186,7 +287,15 @@ class AliceLocalizer:
         self.waitForButton(msg, ['space'])
 
         self.fixation.autoDraw = True
-        self.processBlocks(run-1) # zero-based index
+        cpuStart = time.process_time()
+        if self.playback == 'scheduled':
+            self.processBlocksScheduled(run-1, start) # zero-based index
+        elif self.playback == 'continuous':
+            self.processBlocksContinuous(run-1, start) # zero-based index
+        else:
+            self.processBlocks(run-1, start) # zero-based index
+        self.checkpoint.finish()
+        logging.log(level = logging.EXP, msg = 'Run CPU time\t%.3f\t%s' % (time.process_time() - cpuStart, self.playback))
         self.fixation.autoDraw = False
 
         msg = 'Ende der Aufgabe'
@@ -195,39 +304,242 @@ class AliceLocalizer:
         self.waitForButton(msg, ['space'])
         self.finish()
 
-    def processBlocks(self, run):
+    def processBlocks(self, run, start=0):
         """
         Process all blocks sequentially according to self.blocks. The duration and timing is either explicitly 
         specified (12 seconds for fixation) or defined by the duration of the specific wav-file. 
+        Every completed block (including its ITI) is recorded in the checkpoint of the run.
+
+        Parameters
+        ----------
+        run : int
+            zero-based index of the run
+        start : int
+            index of the first block to present, e.g. of a resumed run (default: 0)
         """
-        intactIndex = 0
-        degradedIndex = 0
-        
         blocks = self.blocks[run]
+        intactIndex = blocks[0:start].count('I')
+        degradedIndex = blocks[0:start].count('D')
+
+        # decode the wav-file of the next block while the current one is running (not needed for streaming)
+        if self.playback == 'streaming':
+            self.streamStats = {'passages': 0, 'underruns': 0, 'peakRss': getResidentMemory() or 0}
+        else:
+            self.prefetcher = Prefetcher(self.soundLoader, maxBuffers=2)
+            self.prefetcher.start(self.getBlockWavfiles(blocks)[intactIndex + degradedIndex:])
         
-        for block in blocks:
+        pulse = self.waitForRunStart()
+        for i in range(start, len(blocks)):
+            block = blocks[i]
+            iti = self.itis[i]
             print(block)
+            entries = len(self.thisExp.entries)
+            if pulse is not None and self.syncBlocks and i > start:
+                pulse = self.scanner.waitForNext(onPoll=self.checkQuit, pollInterval=self.pollInterval)
+            writes = len(self.triggers.log)
             if block == 'X':
-                if self.mode == MODE_EXP:
-                    self.port.setData(TRIGGER_BASELINE)
-                    self.wait(0.1)
-                    self.port.setData(0)
-                    self.wait(11.9)
-                else:
-                    self.wait(12)
+                self.triggers.pulse(TRIGGER_BASELINE)
+                self.wait(FIXATION_DURATION)
             elif block == 'I':
                 self.presentSound(self.intact[intactIndex], BLOCK_INTACT)
                 intactIndex = intactIndex + 1
             elif block == 'D':
                 self.presentSound(self.degraded[degradedIndex], BLOCK_DEGRADED)
                 degradedIndex = degradedIndex + 1
-            iti = (100 + round(random.random() * 100)) / 1000
+            if pulse is not None and (self.syncBlocks or i == start):
+                self.scanner.addLatency(pulse, self.getTriggerOnset(writes))
             self.wait(iti)
+            self.checkpoint.complete(i, entries=self.thisExp.entries[entries:])
+
+        if self.playback == 'streaming':
+            logging.log(level = logging.EXP, msg = 'Streaming\t%d passages\tpeak RSS %.1f MB\tunderruns %d' % (
+                self.streamStats['passages'], self.streamStats['peakRss'] / 1024 / 1024, self.streamStats['underruns']))
+            return
+        self.prefetcher.stop()
+        for line in self.prefetcher.report():
+            logging.log(level = logging.EXP, msg = line)
         
+    def processBlocksScheduled(self, run, start=0):
+        """
+        Process all blocks like processBlocks, but without a frame loop: the run is compiled into a timeline before
+        it starts (see compileTimeline and Utils/Timeline.py), so the onset of every block is anchored to the start
+        of the run, and every sound is started at exactly this time by the PTB audio backend. Triggers are scheduled
+        for the same time. The window is only redrawn once, as the fixation cross does not change during the run.
+        Scheduled and actual onsets are logged for each block, and every completed block is recorded in the
+        checkpoint of the run. A resumed run starts with block start (event i of the timeline is block start + i).
+        """
+        import psychtoolbox as ptb
+
+        blocks = self.blocks[run]
+        timeline = self.compileTimeline(blocks, start)
+
+        # decode the wav-file of the next block while the current one is running
+        self.prefetcher = Prefetcher(self.soundLoader, maxBuffers=2)
+        self.prefetcher.start([item for item in timeline.items if item is not None])
+        sounds = {}
+
+        def prepare(i, at):
+            if timeline.items[i] is not None:
+                wav = self.prefetcher.get(timeline.items[i])
+                wav.setVolume(1)
+                wav.play(when=at)
+                sounds[i] = wav
+            self.triggers.pulse(int(timeline.triggers[i]), at=at)
+
+        def started(i, at, now):
+            return getSoundOnset(sounds[i], now) if i in sounds else now
+
+        def finished(i):
+            if i in sounds:
+                sounds.pop(i).stop()
+                self.prefetcher.release(timeline.items[i])
+            self.thisExp.addData('block', timeline.labels[i])
+            self.thisExp.addData('wavfile', timeline.items[i] or '')
+            self.thisExp.addData('onset.scheduled', timeline.origin + timeline.onsets[i])
+            self.thisExp.addData('onset.actual', timeline.actual[i])
+            self.thisExp.nextEntry()
+            self.checkpoint.complete(start + i, entries=self.thisExp.entries[-1:])
+
+        self.win.flip()  # show the fixation cross
+        pulse = self.waitForRunStart()
+        origin = (pulse if pulse is not None else ptb.GetSecs()) + self.scheduleLead
+        # each passage is started by the audio backend at its onset and its trigger is sent by the trigger thread, so
+        # during the blocks and ITIs the loop only checks for the quit key and sleeps between the checks (spinWindow=0)
+        timeline.run(ptb.GetSecs, origin, prepare, started, finished, onPoll=self.checkQuit,
+                     lead=self.scheduleLead, spinWindow=0, pollInterval=self.pollInterval)
+        if pulse is not None:
+            self.scanner.addLatency(pulse, timeline.actual[0])
+        for line in timeline.report():
+            logging.log(level = logging.EXP, msg = line)
+        self.prefetcher.stop()
+        for line in self.prefetcher.report():
+            logging.log(level = logging.EXP, msg = line)
+
+    def processBlocksContinuous(self, run, start=0):
+        """
+        Process all blocks like processBlocks, but as one continuous output stream (see Utils/ContinuousStream.py):
+        the passages are preloaded and the timeline of the run (see compileTimeline) including ITIs and fixation
+        blocks (silence) is assembled before the stream is started, so every block onset is a sample offset from
+        the start of the run. The triggers are scheduled from the sample clock of the stream. Onsets are logged
+        after the run. The blocks are not recorded in the checkpoint while the stream is playing, so an interrupted
+        run is resumed from the beginning (start is 0).
+        """
+        blocks = self.blocks[run]
+        timeline = self.compileTimeline(blocks, start)
+        buffers, sampleRate = self.loadRunBuffers([item for item in timeline.items if item is not None])
+
+        stream = ContinuousStream(sampleRate, channels=2)
+        for i in range(len(timeline)):
+            item = timeline.items[i]
+            label = timeline.labels[i] + '\t' + (item or '')
+            if item is None:
+                stream.add(duration=timeline.durations[i], trigger=int(timeline.triggers[i]), label=label)
+            else:
+                stream.add(buffers[item], trigger=int(timeline.triggers[i]), label=label)
+            stream.add(duration=timeline.ends[i] - timeline.offsets[i])
+        logging.log(level = logging.EXP, msg = 'Continuous stream\t%d Hz\t%.3f s\t%d blocks' % (sampleRate, stream.getDuration(), len(blocks)))
+
+        self.win.flip()  # show the fixation cross
+        pulse = self.waitForRunStart()
+        stream.play(onTrigger=lambda value, at: self.triggers.pulse(value, at=at))
+        started = time.perf_counter()
+        waitUntil(started + stream.getDuration(), time.perf_counter, self.spinWindow, self.pollInterval, self.checkQuit)
+        while not stream.isFinished():
+            waitUntil(time.perf_counter() + self.pollInterval, time.perf_counter, self.spinWindow, self.pollInterval, self.checkQuit)
+        stream.stop()
+        if pulse is not None and stream.onsets:
+            self.scanner.addLatency(pulse, stream.onsets[0][2])
+
+        for label, frame, onset in stream.onsets:
+            if not label:
+                continue  # ITI
+            block, _, wavfile = label.partition('\t')
+            logging.log(level = logging.EXP, msg = 'Block onset\t%s\t%d\t%.6f\t%s' % (block, frame, onset, wavfile))
+            self.thisExp.addData('block', block)
+            self.thisExp.addData('wavfile', wavfile)
+            self.thisExp.addData('onset.frame', frame)
+            self.thisExp.addData('onset.actual', onset)
+            self.thisExp.nextEntry()
+        logging.log(level = logging.EXP, msg = 'Continuous stream\tunderruns %d' % stream.underruns)
+
+    def compileTimeline(self, blocks, start=0):
+        """
+        Compile the blocks of a run into a timeline (see Utils/Timeline.py): fixation blocks of FIXATION_DURATION and
+        the passages with the durations of their wav headers, each followed by its ITI.
+
+        Parameters
+        ----------
+        blocks : list of str
+            block sequence of the run
+        start : int
+            index of the first block of the timeline, e.g. of a resumed run (default: 0)
+        """
+        timeline = Timeline()
+        wavfiles = iter(self.getBlockWavfiles(blocks))
+        for i, (block, iti) in enumerate(zip(blocks, self.itis)):
+            wavfile = next(wavfiles) if block != 'X' else None
+            if i < start:
+                continue
+            if block == 'X':
+                timeline.add(FIXATION_DURATION, trigger=TRIGGER_BASELINE, label=block, pause=iti)
+            else:
+                timeline.add(self.wavManifest.getDuration(wavfile), item=wavfile,
+                             trigger=BLOCK_INTACT if block == 'I' else BLOCK_DEGRADED, label=block, pause=iti)
+        return timeline.compile()
+
+    def loadRunBuffers(self, wavfiles):
+        """
+        Load the samples of all wav-files of a run (float32, stereo, with onset/offset ramps) for the 'continuous'
+        playback mode. Files of the stimulus bank are copied from the bank, the others are decoded (see
+        StimulusBank.bakeFile), at the sample rate of the bank or otherwise of the first wav-file.
+
+        Returns
+        -------
+        dictionary (wav-file -> numpy array) and the sample rate
+        """
+        bank = self.stimulusBank
+        if bank is not None:
+            bank.open()
+            sampleRate = bank.sampleRate
+        else:
+            sampleRate = self.wavManifest.get(wavfiles[0])['sampleRate']
+        buffers = {}
+        start = time.perf_counter()
+        for wavfile in wavfiles:
+            if bank is not None and bank.channels == 2 and bank.contains(wavfile):
+                buffers[wavfile] = np.array(bank.get(wavfile))
+            else:
+                buffers[wavfile] = bakeFile((wavfile, sampleRate, 2, self.continuousRampDuration))
+        logging.log(level = logging.EXP, msg = 'Preloaded\t%d files\t%.1f MB\t%.3f s' % (
+            len(buffers), sum(b.nbytes for b in buffers.values()) / 1024 / 1024, time.perf_counter() - start))
+        return buffers, sampleRate
+
+    def getBlockWavfiles(self, blocks):
+        """
+        Return the wav-files of all intact and degraded blocks in the order in which they are presented.
+
+        Parameters
+        ----------
+        blocks : list of str
+            block sequence (see self.blocks)
+        """
+        wavfiles = []
+        intactIndex = 0
+        degradedIndex = 0
+        for block in blocks:
+            if block == 'I':
+                wavfiles.append(self.intact[intactIndex])
+                intactIndex = intactIndex + 1
+            elif block == 'D':
+                wavfiles.append(self.degraded[degradedIndex])
+                degradedIndex = degradedIndex + 1
+        return wavfiles
+
     def setupStimuli(self, language, run):
         """
         Set up the list of wavefiles to use. A set of 6 intact and degraded stimuli are randomly selected.
-        The randomization makes sure that subsequent stimuli are not from the same sentence.
+        The randomization makes sure that subsequent stimuli are not from the same sentence and that runs 1 and 2
+        of a participant do not share a passage.
         
         Parameters
         ----------
@@ -255,64 +567,40 @@ class AliceLocalizer:
             elif (b == 'D'):
                 self.degraded.append(os.path.join(directory, str(seq[i])+'_degraded.wav'))
                 i = i + 1
-        
+
+        # durations from the wav headers, so the run length is known before any sound is decoded
+        self.wavManifest = WavManifest(directory)
+        self.wavManifest.update()
+        logging.log(level = logging.EXP, msg = self.wavManifest.summary())
+        logging.log(level = logging.EXP, msg = 'Run duration\t%d\t%.3f' % (run, self.getRunDuration(blocks)))
+
+    def getRunDuration(self, blocks):
+        """
+        Return the planned duration of a run in seconds: fixation blocks, wav-files and ITIs (see compileTimeline).
+
+        Parameters
+        ----------
+        blocks : list of str
+            block sequence of the run
+        """
+        return self.compileTimeline(blocks).getDuration()
 
     def makeStimulusSequence(self, run):
-        seq = []
-        isIntacts = []
-        intact = list(range(1, 24))
-        degraded = list(range(1, 24))
-        lastIntact = False
-        
-        blocks = self.blocks[run-1]
-        for b in blocks:
-            if (b == 'I'):
-                ok = False
-                while not ok:
-                    # draw an intact stimulus
-                    ind = np.random.randint(len(intact))
-                    value = intact[ind]
-                    ok = self.checkValue(seq, value, True, lastIntact)
-                intact.remove(value)
-                seq.append(value)
-                isIntacts.append(True)
-                lastIntact = True
-            elif (b == 'D'):
-                ok = False
-                while not ok:
-                    # draw an intact stimulus
-                    ind = np.random.randint(len(degraded))
-                    value = degraded[ind]
-                    ok = self.checkValue(seq, value, False, lastIntact)
-                degraded.remove(value)
-                seq.append(value)
-                isIntacts.append(False)
-                lastIntact = False
-        
-        return seq
-                
-         
-    def checkValue(self, seq, value, isCurrentIntact, isLastIntact):
-        if len(seq) == 0:
-            return True
-        
-        # Last value should not be identical 
-        last = seq[-1]
-        if value == last:
-            return False
-        
-        # Two consecutive intacts should not be consecutive passages
-        if isCurrentIntact and isLastIntact:
-            if value == last + 1:
-                return False
-        
-        # Passages should not occur twice in the sequence, independent of intact/degraded
-        for s in seq:
-            if s == value:
-                return False
-        
-        return True        
-      
+        """
+        Draw the passages of the intact and degraded blocks of the specified run and the ITIs after each block
+        (self.itis). Both runs are drawn from the participant's seed, so they never share a passage and the same
+        seed always yields the same sequences and ITIs (see PassageSampler).
+
+        Parameters
+        ----------
+        run : int
+            run (1 or 2)
+        """
+        sequences, itis = self.passageSampler.sample(self.seed)
+        self.itis = itis[run-1]
+        logging.log(level = logging.EXP, msg = 'Passages\t%d\t%d\t%s' % (self.seed, run, ' '.join(str(s) for s in sequences[run-1])))
+        return sequences[run-1]
+
     def printStimuli(self):
         blocks = self.blocks[run]
         i = 0
@@ -337,8 +625,11 @@ class AliceLocalizer:
         wavfile : str 
             wave file to play (either absolute path or relative to the folder of the python file)
         """
+        if self.playback == 'streaming':
+            self.presentStream(wavfile, triggerValue)
+            return
         trialClock = core.Clock()
-        wav = sound.Sound(wavfile, secs=-1, stereo=True, hamming=True, name="sound stimulus")
+        wav = self.prefetcher.get(wavfile)
         wav.setVolume(1)
         trialDuration = wav.getDuration()
         keyb = keyboard.Keyboard()
@@ -352,9 +643,11 @@ class AliceLocalizer:
         trialClock.reset(-_timeToFirstFrame)  # t0 is time of first possible flip
         frameN = -1
         continueRoutine = True
-        triggerActive = False
+        routine = self.profiler.routine('presentSound')
+        routine.begin()
 
         while continueRoutine:
+            routine.tick()
             # get current time
             t = trialClock.getTime()
             tThisFlip = self.win.getFutureFlipTime(clock=trialClock)
@@ -367,18 +660,17 @@ class AliceLocalizer:
                 wav.frameNStart = frameN  # exact frame index
                 wav.tStart = t  # local t and not account for scr refresh
                 wav.tStartRefresh = tThisFlipGlobal  # on global time
-                if self.mode == MODE_EXP:
-                    self.port.setData(triggerValue)
-                    triggerActive = True
+                audioStart = self.profiler.clock()
+                self.triggers.pulse(triggerValue)  # reset after 100ms by the trigger scheduler
+                playStart = self.profiler.clock()
                 wav.play()  # start the sound (it finishes automatically)
+                routine.add('audio.start', audioStart)
+                routine.since('play', playStart)
 
             
-            if self.mode == MODE_EXP and triggerActive and wav.status == STARTED and t >= 0.1-self.frameTolerance:
-                self.port.setData(0)
             
             # check for quit (typically the Esc key)
-            if self.endExpNow or event.getKeys(keyList=["escape"]):
-                core.quit()
+            self.checkQuit(routine)
             
             if wav.status == FINISHED and tThisFlipGlobal > wav.tStartRefresh + trialDuration-self.frameTolerance:
                 continueRoutine = False     
@@ -386,18 +678,58 @@ class AliceLocalizer:
             # refresh the screen
             if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
                 self.win.flip()
+                routine.flip()
 
         # -------Ending Routine -------
         wav.stop()  # ensure sound has stopped at end of routine
+        self.prefetcher.release(wavfile)  # lets the prefetcher decode the next block
         self.thisExp.addData('wavfile', wavfile)
         self.thisExp.addData('wav.started', wav.tStart)
         self.thisExp.nextEntry()
         
         self.routineTimer.reset()
 
+    def presentStream(self, wavfile, triggerValue):
+        """
+        Play a sound by streaming it from the memory-mapped wav-file (see Utils/StreamingSound.py).
+        The resident memory of the process is sampled while waiting for the end of the sound.
+
+        Parameters
+        ----------
+        wavfile : str 
+            wave file to play (either absolute path or relative to the folder of the python file)
+        """
+        wav = StreamingSound(wavfile, readAhead=self.streamReadAhead)
+        stats = self.streamStats
+
+        def poll():
+            self.checkQuit()
+            rss = getResidentMemory()
+            if rss is not None and rss > stats['peakRss']:
+                stats['peakRss'] = rss
+
+        self.win.flip()
+        wav.play()
+        self.triggers.pulse(triggerValue)  # reset after 100ms by the trigger scheduler
+        started = time.perf_counter()
+        waitUntil(started + wav.getDuration(), time.perf_counter, self.spinWindow, self.pollInterval, poll)
+        while not wav.isFinished():
+            waitUntil(time.perf_counter() + self.pollInterval, time.perf_counter, self.spinWindow, self.pollInterval, poll)
+        wav.stop()
+
+        stats['passages'] = stats['passages'] + 1
+        stats['underruns'] = stats['underruns'] + wav.underruns
+        logging.log(level = logging.EXP, msg = 'Stream\t%.4f\t%d\t%s' % (
+            wav.onset - wav.startTime if wav.onset is not None else -1, wav.underruns, wavfile))
+        self.thisExp.addData('wavfile', wavfile)
+        self.thisExp.addData('wav.started', started)
+        self.thisExp.addData('wav.underruns', wav.underruns)
+        self.thisExp.nextEntry()
+
     def wait(self, time):
         """
         Wait for a specific amount of time while listening for key presses to quit the experiment.
+        The escape key is checked at least every pollInterval seconds.
         
         Parameters
         ----------
@@ -405,31 +737,109 @@ class AliceLocalizer:
             time in seconds to wait 
         """
         trialClock = core.Clock()
-        trialDuration = time
-        keyb = keyboard.Keyboard()
+        routine = self.profiler.routine('wait')
+        routine.begin()
 
-        # reset timers
-        trialClock.reset()
-        continueRoutine = True
+        def poll():
+            routine.tick()
+            self.checkQuit(routine)
 
-        while continueRoutine:
-            # get current time
-            t = trialClock.getTime()
-            
-            # check for quit (typically the Esc key)
-            if self.endExpNow or event.getKeys(keyList=["escape"]):
-                core.quit()
-            
-            if t > trialDuration:
-                continueRoutine = False    
-
-            # refresh the screen (needed to show the fixation cross at the beginning)
-            if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
-                self.win.flip() 
+        # refresh the screen once (needed to show the fixation cross at the beginning). The content does not
+        # change while waiting, so the thread sleeps and only spins for the final spinWindow seconds
+        self.win.flip()
+        routine.flip()
+        end = waitUntil(time, trialClock.getTime, spinWindow=self.spinWindow, pollInterval=self.pollInterval, onPoll=poll)
+        routine.add('overshoot', end - time)
 
         # -------Ending Routine -------
         self.routineTimer.reset()
 
+    def getCheckpointFile(self, expInfo, run):
+        """
+        Return the checkpoint file of a run of the participant and session (see Utils/RunCheckpoint.py).
+        """
+        return os.path.join(self._thisDir, 'data', '%s_%s_%s_%d_checkpoint.jsonl' % (expInfo['participant'], expInfo['session'], self.expName, run))
+
+    def startCheckpoint(self, run):
+        """
+        Start the checkpoint of a run. A new run writes its seed, playback mode, data file and a hash of its passages
+        and ITIs to the checkpoint. A resumed run checks that it presents the passages and ITIs of the interrupted run,
+        restores the completed blocks into the data file and continues the checkpoint.
+
+        Returns
+        -------
+        the index of the first block to present
+        """
+        blocks = self.blocks[run-1]
+        schedule = blocks + self.getBlockWavfiles(blocks) + ['%.6f' % iti for iti in self.itis]
+        self.checkpoint = RunCheckpoint(self.getCheckpointFile(self.expInfo, run))
+        if self.resumeState is None:
+            self.checkpoint.start({'run': run, 'seed': self.seed, 'playback': self.playback, 'dataFile': self.dataFileName,
+                                   'blocks': len(blocks), 'listHash': getListHash(schedule)})
+            return 0
+        if self.resumeState['info']['listHash'] != getListHash(schedule):
+            raise ValueError('The passages or ITIs of run %d differ from the interrupted run' % run)
+        for block in self.resumeState['trials']:
+            for entry in block['entries']:
+                for name, value in entry.items():
+                    self.thisExp.addData(name, value)
+                self.thisExp.nextEntry()
+        self.checkpoint.start()
+        logging.log(level = logging.EXP, msg = 'Resumed run\t%d\tat block %d of %d' % (run, self.resumeState['next'], len(blocks)))
+        return self.resumeState['next']
+
+    def waitForRunStart(self):
+        """
+        Wait for the scanner pulse which starts the run (the scannerPulse-th pulse from now on) if the run is
+        synchronized to the scanner.
+        The escape key is checked while waiting.
+
+        Returns
+        -------
+        the time of the pulse (in the time base of the trigger scheduler), or None without scanner
+        """
+        if self.scanner is None:
+            return None
+        # the pulses are counted from here: pulses received before the run is ready (e.g. during the instructions)
+        # are ignored, so the run is never anchored to a pulse in the past
+        return self.scanner.waitForNext(self.scannerPulse, onPoll=self.checkQuit, pollInterval=self.pollInterval)
+
+    def getTriggerOnset(self, start):
+        """
+        Return the time of the first trigger onset written since the trigger log had the specified length
+        (None if there is none), e.g. the onset of a block synchronized to a scanner pulse.
+        """
+        for scheduled, actual, value in self.triggers.log[start:]:
+            if value != 0:
+                return actual
+        return None
+
+    def checkQuit(self, routine=None):
+        """
+        Quit the experiment if requested (typically by the Esc key).
+        """
+        if self.endExpNow or self.getKeys(["escape"], routine):
+            core.quit()
+
+    def getKeys(self, keyList=None, routine=None):
+        """
+        Return the keys of keyList (default: all keys) pressed since the last call and record the key-poll latency
+        of the routine.
+
+        Parameters
+        ----------
+        keyList : list of str
+            keys to check (default: None, all keys)
+        routine : RoutineProfiler
+            profiler of the calling routine (default: None, the latency is not recorded)
+        """
+        if routine is None:
+            return event.getKeys(keyList=keyList)
+        start = self.profiler.clock()
+        keys = event.getKeys(keyList=keyList)
+        routine.since('keyPoll', start)
+        return keys
+
     def resetTrialComponents(self, components):
         """
         Reset the specified list of PsychoPy-components.
@@ -466,8 +876,11 @@ class AliceLocalizer:
         self.message.autoDraw = True
         
         status = STARTED
+        routine = self.profiler.routine('waitForButton')
+        routine.begin()
         while continueRoutine:
-            keys = event.getKeys()
+            routine.tick()
+            keys = self.getKeys(routine=routine)
             
             if len(keys):
                 theseKeys = keys[0]  # at least one key was pressed
@@ -491,13 +904,15 @@ class AliceLocalizer:
             # refresh the screen
             if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
                 self.win.flip()
+                routine.flip()
 
         # -------Ending Routine "pause"-------
         # Hide message component
         self.message.autoDraw = False
         
-alice = AliceLocalizer()
-alice.startExperiment(run)
+if __name__ == '__main__':
+    alice = AliceLocalizer()
+    alice.startExperiment(run)
 
 # Test stimulus setup
 #alice.setup()
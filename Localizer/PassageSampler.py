@@ -0,0 +1,123 @@
+import zlib
+
+import numpy as np
+
+
+def getParticipantSeed(participant):
+    """
+    Derive a reproducible random seed from a participant ID.
+
+    Parameters
+    ----------
+    participant : str
+        participant ID as entered in the experiment dialog
+    """
+    participant = str(participant).strip()
+    if participant.isdigit():
+        return int(participant)
+    return zlib.crc32(participant.encode('utf-8'))
+
+
+class PassageSampler:
+    """
+    Assigns the Alice passages to the intact and degraded blocks of both runs of a participant.
+
+    The passages are drawn block by block from the set of passages not used so far by the participant
+    (in either run), so no passage is presented twice. Two consecutive intact blocks never present consecutive
+    passages. The random numbers of each participant come from a generator seeded with the participant's seed,
+    so the sequence (and the ITIs) of a participant can be reproduced and do not depend on which other
+    participants are generated in the same call.
+    """
+
+    def __init__(self, blocks, numPassages=24, itiRange=(100, 200)):
+        """
+        Parameters
+        ----------
+        blocks : list of lists of str
+            block sequence of each run (X = fixation, I = intact, D = degraded)
+        numPassages : int
+            number of available passages, numbered from 1 (default: 24)
+        itiRange : tuple of int
+            minimum and maximum ITI after each block in milliseconds (default: 100-200ms)
+        """
+        self.blocks = blocks
+        self.numPassages = numPassages
+        self.itiRange = itiRange
+
+        # stimulus slots of all runs: run index and block type
+        self.slotRuns = []
+        self.slotTypes = []
+        for run in range(len(blocks)):
+            for b in blocks[run]:
+                if b == 'I' or b == 'D':
+                    self.slotRuns.append(run)
+                    self.slotTypes.append(b)
+        if len(self.slotTypes) > numPassages:
+            raise ValueError('%d passages are not enough for %d intact/degraded blocks' % (numPassages, len(self.slotTypes)))
+
+    def sample(self, seed):
+        """
+        Draw the passages and ITIs of all runs for a single participant.
+
+        Parameters
+        ----------
+        seed : int
+            random seed of the participant
+
+        Returns
+        -------
+        sequences : list of lists of int
+            passage numbers of the intact and degraded blocks of each run
+        itis : list of lists of double
+            ITI in seconds after each block of each run
+        """
+        sequences, itis = self.sampleCohort([seed])
+        return sequences[0], itis[0]
+
+    def sampleCohort(self, seeds):
+        """
+        Draw the passages and ITIs of all runs for a number of participants at once.
+
+        Parameters
+        ----------
+        seeds : list of int
+            random seed of each participant
+
+        Returns
+        -------
+        sequences : list (participants) of lists (runs) of lists of int
+            passage numbers of the intact and degraded blocks of each run
+        itis : list (participants) of lists (runs) of lists of double
+            ITI in seconds after each block of each run
+        """
+        numSlots = len(self.slotTypes)
+        keys = np.empty((len(seeds), numSlots, self.numPassages))
+        itis = []
+        for p in range(len(seeds)):
+            rng = np.random.default_rng(seeds[p])
+            keys[p] = rng.random((numSlots, self.numPassages))
+            itis.append([[int(v) / 1000 for v in rng.integers(self.itiRange[0], self.itiRange[1] + 1, len(b))] for b in self.blocks])
+
+        available = np.ones((len(seeds), self.numPassages), dtype=bool)
+        chosen = np.empty((len(seeds), numSlots), dtype=int)
+        participants = np.arange(len(seeds))
+        for slot in range(numSlots):
+            allowed = available.copy()
+            if slot > 0 and self.slotRuns[slot - 1] == self.slotRuns[slot] and self.slotTypes[slot - 1] == 'I' and self.slotTypes[slot] == 'I':
+                # two consecutive intact blocks should not present consecutive passages
+                following = chosen[:, slot - 1] + 1
+                ok = following < self.numPassages
+                allowed[participants[ok], following[ok]] = False
+            if not np.all(allowed.any(axis=1)):
+                raise ValueError('No passage left for block %d' % slot)
+            # uniform choice among the allowed passages: largest random key
+            chosen[:, slot] = np.argmax(np.where(allowed, keys[:, slot], -1), axis=1)
+            available[participants, chosen[:, slot]] = False
+
+        sequences = []
+        for p in range(len(seeds)):
+            runs = [[] for b in self.blocks]
+            for slot in range(numSlots):
+                runs[self.slotRuns[slot]].append(int(chosen[p, slot]) + 1)
+            sequences.append(runs)
+        return sequences, itis
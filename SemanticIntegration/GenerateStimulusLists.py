@@ -0,0 +1,80 @@
+"""
+Generate the stimuli lists of a cohort of participants without starting PsychoPy (no window, no audio).
+The lists are written to stim_lists/<participant>_<session>_stim_SemanticIntegration.csv, where the
+experiment picks them up instead of generating a list at the start of run 1. Each list contains both runs.
+
+The random numbers of each list come from a generator seeded with (seed, participant, session), so a list
+can be reproduced and does not depend on the number of workers or on the other lists generated in the same call.
+Existing lists are kept unless --overwrite is specified. Every worker builds the tables of its own sampler, so the
+default number of workers is limited by the available memory (see StimulusLists.getWorkerCount).
+
+Usage: python GenerateStimulusLists.py --participants N [--first 1] [--sessions 1] [--workers N] [--seed 0] [--overwrite]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import StimulusLists
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+
+# sampler of each worker process, reused for all its lists (the sampler caches its tables, about 0.3 GB per worker)
+sampler = StimulusLists.getSequenceSampler()
+
+
+def generate(job):
+    """
+    Generate and write the stimuli list of one participant and session.
+
+    Parameters
+    ----------
+    job : tuple
+        (participant, session, seed, overwrite)
+
+    Returns
+    -------
+    the path of the list and whether it was written
+    """
+    participant, session, seed, overwrite = job
+    filename = StimulusLists.getStimListPath(_thisDir, participant, session)
+    if os.path.exists(filename) and not overwrite:
+        return filename, False
+    rng = np.random.default_rng([seed, int(participant), int(session)])
+    stimuli, responseTimes = StimulusLists.generateStimulusList(os.path.join(_thisDir, 'responseTimes.csv'), sampler, rng)
+    StimulusLists.writeStimulusList(filename, stimuli, responseTimes)
+    return filename, True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the stimuli lists of a cohort of participants')
+    parser.add_argument('--participants', type=int, required=True, help='number of participants')
+    parser.add_argument('--first', type=int, default=1, help='ID of the first participant (default: 1)')
+    parser.add_argument('--sessions', type=int, default=1, help='number of sessions per participant (default: 1)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs, limited by the available memory)')
+    parser.add_argument('--seed', type=int, default=0, help='base seed of the cohort (default: 0)')
+    parser.add_argument('--overwrite', action='store_true', help='replace existing lists')
+    args = parser.parse_args()
+
+    os.makedirs(os.path.join(_thisDir, 'stim_lists'), exist_ok=True)
+    jobs = []
+    for p in range(args.first, args.first + args.participants):
+        for s in range(1, args.sessions + 1):
+            jobs.append((str(p), '%03d' % s, args.seed, args.overwrite))
+
+    start = time.perf_counter()
+    written = 0
+    with ProcessPoolExecutor(max_workers=StimulusLists.getWorkerCount(args.workers)) as executor:
+        for filename, isNew in executor.map(generate, jobs, chunksize=max(1, len(jobs) // 64)):
+            if isNew:
+                written = written + 1
+    duration = time.perf_counter() - start
+
+    print('%d lists written, %d existing lists kept' % (written, len(jobs) - written))
+    print('%.2f s, %.1f lists/s' % (duration, written / duration if duration > 0 else 0))
+
+
+if __name__ == '__main__':
+    main()
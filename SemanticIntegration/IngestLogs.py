@@ -0,0 +1,366 @@
+"""
+Ingest the log files of the runs (data/*_SemanticIntegration_*.log) into a columnar session store, so the trials of a
+whole study can be analysed without parsing the text files again.
+
+The EXP lines 'Playback started', 'Response' and 'Trial ended' of the trials of every log are converted into typed
+columns (one row per line): session, trial, event, log time, global time, wav file, response key, rt and rt.event. The
+playback of the instructions is not a trial. A resumed run is appended to the log of the interrupted run, so the rows
+of its trials replace the rows of the interrupted attempt from the trial at which it was resumed. Training logs (which
+play the stimuli of stimuli_list_training.csv) are recorded as sessions without rows. Strings are stored
+as codes into tables (sessions, wavs, responses), so the store holds only numeric arrays and is written as a NumPy
+.npz file. Only logs which are new or have changed since the last ingestion are parsed (in parallel); the rows of
+the other sessions are taken from the existing store.
+
+Usage: python IngestLogs.py [directories ...] [--store data/sessions.npz] [--workers N] [--summary]
+"""
+import argparse
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from StimulusLists import PREFIXES
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+
+# increment if the parsing changes, to parse all logs again
+VERSION = 2
+
+EVENTS = ['playback', 'response', 'end']
+EVENT_PLAYBACK = 0
+EVENT_RESPONSE = 1
+EVENT_END = 2
+
+ROW_COLUMNS = ['session', 'trial', 'event', 'time', 'globalTime', 'wav', 'response', 'rt', 'rtEvent']
+
+LOG_NAME = re.compile(r'^(?P<participant>.*)_SemanticIntegration_(?P<run>\d+)_(?P<date>.+)\.log$')
+
+# wav files of the training list (e.g. pseudoword_training6a.wav)
+TRAINING_WAV = re.compile(r'^[a-z]+_training')
+
+# 'Resumed run\t<run>\tat trial <next> of <trials>', logged by startCheckpoint of SemanticIntegration.py
+RESUMED_AT = re.compile(r'^at trial (?P<next>\d+) of \d+')
+
+
+def parseLog(path):
+    """
+    Parse the EXP lines of the trials of a log file.
+
+    Parameters
+    ----------
+    path : str
+        log file
+
+    Returns
+    -------
+    dictionary of the row columns (without session): trial, event, time, globalTime, rt and rtEvent as numpy
+    arrays, wav and response as lists of str ('' if the line has none), and resumed (trial at which the run was
+    resumed, -1 if it was not) and training (True for the log of a training run, which has no rows)
+    """
+    trial = -1
+    inTrial = False
+    resumed = -1
+    training = False
+    columns = {name: [] for name in ['trial', 'event', 'time', 'globalTime', 'wav', 'response', 'rt', 'rtEvent']}
+
+    def add(event, t, globalTime=np.nan, wav='', response='', rt=np.nan, rtEvent=np.nan):
+        columns['trial'].append(trial)
+        columns['event'].append(event)
+        columns['time'].append(t)
+        columns['globalTime'].append(globalTime)
+        columns['wav'].append(wav)
+        columns['response'].append(response)
+        columns['rt'].append(rt)
+        columns['rtEvent'].append(rtEvent)
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            # '<time> \t<level> \t<message>', the fields of the message are separated by tabs as well
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 4:
+                continue
+            message = parts[2]
+            try:
+                if message == 'Playback started':
+                    wav = parts[4] if len(parts) > 4 else ''
+                    name = os.path.basename(wav.replace('\\', '/'))
+                    # the instructions (and other sounds without condition) are not trials
+                    inTrial = name.split('_')[0] in PREFIXES
+                    if not inTrial:
+                        continue
+                    if TRAINING_WAV.match(name):
+                        training = True
+                        break
+                    trial = trial + 1
+                    add(EVENT_PLAYBACK, float(parts[0]), globalTime=float(parts[3]), wav=wav)
+                elif message == 'Response' and inTrial:
+                    add(EVENT_RESPONSE, float(parts[0]), response=parts[3], rt=float(parts[4]) if len(parts) > 4 else np.nan,
+                        rtEvent=float(parts[5]) if len(parts) > 5 else np.nan)
+                elif message == 'Trial ended' and inTrial:
+                    add(EVENT_END, float(parts[0]), globalTime=float(parts[3]))
+                    inTrial = False
+                elif message == 'Resumed run' and len(parts) > 4:
+                    match = RESUMED_AT.match(parts[4])
+                    if match is None:
+                        continue
+                    # the trials from next on are presented again, the rows of the interrupted attempt are dropped
+                    resumed = int(match.group('next'))
+                    keep = sum(1 for t in columns['trial'] if t < resumed)
+                    for values in columns.values():
+                        del values[keep:]
+                    trial = resumed - 1
+                    inTrial = False
+            except ValueError:
+                continue  # truncated line of a crashed run
+    if training:
+        columns = {name: [] for name in columns}
+    for name in ['trial', 'event']:
+        columns[name] = np.array(columns[name], dtype=np.int32 if name == 'trial' else np.int8)
+    for name in ['time', 'globalTime', 'rt', 'rtEvent']:
+        columns[name] = np.array(columns[name], dtype=float)
+    columns['resumed'] = resumed
+    columns['training'] = training
+    return columns
+
+
+def encode(values, table, index):
+    """
+    Return the codes of a list of str in table (-1 for ''), appending new values to table and index.
+    """
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if not value:
+            codes[i] = -1
+            continue
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(table)
+            table.append(value)
+        codes[i] = code
+    return codes
+
+
+class SessionStore:
+    """
+    Columnar store of the trial events of all ingested runs (see the module description).
+
+    Rows: session, trial, event (index into EVENTS), time (log time), globalTime, wav (index into wavs), response
+    (index into responses), rt and rtEvent (nan if not logged), all numpy arrays of equal length.
+    Sessions: file (path relative to the root of the store), size and mtime of the file, participant, run, date,
+    resumed (trial at which an interrupted run was resumed, -1 if it was not) and training (training runs have no rows).
+    """
+
+    def __init__(self):
+        self.columns = {name: np.empty(0, dtype=dtype) for name, dtype in zip(ROW_COLUMNS,
+                        [np.int32, np.int32, np.int8, float, float, np.int32, np.int32, float, float])}
+        self.files = []
+        self.sizes = []
+        self.mtimes = []
+        self.participants = []
+        self.runs = []
+        self.dates = []
+        self.resumed = []
+        self.training = []
+        self.wavs = []
+        self.responses = []
+
+    def __len__(self):
+        return len(self.columns['session'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a store written by save (an empty store if the file does not exist or was written by another VERSION).
+        """
+        store = cls()
+        if not os.path.exists(filename):
+            return store
+        with np.load(filename) as f:
+            if int(f['version']) != VERSION:
+                return store
+            store.columns = {name: f[name] for name in ROW_COLUMNS}
+            store.files = f['files'].tolist()
+            store.sizes = f['sizes'].tolist()
+            store.mtimes = f['mtimes'].tolist()
+            store.participants = f['participants'].tolist()
+            store.runs = f['runs'].tolist()
+            store.dates = f['dates'].tolist()
+            store.resumed = f['resumed'].tolist()
+            store.training = f['training'].tolist()
+            store.wavs = f['wavs'].tolist()
+            store.responses = f['responses'].tolist()
+        return store
+
+    def save(self, filename):
+        """
+        Write the store to filename (.npz, replaced atomically).
+        """
+        temp = filename + '.tmp.npz'
+        np.savez(temp, version=VERSION, files=np.array(self.files, dtype=str), sizes=np.array(self.sizes, dtype=np.int64),
+                 mtimes=np.array(self.mtimes, dtype=float), participants=np.array(self.participants, dtype=str),
+                 runs=np.array(self.runs, dtype=np.int32), dates=np.array(self.dates, dtype=str),
+                 resumed=np.array(self.resumed, dtype=np.int32), training=np.array(self.training, dtype=bool),
+                 wavs=np.array(self.wavs, dtype=str), responses=np.array(self.responses, dtype=str), **self.columns)
+        os.replace(temp, filename)
+
+    def getSessions(self):
+        """
+        Return the session index of every ingested file (path relative to the root of the store) as dictionary.
+        """
+        return {file: session for session, file in enumerate(self.files)}
+
+    def remove(self, sessions):
+        """
+        Remove the rows and entries of the specified sessions (e.g. logs which have changed). The remaining sessions
+        are renumbered.
+        """
+        sessions = set(sessions)
+        if not sessions:
+            return
+        keep = [s for s in range(len(self.files)) if s not in sessions]
+        mapping = np.full(len(self.files), -1, dtype=np.int32)
+        mapping[keep] = np.arange(len(keep), dtype=np.int32)
+        rows = mapping[self.columns['session']] >= 0
+        self.columns = {name: values[rows] for name, values in self.columns.items()}
+        self.columns['session'] = mapping[self.columns['session']]
+        for table in [self.files, self.sizes, self.mtimes, self.participants, self.runs, self.dates,
+                      self.resumed, self.training]:
+            table[:] = [table[s] for s in keep]
+
+    def extend(self, logs):
+        """
+        Append the rows of parsed logs as new sessions.
+
+        Parameters
+        ----------
+        logs : list of tuples
+            (file, size, mtime, columns returned by parseLog) of every log
+        """
+        wavIndex = {w: i for i, w in enumerate(self.wavs)}
+        responseIndex = {r: i for i, r in enumerate(self.responses)}
+        parts = {name: [self.columns[name]] for name in ROW_COLUMNS}
+        for file, size, mtime, parsed in logs:
+            name = LOG_NAME.match(os.path.basename(file))
+            session = len(self.files)
+            self.files.append(file)
+            self.sizes.append(size)
+            self.mtimes.append(mtime)
+            self.participants.append(name.group('participant') if name else '')
+            self.runs.append(int(name.group('run')) if name else 0)
+            self.dates.append(name.group('date') if name else '')
+            parsed = dict(parsed)
+            self.resumed.append(parsed.pop('resumed'))
+            self.training.append(parsed.pop('training'))
+            parsed['session'] = np.full(len(parsed['trial']), session, dtype=np.int32)
+            parsed['wav'] = encode(parsed['wav'], self.wavs, wavIndex)
+            parsed['response'] = encode(parsed['response'], self.responses, responseIndex)
+            for column in ROW_COLUMNS:
+                parts[column].append(parsed[column])
+        self.columns = {column: np.concatenate(parts[column]).astype(self.columns[column].dtype) for column in ROW_COLUMNS}
+
+    def getConditions(self):
+        """
+        Return the condition of every row (prefix of its wav file, e.g. 'expected', '' without wav file) as codes
+        into the returned list of conditions.
+        """
+        conditions = sorted(set(os.path.basename(w).split('_')[0] for w in self.wavs))
+        index = {c: i for i, c in enumerate(conditions)}
+        wavConditions = np.array([index[os.path.basename(w).split('_')[0]] for w in self.wavs] + [-1], dtype=np.int32)
+        return wavConditions[self.columns['wav']], conditions
+
+    def getTrialColumn(self, name, event):
+        """
+        Return a column of the rows of an event, aligned with the playback rows (nan or -1 for trials without this
+        event), e.g. the response rt of every trial. If a trial has several rows of the event, the first one is used.
+        """
+        c = self.columns
+        playback = c['event'] == EVENT_PLAYBACK
+        # the rows are ordered by session and trial, so the trial of a row is the number of playback rows up to it
+        trials = np.cumsum(playback) - 1
+        rows = np.flatnonzero((c['event'] == event) & (c['trial'] >= 0))
+        trials = trials[rows]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = trials[1:] != trials[:-1]
+        fill = np.nan if c[name].dtype.kind == 'f' else -1
+        result = np.full(np.count_nonzero(playback), fill, dtype=c[name].dtype)
+        result[trials[first]] = c[name][rows[first]]
+        return result
+
+
+def ingest(directories, storeFile, workers=None):
+    """
+    Ingest the new and changed logs of the directories into the store. Returns the store and the number of parsed logs.
+    """
+    root = os.path.dirname(os.path.abspath(storeFile))
+    store = SessionStore.load(storeFile)
+    paths = sorted(p for d in directories for p in glob.glob(os.path.join(d, '*_SemanticIntegration_*.log')))
+    sessions = store.getSessions()
+    pending = []
+    changed = []
+    for path in paths:
+        file = os.path.relpath(os.path.abspath(path), root)
+        stat = os.stat(path)
+        session = sessions.get(file)
+        if session is not None and store.sizes[session] == stat.st_size and store.mtimes[session] == stat.st_mtime:
+            continue
+        pending.append((path, file, stat.st_size, stat.st_mtime))
+        if session is not None:
+            changed.append(session)
+    store.remove(changed)
+    if len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parseLog, [p[0] for p in pending], chunksize=max(1, len(pending) // 64)))
+    else:
+        results = [parseLog(p[0]) for p in pending]
+    store.extend([(file, size, mtime, parsed) for (path, file, size, mtime), parsed in zip(pending, results)])
+    if pending:
+        store.save(storeFile)
+    return store, len(pending)
+
+
+def printSummary(store):
+    """
+    Print the number of trials, the response rate and the mean rt.event (rt if not logged) of every condition.
+    """
+    start = time.perf_counter()
+    c = store.columns
+    playback = c['event'] == EVENT_PLAYBACK
+    conditions, names = store.getConditions()
+    conditions = conditions[playback]
+    rt = store.getTrialColumn('rtEvent', EVENT_RESPONSE)
+    rtLogged = store.getTrialColumn('rt', EVENT_RESPONSE)
+    rt = np.where(np.isfinite(rt), rt, rtLogged)
+    responded = np.isfinite(rt)
+    print('%-12s %9s %9s %9s' % ('condition', 'trials', 'responses', 'rt mean'))
+    for i, name in enumerate(names):
+        trials = conditions == i
+        count = np.count_nonzero(trials & responded)
+        print('%-12s %9d %8.1f%% %9.4f' % (name, np.count_nonzero(trials), 100 * count / max(1, np.count_nonzero(trials)),
+                                          rt[trials & responded].mean() if count else np.nan))
+    print('query time %.2f ms' % (1000 * (time.perf_counter() - start)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest the log files of the runs into a columnar session store')
+    parser.add_argument('directories', nargs='*', default=[os.path.join(_thisDir, 'data')], help='directories with log files (default: data)')
+    parser.add_argument('--store', default=os.path.join(_thisDir, 'data', 'sessions.npz'), help='store file (default: data/sessions.npz)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--summary', action='store_true', help='print the response rate and mean rt per condition')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store, parsed = ingest(args.directories, args.store, args.workers)
+    print('%d new or changed logs parsed, %d sessions, %d rows in %.3f s' % (
+        parsed, len(store.files), len(store), time.perf_counter() - start))
+    if args.summary:
+        printSummary(store)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+"""
+Generate the stimuli lists of a cohort of participants which are counterbalanced across the cohort, not only within
+each list. Every list presents all stimuli (both versions of each pseudoword, one per run), so what differs between
+the lists is where each stimulus is presented. The optimizer minimises the imbalance of the cohort:
+
+- stimulus x position: how often each wavefile is presented in each position bin (--bins bins of equal size over
+  both runs, i.e. also the run of each item), compared to an even distribution over the bins
+- condition x position: how often each condition is presented at each trial position of a run, compared to its
+  proportion in the run
+- pseudoword versions: how often the a version of each pseudoword is presented in run 1 (and thus heard first)
+
+Each term is the mean squared deviation of the counts from their expected value, the objective is their weighted
+sum. The search starts from lists drawn by StimulusLists.generateStimulusList and swaps two trials of a list:
+trials of the same run, sentences of the same condition across the runs or the two versions of a pseudoword,
+so each run keeps its number of trials per condition and its complementary items. Swaps which would present a
+condition three times in a row are rejected. In every step a batch of random swaps is scored at once (the change
+of the objective only depends on the counts of the cells the swap moves between) and the best improving swap is
+applied. Independent starts (--starts) run in parallel and the best cohort is written. Every worker process builds
+the tables of its own sampler, so the default number of workers (and of starts) is the number of CPUs limited by the
+available memory (see StimulusLists.getWorkerCount).
+
+The lists are written to stim_lists/<participant>_<session>_stim_SemanticIntegration.csv like by
+GenerateStimulusLists.py. Existing lists are kept unless --overwrite is specified (then no lists are written if
+any of them exists). The objective of the best start is reported over time (--curve writes the curves of all starts).
+
+Usage: python OptimizeStimulusLists.py --participants N [--first 1] [--session 001] [--bins 10] [--time 10]
+                                       [--starts N] [--workers N] [--seed 0] [--curve curve.tsv] [--overwrite]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import StimulusLists
+from ValidateStimulusLists import PSEUDOWORD
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+
+# weights of the stimulus x position, condition x position and pseudoword version terms of the objective
+WEIGHTS = (1.0, 1.0, 1.0)
+
+# sampler of each worker process, reused for all its starts (the sampler caches its tables, about 0.3 GB per worker)
+sampler = StimulusLists.getSequenceSampler()
+
+
+class CohortDesign:
+    """
+    Stimuli lists of a cohort (one list per participant, each a permutation of the same stimuli) with the counts
+    of the imbalance objective, which are updated incrementally when two trials of a list are swapped.
+    """
+
+    def __init__(self, lists, bins=10, maxRun=2, weights=WEIGHTS):
+        """
+        Parameters
+        ----------
+        lists : list of list of str
+            wavefiles of each list (both runs), all lists have to contain the same wavefiles
+        bins : int
+            number of position bins of the stimulus x position term, should be even so the bins do not cross the
+            boundary between the runs (default: 10)
+        maxRun : int
+            maximum number of consecutive trials of the same condition (default: 2)
+        weights : tuple of double
+            weights of the stimulus x position, condition x position and pseudoword version terms
+        """
+        self.stimuli = sorted(set(lists[0]))
+        index = dict((s, i) for i, s in enumerate(self.stimuli))
+        self.sequences = np.array([[index[s] for s in l] for l in lists], dtype=np.int64)
+        if any(sorted(l) != sorted(self.stimuli) for l in lists) or self.sequences.shape[1] != len(self.stimuli):
+            raise ValueError('All lists have to present each stimulus exactly once')
+        self.numLists, self.length = self.sequences.shape
+        self.half = self.length // 2
+        self.bins = bins
+        self.maxRun = maxRun
+        self.weights = weights
+
+        # attributes of the stimuli: condition, version (a/b) of pseudowords and the other version of the same item
+        self.conditions = np.array([StimulusLists.CONDITIONS.index(StimulusLists.getCondition(s)) for s in self.stimuli])
+        self.pseudo = self.conditions == StimulusLists.CONDITIONS.index('pseudo')
+        self.versionA = np.zeros(len(self.stimuli), dtype=bool)
+        self.pair = np.full(len(self.stimuli), -1)
+        self.item = np.full(len(self.stimuli), -1)
+        items = {}
+        for i, s in enumerate(self.stimuli):
+            match = PSEUDOWORD.match(s)
+            if match:
+                items.setdefault(match.group(1), {})[match.group(2)] = i
+        for number, (item, versions) in enumerate(sorted(items.items())):
+            if len(versions) == 2:
+                self.pair[versions['a']] = versions['b']
+                self.pair[versions['b']] = versions['a']
+                self.versionA[versions['a']] = True
+                self.item[versions['a']] = number
+                self.item[versions['b']] = number
+        self.numItems = len(items)
+
+        self.positions = np.empty_like(self.sequences)
+        rows = np.arange(self.numLists)[:, None]
+        self.positions[rows, self.sequences] = np.arange(self.length)
+        self.binOf = np.arange(self.length) * bins // self.length
+        self.runOf = (np.arange(self.length) >= self.half).astype(int)
+
+        # expected counts: each stimulus numLists/bins times per bin, each condition in proportion to its trials
+        # in the run at each position, the a version of each pseudoword in run 1 in half of the lists
+        self.positionTarget = self.numLists / bins
+        runCounts = np.array([np.bincount(self.conditions[self.sequences[0, r * self.half:(r + 1) * self.half]],
+                                          minlength=len(StimulusLists.CONDITIONS)) for r in (0, 1)])
+        self.conditionTarget = self.numLists * runCounts[self.runOf].T / self.half
+        self.versionTarget = self.numLists / 2
+        self.scales = (weights[0] / (len(self.stimuli) * bins), weights[1] / (len(StimulusLists.CONDITIONS) * self.length),
+                       weights[2] / max(1, self.numItems))
+        self.count()
+
+    def count(self):
+        """
+        Count the stimuli per position bin, the conditions per position and the a versions in run 1 of all lists.
+        """
+        self.positionCounts = np.zeros((len(self.stimuli), self.bins), dtype=np.int64)
+        np.add.at(self.positionCounts, (self.sequences, self.binOf[None, :]), 1)
+        self.conditionCounts = np.zeros((len(StimulusLists.CONDITIONS), self.length), dtype=np.int64)
+        np.add.at(self.conditionCounts, (self.conditions[self.sequences], np.arange(self.length)[None, :]), 1)
+        first = self.sequences[:, 0:self.half]
+        first = first[self.versionA[first]]
+        self.versionCounts = np.bincount(self.item[first], minlength=self.numItems)
+
+    def getTerms(self):
+        """
+        Return the stimulus x position, condition x position and pseudoword version terms of the objective (mean
+        squared deviations from the expected counts, not weighted).
+        """
+        return (np.mean((self.positionCounts - self.positionTarget) ** 2),
+                np.mean((self.conditionCounts - self.conditionTarget) ** 2),
+                np.mean((self.versionCounts - self.versionTarget) ** 2) if self.numItems else 0.0)
+
+    def getObjective(self):
+        return sum(w * t for w, t in zip(self.weights, self.getTerms()))
+
+    def getLowerBound(self):
+        """
+        Return a lower bound of the objective: integer counts deviate from a fractional expected value T by at least
+        frac(T) * (1 - frac(T)) in the mean.
+        """
+        bound = 0.0
+        for weight, target in zip(self.weights, (self.positionTarget, self.conditionTarget, self.versionTarget)):
+            fraction = np.asarray(target) - np.floor(target)
+            bound = bound + weight * np.mean(fraction * (1 - fraction))
+        return bound
+
+    def getCandidates(self, rng, size):
+        """
+        Draw random swaps (list, position, position), a tenth of the swaps of pseudowords exchange its versions.
+        """
+        lists = rng.integers(self.numLists, size=size)
+        p = rng.integers(self.length, size=size)
+        q = rng.integers(self.length, size=size)
+        s = self.sequences[lists, p]
+        flip = self.pseudo[s] & (rng.random(size) < 0.1)
+        q[flip] = self.positions[lists[flip], self.pair[s[flip]]]
+        return lists, p, q
+
+    def getDeltas(self, lists, p, q):
+        """
+        Return the change of the objective for each swap (inf for invalid swaps).
+        """
+        s = self.sequences[lists, p]
+        t = self.sequences[lists, q]
+        cs = self.conditions[s]
+        ct = self.conditions[t]
+        pairs = self.pair[s] == t
+        valid = (p != q) & ((self.runOf[p] == self.runOf[q]) | ((cs == ct) & ~self.pseudo[s]) | pairs)
+        valid &= ~self.hasLongRun(lists, p, q, ct, cs) & ~self.hasLongRun(lists, q, p, cs, ct)
+
+        # moving one count from cell x to cell y changes the sum of squares by 2 * (y - x) + 2 (distinct cells)
+        bp = self.binOf[p]
+        bq = self.binOf[q]
+        c = self.positionCounts - self.positionTarget
+        delta = self.scales[0] * np.where(bp != bq, 2 * (c[s, bq] - c[s, bp] + c[t, bp] - c[t, bq]) + 4, 0)
+        c = self.conditionCounts - self.conditionTarget
+        delta += self.scales[1] * np.where(cs != ct, 2 * (c[cs, q] - c[cs, p] + c[ct, p] - c[ct, q]) + 4, 0)
+        if self.numItems:
+            # swapping the versions of a pseudoword moves its a version into or out of run 1
+            c = self.versionCounts[self.item[s]] - self.versionTarget
+            aFirst = np.where(self.versionA[s], p < self.half, q < self.half)
+            delta += self.scales[2] * np.where(pairs, np.where(aFirst, -2 * c + 1, 2 * c + 1), 0)
+        return np.where(valid, delta, np.inf)
+
+    def hasLongRun(self, lists, p, q, cp, cq):
+        """
+        Check whether a condition occurs more than maxRun times in a row around position p after the swap of
+        p (new condition cp) and q (new condition cq).
+        """
+        offsets = np.arange(-self.maxRun, self.maxRun + 1)
+        indices = p[:, None] + offsets[None, :]
+        inside = (indices >= 0) & (indices < self.length)
+        values = self.conditions[self.sequences[lists[:, None], np.clip(indices, 0, self.length - 1)]]
+        values = np.where(indices == p[:, None], cp[:, None], values)
+        values = np.where(indices == q[:, None], cq[:, None], values)
+        values = np.where(inside, values, -1 - np.arange(len(offsets))[None, :])  # distinct outside the list
+        same = np.ones((len(p), self.maxRun + 1), dtype=bool)
+        for k in range(1, self.maxRun + 1):
+            same &= values[:, k:k + self.maxRun + 1] == values[:, 0:self.maxRun + 1]
+        return np.any(same, axis=1)
+
+    def swap(self, k, p, q):
+        """
+        Swap the trials at positions p and q of list k and update the counts.
+        """
+        s = self.sequences[k, p]
+        t = self.sequences[k, q]
+        for stimulus, old, new in ((s, p, q), (t, q, p)):
+            self.positionCounts[stimulus, self.binOf[old]] -= 1
+            self.positionCounts[stimulus, self.binOf[new]] += 1
+            self.conditionCounts[self.conditions[stimulus], old] -= 1
+            self.conditionCounts[self.conditions[stimulus], new] += 1
+            if self.versionA[stimulus] and (old < self.half) != (new < self.half):
+                self.versionCounts[self.item[stimulus]] += 1 if new < self.half else -1
+        self.sequences[k, p] = t
+        self.sequences[k, q] = s
+        self.positions[k, s] = q
+        self.positions[k, t] = p
+
+    def search(self, duration, rng, batch=256, onImprove=None):
+        """
+        Improve the lists by local search for the specified time in seconds: score a batch of random swaps and
+        apply the best one if it decreases the objective. The search stops early at the lower bound.
+
+        Parameters
+        ----------
+        duration : double
+            time in seconds
+        rng : numpy.random.Generator
+            random number generator
+        batch : int
+            number of swaps scored per step (default: 256)
+        onImprove : callable
+            function called with the objective after every applied swap (default: None)
+
+        Returns
+        -------
+        the number of steps and of applied swaps
+        """
+        objective = self.getObjective()
+        bound = self.getLowerBound() + 1e-9
+        deadline = time.perf_counter() + duration
+        steps = 0
+        swaps = 0
+        while time.perf_counter() < deadline and objective > bound:
+            lists, p, q = self.getCandidates(rng, batch)
+            deltas = self.getDeltas(lists, p, q)
+            best = int(np.argmin(deltas))
+            steps = steps + 1
+            if deltas[best] < -1e-12:
+                self.swap(lists[best], p[best], q[best])
+                objective = objective + deltas[best]
+                swaps = swaps + 1
+                if onImprove is not None:
+                    onImprove(objective)
+        return steps, swaps
+
+    def getLists(self):
+        return [[self.stimuli[s] for s in row] for row in self.sequences]
+
+
+def optimize(job):
+    """
+    Run one start of the optimizer: draw the lists of the cohort and improve them by local search.
+
+    Parameters
+    ----------
+    job : tuple
+        (start, number of lists, seed, bins, duration in seconds)
+
+    Returns
+    -------
+    the lists, the terms of the objective before and after the search, the curve of the objective
+    (list of (time, objective)) and the number of steps and applied swaps
+    """
+    start, numLists, seed, bins, duration = job
+    responseTimesFile = os.path.join(_thisDir, 'responseTimes.csv')
+    lists = []
+    for k in range(numLists):
+        rng = np.random.default_rng([seed, start, k])
+        lists.append(StimulusLists.generateStimulusList(responseTimesFile, sampler, rng)[0])
+    design = CohortDesign(lists, bins)
+    initial = design.getTerms()
+
+    origin = time.perf_counter()
+    curve = [(0.0, design.getObjective())]
+    def record(objective):
+        now = time.perf_counter() - origin
+        if now - curve[-1][0] >= 0.01:
+            curve.append((now, objective))
+    steps, swaps = design.search(duration, np.random.default_rng([seed, start, numLists]), onImprove=record)
+    curve.append((time.perf_counter() - origin, design.getObjective()))
+
+    lists = design.getLists()
+    if not all(sampler.check([StimulusLists.getCondition(f) for f in l]) for l in lists):
+        raise ValueError('Start %d: a list presents a condition three times in a row' % start)
+    return lists, initial, design.getTerms(), curve, steps, swaps
+
+
+def formatTerms(terms):
+    return 'stimulus x position %.4f, condition x position %.4f, pseudoword versions %.4f, objective %.4f' % (
+        terms[0], terms[1], terms[2], sum(w * t for w, t in zip(WEIGHTS, terms)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate counterbalanced stimuli lists of a cohort of participants')
+    parser.add_argument('--participants', type=int, required=True, help='number of participants (lists)')
+    parser.add_argument('--first', type=int, default=1, help='ID of the first participant (default: 1)')
+    parser.add_argument('--session', default='001', help='session of the lists (default: 001)')
+    parser.add_argument('--bins', type=int, default=10, help='number of position bins over both runs (default: 10)')
+    parser.add_argument('--time', type=float, default=10, help='search time of each start in seconds (default: 10)')
+    parser.add_argument('--starts', type=int, default=None, help='number of independent starts (default: number of workers)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs, limited by the available memory)')
+    parser.add_argument('--seed', type=int, default=0, help='base seed of the cohort (default: 0)')
+    parser.add_argument('--curve', default=None, help='write the objective over time of all starts to this tsv file')
+    parser.add_argument('--overwrite', action='store_true', help='replace existing lists')
+    args = parser.parse_args()
+
+    participants = [str(p) for p in range(args.first, args.first + args.participants)]
+    filenames = [StimulusLists.getStimListPath(_thisDir, p, args.session) for p in participants]
+    existing = [f for f in filenames if os.path.exists(f)]
+    if existing and not args.overwrite:
+        print('%d of the lists already exist, use --overwrite to replace them' % len(existing))
+        return
+
+    workers = StimulusLists.getWorkerCount(args.workers)
+    starts = args.starts or workers
+    start = time.perf_counter()
+    jobs = [(s, args.participants, args.seed, args.bins, args.time) for s in range(starts)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(optimize, jobs))
+    duration = time.perf_counter() - start
+
+    objectives = [r[3][-1][1] for r in results]
+    best = int(np.argmin(objectives))
+    lists, initial, final, curve, steps, swaps = results[best]
+    for s, r in enumerate(results):
+        print('start %d: objective %.4f -> %.4f, %d steps, %d swaps' % (s, r[3][0][1], r[3][-1][1], r[4], r[5]))
+    print('best start %d' % best)
+    print('  initial: %s' % formatTerms(initial))
+    print('  final:   %s' % formatTerms(final))
+    print('  lower bound of the objective %.4f' % CohortDesign(lists, args.bins).getLowerBound())
+    print('objective over time (best start):')
+    marks = np.searchsorted([t for t, o in curve], np.linspace(0, curve[-1][0], 11), side='right') - 1
+    for i in sorted(set(marks)):
+        print('  %7.2f s  %.4f' % curve[i])
+    if args.curve:
+        with open(args.curve, 'w') as f:
+            f.write('start\ttime\tobjective\n')
+            for s, r in enumerate(results):
+                for t, o in r[3]:
+                    f.write('%d\t%.4f\t%.6f\n' % (s, t, o))
+
+    os.makedirs(os.path.join(_thisDir, 'stim_lists'), exist_ok=True)
+    responseTimesFile = os.path.join(_thisDir, 'responseTimes.csv')
+    for filename, stimuli in zip(filenames, lists):
+        StimulusLists.writeStimulusList(filename, stimuli, StimulusLists.getResponseTimeList(stimuli, responseTimesFile))
+    print('%d lists written, %d starts, %.2f s' % (len(lists), starts, duration))
+
+
+if __name__ == '__main__':
+    main()
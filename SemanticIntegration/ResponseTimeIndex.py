@@ -0,0 +1,137 @@
+import os
+
+
+class ResponseTimeIndex:
+    """
+    Response time (in ms) of each wavefile, read from a csv-file with wavefile in the first and response time
+    in the second column (responseTimes.csv).
+
+    The file is read once into a dictionary keyed by wavefile and only re-read when its modification time
+    (or size) changes, so lookups for whole stimuli lists cost one dictionary access per stimulus.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            csv-file to read (either absolute path or relative to the current directory)
+        """
+        self.filename = filename
+        self.stamp = None
+        self.times = {}
+
+    def load(self):
+        """
+        (Re-)read the file if it changed since it was last read.
+        """
+        stat = os.stat(self.filename)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return
+
+        times = {}
+        with open(self.filename, newline='') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                tokens = line.split(';')
+                if len(tokens) < 2:
+                    raise ValueError('%s, line %d: expected "wavefile;response time", got "%s"' % (self.filename, number, line))
+                times[tokens[0]] = int(tokens[1])
+        self.times = times
+        self.stamp = stamp
+
+    def lookup(self, stimFiles):
+        """
+        Return the response times of the specified wavefiles.
+
+        Parameters
+        ----------
+        stimFiles : list of str
+            wavefiles
+
+        Returns
+        -------
+        list of int
+            response times in ms
+
+        Raises
+        ------
+        KeyError
+            if any of the wavefiles is not listed (the error lists all missing wavefiles)
+        """
+        self.load()
+        try:
+            return [self.times[stim] for stim in stimFiles]
+        except KeyError:
+            missing = self.getMissing(stimFiles)
+            raise KeyError('%d stimuli have no response time in %s: %s' % (len(missing), self.filename, ', '.join(missing))) from None
+
+    def getMissing(self, stimFiles):
+        """
+        Return the wavefiles (each once, in order of first occurrence) which are not listed.
+
+        Parameters
+        ----------
+        stimFiles : list of str
+            wavefiles
+        """
+        self.load()
+        missing = []
+        seen = set()
+        for stim in stimFiles:
+            if stim not in self.times and stim not in seen:
+                missing.append(stim)
+                seen.add(stim)
+        return missing
+
+    def getTotal(self, stimFiles):
+        """
+        Return the total response window in seconds of the specified wavefiles (e.g. of a run).
+
+        Parameters
+        ----------
+        stimFiles : list of str
+            wavefiles
+        """
+        return sum(self.lookup(stimFiles)) / 1000
+
+    def getTotals(self, stimLists):
+        """
+        Return the total response window in seconds of each of the specified stimuli lists.
+
+        Parameters
+        ----------
+        stimLists : list of lists of str
+            wavefiles of each list
+        """
+        return [self.getTotal(stimFiles) for stimFiles in stimLists]
+
+    def __len__(self):
+        self.load()
+        return len(self.times)
+
+    def __contains__(self, stim):
+        self.load()
+        return stim in self.times
+
+
+# indices of all files read so far, by absolute path
+_indices = {}
+
+
+def getResponseTimeIndex(filename):
+    """
+    Return the shared index of the specified file (created on first use).
+
+    Parameters
+    ----------
+    filename : str
+        csv-file with the response time of each wavefile (responseTimes.csv)
+    """
+    key = os.path.abspath(filename)
+    if key not in _indices:
+        _indices[key] = ResponseTimeIndex(key)
+    return _indices[key]
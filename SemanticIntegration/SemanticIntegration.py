@@ -1,27 +1,26 @@
 from __future__ import absolute_import, division
 
-from psychopy import locale_setup
-from psychopy import prefs
-from psychopy import gui, visual, core, data, event, logging, clock
-from psychopy.constants import (NOT_STARTED, STARTED, PLAYING, PAUSED,
-                                STOPPED, FINISHED, PRESSED, RELEASED, FOREVER)
-
 import numpy as np  # whole numpy lib is available, prepend 'np.'
-from numpy import (sin, cos, tan, log, log10, pi, average,
-                   sqrt, std, deg2rad, rad2deg, linspace, asarray)
-from numpy.random import random, randint, normal, shuffle
 import os  # handy system and path functions
 import sys  # to get file system encoding
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from AudioCache import AudioCache, loadSound
+from Triggers import TriggerScheduler, openTriggerPort
+from Timing import waitUntil
+from WavManifest import WavManifest
+from StimulusBank import StimulusBank
+from TrialJournal import TrialJournal
+from FrameProfiler import FrameProfiler
+from ResponseCollector import ResponseCollector, getSoundOnset
+from Timeline import Timeline
+from ScannerPulses import ScannerPulseReader, openScannerPort
+from TriggerPlan import TriggerPlan
+from RunCheckpoint import RunCheckpoint, readCheckpoint, getListHash
+from PsychopyImport import importPsychopy
+import StimulusLists
 
-from psychopy import prefs
-prefs.hardware['audioLib'] = ['PTB']
-from psychopy import sound
-
-from psychopy.hardware import keyboard
-import serial
-from psychopy import parallel
-
-import csv
 
 MODE_EXP = 1
 MODE_DEV = 2
@@ -33,20 +32,39 @@ TRIGGER_EXPECTED = 32
 TRIGGER_PSEUDOWORD = 16
 TRIGGER_UNEXPECTED = 8
 
+CONDITION_TRIGGERS = {'anomalous': TRIGGER_ANOMALOUS, 'expected': TRIGGER_EXPECTED, 'pseudoword': TRIGGER_PSEUDOWORD, 'unexpected': TRIGGER_UNEXPECTED}
+
+# fields of the trial records (data file and journal)
+TRIAL_FIELDS = ['wavfile', 'wav.duration', 'response', 'rt', 'rt.event', 'rt.offset', 'presses', 'wav.started', 'startTime', 'startTimeGlobal', 'endTime', 'responseTime']
+
 class Experiment:
     
     def __init__(self):
         """
         Constructor which sets up a number of general attributes and defaults.
         """
+        importPsychopy(globals())
         self.pauseClock = core.Clock()        
         self.psychopyVersion = '3.2.4'
         self.globalClock = core.Clock()  # to track the time since experiment started
         self.routineTimer = core.CountdownTimer()
         self.defaultKeyboard = keyboard.Keyboard()
         self.frameTolerance = 0.001 
+        self.spinWindow = 0.002  # final part of a wait (in seconds) which is busy-waited instead of slept
+        self.pollInterval = 0.02  # maximum interval (in seconds) between two checks for the escape key while waiting
         self.endExpNow = False
-        #self.serialPort = 'COM1'
+        self.scannerBackend = None  # scanner pulses: None (no synchronization), 'serial' (pyserial), 'tty' (POSIX device) or 'simulated' (see Utils/ScannerPulses.py)
+        self.scannerPort = 'COM1'  # serial port or device of the scanner pulses
+        self.scannerTR = 2.0  # TR in seconds of the 'simulated' scanner
+        self.scannerPulse = 1  # the run starts with this scanner pulse after the instructions (e.g. 1 + number of dummy scans)
+        self.syncTrials = False  # 'frame' playback with scanner: every trial starts with the next scanner pulse
+        self.itemTriggers = False  # send the item number of every trial as second trigger pulse (see Utils/TriggerPlan.py)
+        self.triggerBackend = 'parallel'  # 'parallel' (PsychoPy), 'parport' (Linux /dev/parport0) or 'simulated'
+        self.audioCache = AudioCache(maxBytes=1024 * 1024 * 1024)  # decoded sounds of the current run
+        self.sequenceSampler = StimulusLists.getSequenceSampler()
+        self.profileFrames = False  # record the timing of the frame loops and write a report (see Utils/FrameProfiler.py)
+        self.playback = 'frame'  # 'frame' (frame loop per trial) or 'timeline' (run precompiled into scheduled events, see Utils/Timeline.py)
+        self.scheduleLead = 0.1  # time in seconds between scheduling a sound of the 'timeline' playback and its onset
     
     def start(self):
         self.setup()
@@ -54,6 +72,7 @@ class Experiment:
         run = int(self.expInfo['run'])
         mode = self.expInfo['mode']
         stimList = self.expInfo['list']
+        list = stimList
         if stimList == 'generate':
             list = ''
 
@@ -61,8 +80,13 @@ class Experiment:
             self.startTraining()
         elif mode == 'experiment':
             self.startExperiment(list, run)
+        elif mode == 'resume':
+            if self.resumeState is None:
+                print('No interrupted run to resume for participant %s, session %s, run %d' % (self.expInfo['participant'], self.expInfo['session'], run))
+                return
+            self.startExperiment(self.resumeState['info']['list'], run)
         else:
-            print('Unknown mode. Use either "training" or "experiment"')
+            print('Unknown mode. Use either "training", "experiment" or "resume"')
 
 
         
@@ -77,24 +101,30 @@ class Experiment:
             The respective file should reside in the folder of the python file. Wav-files should be stored in a subfolder "wav" without further subdirectories.
             If stimuli_list is empty, a reandomized list will be generated or used if it is already present. These lists are created for each
             participant and session and are stored in the subfolder 'stim_lists'
+
+        In the 'resume' mode, the run continues with the trial after the last one completed by the interrupted run
+        (see setup and Utils/RunCheckpoint.py), without the instructions.
         """
         if not stimuli_list:
             filenames, responseTimes = self.generateOrReadStimulusList(run)
         else:
             filenames, responseTimes = self.readStimulusList(stimuli_list)
+        self.reportRunDuration(filenames, responseTimes)
+        start = self.startCheckpoint(stimuli_list, run, filenames)
 
+        self.preloadSounds(['wav' + os.sep + 'Instruktionen.wav'] + ['wav' + os.sep + f for f in filenames])
         self.setupTriggers()       
-        self.waitForButton(-1, ['space'], 'Press space to start')  
-        self.fixation.autoDraw = True
-        self.presentSound('wav' + os.sep + 'Instruktionen.wav')
-        self.fixation.autoDraw = False
+        self.setupScanner()
+        if start == 0:
+            self.waitForButton(-1, ['space'], 'Press space to start')  
+            self.fixation.autoDraw = True
+            self.presentSound('wav' + os.sep + 'Instruktionen.wav')
+            self.fixation.autoDraw = False
         self.waitForButton(-1, ['space'], 'Press space to start') 
         self.fixation.autoDraw = True
         self.wait(1)
-        for n in range(0, len(filenames)):
-            path = 'wav' + os.sep + filenames[n]
-            condition = filenames[n].split('_')
-            self.presentSound(path, responseTime=responseTimes[n]/1000, condition = condition[0])
+        self.presentTrials(filenames, responseTimes, start)
+        self.checkpoint.finish()
         self.finish()
 
     def startTraining(self):
@@ -102,7 +132,10 @@ class Experiment:
         Start a training run which always uses the standard training stimuli list: stimuli_list_training.csv
         """
         filenames, responseTimes = self.readStimulusList('stimuli_list_training.csv')
+        self.reportRunDuration(filenames, responseTimes)
+        self.preloadSounds(['wav' + os.sep + 'Instruktionen.wav'] + ['wav' + os.sep + f for f in filenames])
         self.setupTriggers()
+        self.setupScanner()
         self.waitForButton(-1, ['space'], 'Press space to start')
         self.fixation.autoDraw = True
         self.presentSound('wav' + os.sep +'Instruktionen.wav')
@@ -110,10 +143,7 @@ class Experiment:
         self.waitForButton(-1, ['space'], 'Press space to continue')
         self.fixation.autoDraw = True
         self.wait(1)
-        for n in range(0, len(filenames)):
-            path = 'wav' + os.sep + filenames[n]
-            condition = filenames[n].split('_')
-            self.presentSound(path, responseTime=responseTimes[n]/1000, condition = condition[0])
+        self.presentTrials(filenames, responseTimes)
         self.finish()
 
     def setup(self):
@@ -122,8 +152,9 @@ class Experiment:
         """
         self._thisDir = os.path.dirname(os.path.abspath(__file__))
         os.chdir(self._thisDir)
+        self.setupStimulusBank()
         expName = 'SemanticIntegration'  # from the Builder filename that created this script
-        expInfo = {'mode': 'experiment', 'participant': '', 'session': '001', 'run': '1', 'list': 'generate', 'screen': '0', 'Send triggers': 'yes'}
+        expInfo = {'mode': ['experiment', 'training', 'resume'], 'participant': '', 'session': '001', 'run': '1', 'list': 'generate', 'screen': '0', 'Send triggers': 'yes', 'playback': ['frame', 'timeline']}
         dlg = gui.DlgFromDict(dictionary=expInfo, sortKeys=False, title=expName)
         if dlg.OK == False:
             core.quit()  # user pressed cancel
@@ -131,6 +162,16 @@ class Experiment:
         expInfo['expName'] = expName
         expInfo['psychopyVersion'] = self.psychopyVersion
         filename = self._thisDir + os.sep + u'data/%s_%s_%s_%s' % (expInfo['participant'], expName, expInfo['run'], expInfo['date'])
+        self.expName = expName
+        self.checkpoint = None
+        self.resumeState = None
+        if expInfo['mode'] == 'resume':
+            state = readCheckpoint(self.getCheckpointFile(expInfo, int(expInfo['run'])))
+            if state is not None and not state['finished']:
+                # the resumed run is merged into the data files (log, journal, data file) of the interrupted run
+                self.resumeState = state
+                filename = state['info']['dataFile']
+                expInfo['playback'] = state['info']['playback']
         self.thisExp = data.ExperimentHandler(name=expName, version='',
             extraInfo=expInfo, runtimeInfo=None,
             originPath=self._thisDir + os.sep + 'SemanticIntegration.py',
@@ -138,8 +179,10 @@ class Experiment:
             dataFileName=filename)
         self.logFile = logging.LogFile(filename+'.log', level=logging.EXP)
         logging.console.setLevel(logging.WARNING) 
-
-        #self.serial = serial.Serial(self.serialPort, 19200, timeout=1)
+        # trial records are written to the journal while the run is going on, so a crashed run can be recovered
+        self.dataFileName = filename
+        self.journal = TrialJournal(filename + '_trials.csv', TRIAL_FIELDS,
+            log=lambda msg, t: logging.log(level = logging.EXP, msg = msg, t = t)).start()
 
         self.win = visual.Window(
             size=(1024, 768), fullscr=False, screen=int(expInfo['screen']), 
@@ -147,6 +190,7 @@ class Experiment:
             monitor='testMonitor', color='black', colorSpace='rgb',
             blendMode='avg', useFBO=True, 
             units='height')
+        self.profiler = FrameProfiler(enabled=self.profileFrames, framePeriod=self.win.monitorFramePeriod or 1 / 60)
 
         # fixation cross
         self.fixation = visual.TextStim(win=self.win, name='fixation',
@@ -167,7 +211,7 @@ class Experiment:
             depth=0.0)
             
         self.expInfo = expInfo
-        self.expName = expName
+        self.playback = expInfo['playback']
             
         if expInfo['Send triggers'] == "yes":
             self.mode = MODE_EXP
@@ -175,17 +219,94 @@ class Experiment:
             self.mode = MODE_DEV
             
     def setupTriggers(self):
+        """
+        Set up the trigger port and the scheduler which resets trigger pulses after 100ms.
+        Without triggers (development mode), an in-memory port is used which only records the pulses.
+        """
         if self.mode == MODE_EXP:
-            self.port = parallel.ParallelPort(address=0x0378)
-            self.port.setData(0)        
+            port = openTriggerPort(self.triggerBackend, address=0x0378)
+        else:
+            port = openTriggerPort('simulated')
+        clock = time.perf_counter
+        if self.playback == 'timeline':
+            import psychtoolbox as ptb
+            clock = ptb.GetSecs  # same time base as the audio scheduling
+        self.triggers = TriggerScheduler(port, pulseWidth=0.1, clock=clock)
+        self.triggers.start()
+
+    def setupScanner(self):
+        """
+        Start the reader thread of the scanner pulses (see Utils/ScannerPulses.py) if the run is synchronized to the
+        scanner. The pulses are timestamped with the clock of the trigger scheduler.
+        """
+        self.scanner = None
+        self.fakeScanner = None
+        if self.scannerBackend is None:
+            return
+        port, self.fakeScanner = openScannerPort(self.scannerBackend, self.scannerPort, tr=self.scannerTR)
+        self.scanner = ScannerPulseReader(port, clock=self.triggers.clock).start()
 
     def finish(self):
         """
         Clean up the experiment (close serial port, etc.).
         Output files (data, logs, etc.) are automatically handled by PsychoPy (ExperimentHandler)
         """
-        #self.serial.close()
-       
+        if self.scanner is not None:
+            self.scanner.stop()
+            if self.fakeScanner is not None:
+                self.fakeScanner.stop()
+            logging.log(level = logging.EXP, msg = self.scanner.summary())
+        self.triggers.stop()
+        self.journal.stop()
+        logging.log(level = logging.EXP, msg = self.triggers.summary())
+        logging.log(level = logging.EXP, msg = self.audioCache.summary())
+        if self.profiler.enabled:
+            self.profiler.addTriggerLog('presentSound', self.triggers.log)
+            self.profiler.save(self.dataFileName)
+            logging.log(level = logging.EXP, msg = self.profiler.summary())
+
+    def reportRunDuration(self, filenames, responseTimes):
+        """
+        Log the duration of the trials of a run, computed from the wav headers (see Utils/WavManifest.py)
+        before any sound is decoded.
+
+        Parameters
+        ----------
+        filenames : list of str
+            wavefiles of the run
+        responseTimes : list of int
+            response times in ms
+        """
+        manifest = WavManifest(os.path.join(self._thisDir, 'wav'))
+        manifest.update()
+        logging.log(level = logging.EXP, msg = manifest.summary())
+        duration = StimulusLists.getRunDuration(filenames, responseTimes, manifest)
+        logging.log(level = logging.EXP, msg = 'Run duration\t%d trials\t%.3f' % (len(filenames), duration))
+
+    def setupStimulusBank(self):
+        """
+        Load the sounds from the prebaked stimulus bank (resampled, stereo and with ramps, see Utils/StimulusBank.py)
+        if it has been created. Files which are not in the bank are decoded as usual.
+        """
+        bank = StimulusBank(os.path.join(self._thisDir, '..', 'stimulus_bank'))
+        if bank.exists():
+            self.audioCache.loader = bank.getLoader(loadSound)
+
+    def preloadSounds(self, wavfiles):
+        """
+        Decode all wav files of a run into the audio cache, so that no file has to be opened,
+        decoded or resampled right before the onset of a trial.
+
+        Parameters
+        ----------
+        wavfiles : list of str
+            wave files to load (either absolute path or relative to the folder of the python file)
+        """
+        duration = self.audioCache.preload(wavfiles)
+        for wavfile, decodeTime in self.audioCache.decodeTimes.items():
+            logging.log(level = logging.EXP, msg = 'Decoded\t%.4f\t%s' % (decodeTime, wavfile))
+        logging.log(level = logging.EXP, msg = 'Preloaded %d sounds in %.3f s' % (len(self.audioCache), duration))
+        logging.log(level = logging.EXP, msg = self.audioCache.summary())
 
     def readStimulusList(self, filename):
         """
@@ -196,37 +317,16 @@ class Experiment:
         filename : str
             file to read (either absolute path or relative to the folder of the python file)
         """
-        filenames = []
-        responseTimes = []
-        with open(filename, newline='') as csvfile:
-            reader = csv.reader(csvfile, dialect='excel')
-            for row in reader:
-                tokens = row[0].split(';')
-                filenames.append(tokens[0])
-                responseTimes.append(int(tokens[1]))
-
-        return filenames, responseTimes
+        return StimulusLists.readStimulusList(filename)
     
     def getResponseTimeList(self, stimFiles):
-        filename = self._thisDir + os.sep + u'responseTimes.csv'
-        filenames, responseTimes = self.readStimulusList(filename)
-
-        times = []
-        for n in range(0, len(stimFiles)):
-            stim = stimFiles[n]
-            index = filenames.index(stim)
-            times.append(responseTimes[index])
-
-        return times
+        return StimulusLists.getResponseTimeList(stimFiles, os.path.join(self._thisDir, 'responseTimes.csv'))
     
     def writeStimulusList(self, filename, stimuli, responseTimes):
-        with open(filename, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=';', dialect='excel')
-            for i in range(0, len(stimuli)):
-                writer.writerow([stimuli[i], responseTimes[i]])
+        StimulusLists.writeStimulusList(filename, stimuli, responseTimes)
 
     def generateOrReadStimulusList(self, run):
-        stimFile = self._thisDir + os.sep + u'stim_lists\\%s_%s_stim_%s.csv' % (self.expInfo['participant'], self.expInfo['session'], self.expName)
+        stimFile = StimulusLists.getStimListPath(self._thisDir, self.expInfo['participant'], self.expInfo['session'], self.expName)
 
         filenames = []
         responseTimes = []
@@ -239,134 +339,31 @@ class Experiment:
             self.writeStimulusList(stimFile, filenames, responseTimes)
 
         # Select the half corresponding to run 1 or 2
-        center = int(len(filenames)/2)
-        length = len(filenames)
-        if run == 1:
-            filenames = filenames[0:center]
-            responseTimes = responseTimes[0:center]
-        else:
-            filenames = filenames[center:length]
-            responseTimes = responseTimes[center:length]
-
-        return filenames, responseTimes
+        return StimulusLists.selectRun(filenames, responseTimes, run)
     
     def generateStimulusList(self):
-        sequenceA = []
-        sequenceB = []
-        
-        expectedA = []
-        expectedB = []
-        inds = list(range(1, 61))
-        np.random.shuffle(inds)
-        for i in range(0, 30):
-            expectedA.append('expected_' + str(inds[i]) + '.wav')
-            sequenceA.append('exp')
-        for i in range(30, 60):
-            expectedB.append('expected_' + str(inds[i]) + '.wav')
-            sequenceB.append('exp')
-        
-        anomalousA = []
-        anomalousB = []
-        inds = list(range(1, 61))
-        np.random.shuffle(inds)
-        for i in range(0, 30):
-            anomalousA.append('anomalous_' + str(inds[i]) + '.wav')
-            sequenceA.append('an')
-        for i in range(30, 60):
-            anomalousB.append('anomalous_' + str(inds[i]) + '.wav')
-            sequenceB.append('an')
-            
-        unexpectedA = []
-        unexpectedB = []
-        inds = list(range(1, 61))
-        np.random.shuffle(inds)
-        for i in range(0, 30):
-            unexpectedA.append('unexpected_' + str(inds[i]) + '.wav')
-            sequenceA.append('unexp')
-        for i in range(30, 60):
-            unexpectedB.append('unexpected_' + str(inds[i]) + '.wav')
-            sequenceB.append('unexp')
-            
-        pseudowordA = []
-        pseudowordB = []
-        inds = list(range(1, 61))
-        np.random.shuffle(inds)
-        for i in range(0, 60):
-            version = np.random.randint(0, 2)
-            if version == 0:
-                pseudowordA.append('pseudoword_' + str(inds[i]) + 'a.wav')
-                pseudowordB.append('pseudoword_' + str(inds[i]) + 'b.wav')
-            else:
-                pseudowordA.append('pseudoword_' + str(inds[i]) + 'b.wav')
-                pseudowordB.append('pseudoword_' + str(inds[i]) + 'a.wav')
-                
-            sequenceA.append('pseudo')
-            sequenceB.append('pseudo')
-            
-        
-        keepTrying = True
-        while(keepTrying):
-            # shuffle sequence
-            np.random.shuffle(sequenceA)
-            
-            # test sequence
-            ok = self.checkSequence(sequenceA)
-            keepTrying = not ok
-        
-        keepTrying = True
-        while(keepTrying):
-            # shuffle sequence
-            np.random.shuffle(sequenceB)
-            
-            # test sequence
-            ok = self.checkSequence(sequenceB)         
-            keepTrying = not ok
-
-        sequence = []
-        expectedA = iter(expectedA)
-        unexpectedA = iter(unexpectedA)
-        anomalousA = iter(anomalousA)
-        pseudowordA = iter(pseudowordA)
-        for i in range(0, len(sequenceA)):
-            if sequenceA[i] == 'exp':
-                sequence.append(next(expectedA))
-            if sequenceA[i] == 'unexp':
-                sequence.append(next(unexpectedA))
-            if sequenceA[i] == 'an':
-                sequence.append(next(anomalousA))
-            if sequenceA[i] == 'pseudo':
-                sequence.append(next(pseudowordA))
-        
-        expectedB = iter(expectedB)
-        unexpectedB = iter(unexpectedB)
-        anomalousB = iter(anomalousB)
-        pseudowordB = iter(pseudowordB)
-        for i in range(0, len(sequenceB)):
-            if sequenceB[i] == 'exp':
-                sequence.append(next(expectedB))
-            if sequenceB[i] == 'unexp':
-                sequence.append(next(unexpectedB))
-            if sequenceB[i] == 'an':
-                sequence.append(next(anomalousB))
-            if sequenceB[i] == 'pseudo':
-                sequence.append(next(pseudowordB))
-
-        responseTimes = self.getResponseTimeList(sequence)
-        
-        return sequence, responseTimes
+        """
+        Generate a randomized stimuli list for the current participant and session (see StimulusLists.generateStimulusList).
+        """
+        return StimulusLists.generateStimulusList(os.path.join(self._thisDir, 'responseTimes.csv'), self.sequenceSampler)
         
     def checkSequence(self, sequence):
-        ok = True
-        for i in range(2, len(sequence)):
-            if (sequence[i-2] == sequence[i-1]) and (sequence[i-1] == sequence[i]):
-                ok = False
-                break
-        return ok            
+        """
+        Check that no condition occurs three times in a row.
+
+        Parameters
+        ----------
+        sequence : list of str
+            sequence of conditions
+        """
+        return self.sequenceSampler.check(sequence)            
 
-    def presentSound(self, wavfile, responseTime=0, keyList=['1', '2'], condition='none'):
+    def presentSound(self, wavfile, responseTime=0, keyList=['1', '2'], trial=None):
         """
         Play a sound with additional time to wait for a key response. 
-        Response and reaction time relative to the end of the wave file are recorded.
+        The first response key pressed after the end of the wave file is recorded as response. Its reaction time
+        is recorded both when it was polled by the frame loop (rt) and from the timestamp of the key event
+        (rt.event, both relative to the start of the sound, and rt.offset relative to the end of the sound).
         
         Parameters
         ----------
@@ -376,19 +373,25 @@ class Experiment:
             time in seconds to wait for a response after the end of the wave file (default: 0s)
         keyList : list of str
             list of keys to record as response. Only the first key is recorded and the response does not end the trial (default: 1 and 2)
+        trial : int
+            index of the trial in the trigger plan of the run (default: None, no trigger)
         """
         trialClock = core.Clock()
-        wav = sound.Sound(wavfile, secs=-1, stereo=True, hamming=True, name="sound stimulus")
+        wav = self.audioCache.get(wavfile)
         wav.setVolume(1)
         trialDuration = wav.getDuration() + responseTime
-        keyb = keyboard.Keyboard()
+        # response and escape keys are read from the same timestamped event queue
+        collector = ResponseCollector(self.defaultKeyboard, keyList)
+        collector.start()
 
         trialComponents = [wav]    
         self.resetTrialComponents(trialComponents)
 
         response = ''
         rt = -1
-        resetDone = False
+        rtEvent = -1
+        rtOffset = -1
+        playTime = None
 
         # reset timers
         t = 0
@@ -397,9 +400,11 @@ class Experiment:
         trialClock.reset(-_timeToFirstFrame)  # t0 is time of first possible flip
         frameN = -1
         continueRoutine = True
-        triggerActive = False
+        routine = self.profiler.routine('presentSound')
+        routine.begin()
 
         while continueRoutine:
+            routine.tick()
             # get current time
             t = trialClock.getTime()
             tThisFlip = self.win.getFutureFlipTime(clock=trialClock)
@@ -412,43 +417,39 @@ class Experiment:
                 wav.frameNStart = frameN  # exact frame index
                 wav.tStart = t  # local t and not account for scr refresh
                 wav.tStartRefresh = tThisFlipGlobal  # on global time
+                audioStart = self.profiler.clock()
                 wav.play()  # start the sound (it finishes automatically)
+                routine.add('audio.start', audioStart)
+                routine.since('play', audioStart)
                 startTime = trialClock.getTime()
+                playTime = core.getTime()  # time base of the key events
                 
-                # send trigger
-                if self.mode == MODE_EXP:
-                    if condition == "anomalous":
-                        self.port.setData(TRIGGER_ANOMALOUS)
-                    elif condition == "expected":
-                        self.port.setData(TRIGGER_EXPECTED)
-                    elif condition == "pseudoword":
-                        self.port.setData(TRIGGER_PSEUDOWORD)
-                    elif condition == "unexpected":
-                        self.port.setData(TRIGGER_UNEXPECTED)
-                    triggerActive = True
+                # send trigger (resolved before the run, reset after 100ms by the trigger scheduler)
+                if trial is not None:
+                    self.triggerPlan.send(trial, self.triggers)
                 
-                # write logging info
-                logging.log(level = logging.EXP, msg = 'Playback started\t' + str(self.globalClock.getTime()) + '\t' +wavfile)
+                # write logging info (formatted and written by the journal thread)
+                tGlobal = self.globalClock.getTime()
+                self.journal.pushLog(logging.defaultClock.getTime(), 'Playback started\t%s\t%s', (tGlobal, wavfile))
             
-            if self.mode == MODE_EXP and triggerActive and wav.status == STARTED and t >= 0.1-self.frameTolerance:
-                self.port.setData(0)
 
             # Check for a response. This doesn't need to be sychronized with the next 
-            # frame flip
+            # frame flip, as the presses are timestamped by the keyboard
+            pollStart = self.profiler.clock()
+            collector.poll()
+            routine.since('keyPoll', pollStart)
             if wav.status == FINISHED and rt == -1:
-                if resetDone:
-                    theseKeys = event.getKeys(keyList=keyList)
-                    if len(theseKeys):
-                        response = theseKeys[0]
-                        rt = trialClock.getTime() - startTime
-                        print(response)
-                        logging.log(level = logging.EXP, msg = 'Response\t' + response + '\t' + str(rt))
-                else:
-                    keyb.clock.reset()
-                    resetDone = True
+                onset = getSoundOnset(wav, playTime)
+                key, tDown = collector.getFirstPress(onset + wav.getDuration())
+                if key is not None:
+                    response = key
+                    rt = trialClock.getTime() - startTime  # quantized to the frame
+                    rtEvent = tDown - onset
+                    rtOffset = rtEvent - wav.getDuration()
+                    self.journal.pushLog(logging.defaultClock.getTime(), 'Response\t%s\t%s\t%s\t%.4f', (response, rt, rtEvent, rt - rtEvent))
             
             # check for quit (typically the Esc key)
-            if self.endExpNow or event.getKeys(keyList=["escape"]):
+            if self.endExpNow or collector.quit:
                 core.quit()
             
             if wav.status == FINISHED and tThisFlipGlobal > wav.tStartRefresh + trialDuration-self.frameTolerance:
@@ -457,25 +458,202 @@ class Experiment:
             # refresh the screen
             if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
                 self.win.flip()
+                routine.flip()
 
         # -------Ending Routine -------
         wav.stop()  # ensure sound has stopped at end of routine
         endTime = trialClock.getTime()
-        logging.log(level = logging.EXP, msg = 'Trial ended\t' + str(self.globalClock.getTime()))
+        self.journal.pushLog(logging.defaultClock.getTime(), 'Trial ended\t%s', (self.globalClock.getTime(),))
         
-        self.thisExp.addData('wavfile', wavfile)
-        self.thisExp.addData('wav.duration', wav.getDuration())
-        self.thisExp.addData('response', response)
-        self.thisExp.addData('rt', rt)
-        self.thisExp.addData('wav.started', wav.tStart)
-        self.thisExp.addData('startTime', startTime)
-        self.thisExp.addData('startTimeGlobal', startTimeGlobal)
-        self.thisExp.addData('endTime', endTime)
-        self.thisExp.addData('responseTime', responseTime)
-        self.thisExp.nextEntry()
+        presses = collector.format(getSoundOnset(wav, playTime) + wav.getDuration()) if playTime is not None else ''
+        self.recordTrial((wavfile, wav.getDuration(), response, rt, rtEvent, rtOffset, presses, wav.tStart, startTime, startTimeGlobal, endTime, responseTime))
         
         self.routineTimer.reset()
 
+    def recordTrial(self, record):
+        """
+        Write a trial record (one value per field of TRIAL_FIELDS) to the journal and the data file.
+        """
+        self.journal.push(*record)
+        self.journal.flush()
+        self.journal.flushLog()
+        for name, value in zip(TRIAL_FIELDS, record):
+            self.thisExp.addData(name, value)
+        self.thisExp.nextEntry()
+
+    def presentTrials(self, filenames, responseTimes, start=0):
+        """
+        Present the trials of a run, either with a frame loop per trial (presentSound) or from a timeline compiled
+        before the run (presentTimeline), depending on self.playback. The trigger codes of all trials are resolved
+        before the run (see Utils/TriggerPlan.py) and written with their onsets and wav files to
+        data/<...>_events.tsv after the run. Every completed trial is recorded in the checkpoint of the run.
+
+        Parameters
+        ----------
+        filenames : list of str
+            wave files of the trials (in the subfolder "wav")
+        responseTimes : list of int
+            time in ms to wait for a response after the end of each wave file
+        start : int
+            index of the first trial to present, e.g. of a resumed run (default: 0)
+        """
+        wavfiles = ['wav' + os.sep + f for f in filenames]
+        manifest = WavManifest('wav')
+        self.triggerPlan = TriggerPlan(wavfiles, [f.split('_')[0] for f in filenames], CONDITION_TRIGGERS,
+            durations=[manifest.getDuration(f) for f in wavfiles], itemCodes=self.itemTriggers)
+        if self.resumeState is not None:
+            for trial in self.resumeState['trials']:
+                self.triggerPlan.onsets[trial['trial']] = trial['onset']
+        pulse = self.waitForRunStart()
+        if self.playback == 'timeline':
+            self.presentTimeline(wavfiles, responseTimes, pulse, start)
+        else:
+            for i in range(start, len(wavfiles)):
+                if pulse is not None and self.syncTrials and i > start:
+                    pulse = self.waitForSerial(1)
+                writes = len(self.triggers.log)
+                entries = len(self.thisExp.entries)
+                self.presentSound(wavfiles[i], responseTime=responseTimes[i]/1000, trial=i)
+                if pulse is not None and (self.syncTrials or i == start):
+                    self.scanner.addLatency(pulse, self.getTriggerOnset(writes))
+                self.completeTrial(i, self.thisExp.entries[entries:])
+        # sidecar mapping the trigger codes and onsets to the wav files
+        self.triggerPlan.save(self.dataFileName)
+        logging.log(level = logging.EXP, msg = self.triggerPlan.summary())
+
+    def presentTimeline(self, wavfiles, responseTimes, pulse=None, start=0):
+        """
+        Present the trials of a run from a timeline compiled before the run (see Utils/Timeline.py). The onset of
+        each trial is the end of the response window of the previous one, computed from the wav headers and
+        anchored to the start of the run. Sounds and triggers are scheduled with the PTB audio backend instead of
+        running a frame loop per trial, and responses are read from the timestamped keyboard queue while waiting.
+        The scheduled and actual onsets of all trials are logged after the run. Durations and trigger codes are
+        taken from the trigger plan of the run (see presentTrials).
+
+        Parameters
+        ----------
+        wavfiles : list of str
+            wave files of the trials
+        responseTimes : list of int
+            time in ms to wait for a response after the end of each wave file
+        pulse : double
+            time of the scanner pulse which starts the run (default: None, the run starts immediately)
+        start : int
+            index of the first trial to present, e.g. of a resumed run (default: 0). Event i of the timeline is
+            trial start + i.
+        """
+        import psychtoolbox as ptb
+        plan = self.triggerPlan
+        timeline = Timeline()
+        for i in range(start, len(wavfiles)):
+            timeline.add(plan.durations[i], item=wavfiles[i], trigger=plan.codes[i], label=plan.conditions[i],
+                         pause=responseTimes[i]/1000)
+        timeline.compile()
+        collector = ResponseCollector(self.defaultKeyboard, ['1', '2'])
+        collector.start()
+        sounds = {}
+        playbacks = {}
+
+        def prepare(i, at):
+            wav = self.audioCache.get(timeline.items[i])
+            wav.setVolume(1)
+            wav.play(when=at)
+            sounds[i] = wav
+            plan.send(start + i, self.triggers, at=at)
+
+        def started(i, at, now):
+            onset = getSoundOnset(sounds[i], now)
+            # logged when the trial has finished: the next trial starts before the response window of this one is
+            # evaluated, and the log has to list the lines of each trial together (see IngestLogs.py)
+            playbacks[i] = (logging.defaultClock.getTime(), onset - self.globalClock.getLastResetTime())
+            return onset
+
+        def finished(i):
+            sounds.pop(i).stop()
+            collector.poll()
+            onset = timeline.actual[i]
+            offset = onset + timeline.durations[i]
+            end = timeline.origin + timeline.ends[i]
+            response = ''
+            rt = -1
+            rtOffset = -1
+            key, tDown = collector.getFirstPress(offset, end)
+            logTime, globalOnset = playbacks.pop(i)
+            self.journal.pushLog(logTime, 'Playback started\t%s\t%s', (globalOnset, timeline.items[i]))
+            if key is not None:
+                response = key
+                rt = tDown - onset
+                rtOffset = tDown - offset
+                # the press is timed by the response collector, so rt and rt.event are the same time
+                self.journal.pushLog(logging.defaultClock.getTime(), 'Response\t%s\t%s\t%s\t%.4f', (response, rt, rt, 0.0))
+            self.journal.pushLog(logging.defaultClock.getTime(), 'Trial ended\t%s', (end - self.globalClock.getLastResetTime(),))
+            presses = collector.format(offset, onset, end)
+            # the times have the meaning of the frame mode: relative to the (scheduled) start of the trial, except
+            # for startTimeGlobal
+            trialStart = timeline.origin + timeline.onsets[i]
+            self.recordTrial((timeline.items[i], timeline.durations[i], response, rt, rt, rtOffset, presses,
+                              onset - trialStart, onset - trialStart, trialStart - self.globalClock.getLastResetTime(),
+                              timeline.ends[i] - timeline.onsets[i], timeline.ends[i] - timeline.offsets[i]))
+            self.completeTrial(start + i, self.thisExp.entries[-1:])
+
+        def poll():
+            collector.poll()
+            if self.endExpNow or collector.quit:
+                core.quit()
+
+        self.win.flip()  # show the fixation cross
+        # the sentences are started by the audio backend and their triggers are sent by the trigger thread, so between
+        # the onsets the loop only polls the response keys and may sleep (spinWindow=0): busy-waiting would hold the
+        # interpreter lock the trigger thread needs to end its pulses on time
+        origin = (pulse if pulse is not None else ptb.GetSecs()) + self.scheduleLead
+        timeline.run(ptb.GetSecs, origin, prepare, started, finished, onPoll=poll,
+                     lead=self.scheduleLead, spinWindow=0, pollInterval=self.pollInterval)
+        if pulse is not None:
+            self.scanner.addLatency(pulse, timeline.actual[0])
+        for line in timeline.report():
+            logging.log(level = logging.EXP, msg = line)
+
+    def getCheckpointFile(self, expInfo, run):
+        """
+        Return the checkpoint file of a run of the participant and session (see Utils/RunCheckpoint.py).
+        """
+        return os.path.join(self._thisDir, 'data', '%s_%s_%s_%d_checkpoint.jsonl' % (expInfo['participant'], expInfo['session'], self.expName, run))
+
+    def startCheckpoint(self, stimuli_list, run, filenames):
+        """
+        Start the checkpoint of a run. A new run writes the stimulus list, run half, playback mode and data file to
+        the checkpoint. A resumed run checks that its list is the one of the interrupted run, restores the completed
+        trials into the data file and continues the checkpoint.
+
+        Returns
+        -------
+        the index of the first trial to present
+        """
+        self.checkpoint = RunCheckpoint(self.getCheckpointFile(self.expInfo, run))
+        if self.resumeState is None:
+            self.checkpoint.start({'list': stimuli_list, 'run': run, 'playback': self.playback, 'dataFile': self.dataFileName,
+                                   'trials': len(filenames), 'listHash': getListHash(filenames)})
+            return 0
+        info = self.resumeState['info']
+        if info['listHash'] != getListHash(filenames):
+            raise ValueError('The stimulus list of run %d differs from the list of the interrupted run' % run)
+        for trial in self.resumeState['trials']:
+            for entry in trial['entries']:
+                for name, value in entry.items():
+                    self.thisExp.addData(name, value)
+                self.thisExp.nextEntry()
+        self.checkpoint.start()
+        logging.log(level = logging.EXP, msg = 'Resumed run\t%d\tat trial %d of %d' % (run, self.resumeState['next'], len(filenames)))
+        return self.resumeState['next']
+
+    def completeTrial(self, index, entries):
+        """
+        Record a completed trial with its rows of the data file and its trigger onset in the checkpoint of the run
+        (called between trials, the checkpoint is synced to disk).
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.complete(index, entries=entries, onset=self.triggerPlan.onsets[index])
+
     def resetTrialComponents(self, components):
         """
         Reset the specified list of PsychoPy-components.
@@ -514,8 +692,11 @@ class Experiment:
         key_resp = keyboard.Keyboard()
         self.resetTrialComponents([key_resp])
         self.message.text = text
+        routine = self.profiler.routine('waitForButton')
+        routine.begin()
         
         while continueRoutine:
+            routine.tick()
             # get current time
             t = self.pauseClock.getTime()
             tThisFlip = self.win.getFutureFlipTime(clock=self.pauseClock)
@@ -546,7 +727,7 @@ class Experiment:
                     self.win.timeOnFlip(key_resp, 'tStopRefresh')  # time at next scr refresh
                     key_resp.status = FINISHED
             if key_resp.status == STARTED and not waitOnFlip:
-                theseKeys = event.getKeys(keyList=keyList)
+                theseKeys = self.getKeys(keyList, routine)
                 if len(theseKeys):
                     theseKeys = theseKeys[0]  # at least one key was pressed
                     
@@ -559,7 +740,7 @@ class Experiment:
                     key_resp.status = FINISHED
             
             # check for quit (typically the Esc key)
-            if self.endExpNow or event.getKeys(keyList=["escape"]):
+            if self.endExpNow or self.getKeys(["escape"], routine):
                 core.quit()
             
             continueRoutine = False  # will revert to True if at least one component still running
@@ -570,6 +751,7 @@ class Experiment:
             # refresh the screen
             if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
                 self.win.flip()
+                routine.flip()
 
         # -------Ending Routine "pause"-------
         
@@ -587,28 +769,49 @@ class Experiment:
 
     def waitForSerial(self, numberOfSignals):
         """
-        Wait for a number of serial port signals (e.g. MRI scanner pulses)
+        Wait for a number of serial port signals (e.g. MRI scanner pulses), which are read and timestamped by the
+        reader thread of the scanner (see setupScanner). The escape key is checked while waiting.
 
         Parameters
         ----------
         numberOfSignals : int
             number of signals to wait for
+
+        Returns
+        -------
+        the time of the last signal (in the time base of the trigger scheduler)
         """
-        continueRoutine = True
-        detected = 0
-        while continueRoutine:
-            value = self.serial.read()
+        return self.scanner.waitForNext(numberOfSignals, onPoll=self.checkQuit, pollInterval=self.pollInterval)
 
-            # Determine here if the values constitue a signal (TODO)
-            if value > 0:
-                detected = detected + 1
+    def waitForRunStart(self):
+        """
+        Wait for the scanner pulse which starts the run (the scannerPulse-th pulse from now on) if the run is
+        synchronized to the scanner.
 
-            if detected >= numberOfSignals:
-                continueRoutine = False
+        Returns
+        -------
+        the time of the pulse (in the time base of the trigger scheduler), or None without scanner
+        """
+        if self.scanner is None:
+            return None
+        # the pulses are counted from here: pulses received before the run is ready (e.g. during the instructions)
+        # are ignored, so the run is never anchored to a pulse in the past
+        return self.scanner.waitForNext(self.scannerPulse, onPoll=self.checkQuit, pollInterval=self.pollInterval)
+
+    def getTriggerOnset(self, start):
+        """
+        Return the time of the first trigger onset written since the trigger log had the specified length
+        (None if there is none), e.g. the onset of a trial synchronized to a scanner pulse.
+        """
+        for scheduled, actual, value in self.triggers.log[start:]:
+            if value != 0:
+                return actual
+        return None
 
     def wait(self, time):
         """
         Wait for a specific amount of time while listening for key presses to quit the experiment.
+        The escape key is checked at least every pollInterval seconds.
         
         Parameters
         ----------
@@ -616,31 +819,48 @@ class Experiment:
             time in seconds to wait 
         """
         trialClock = core.Clock()
-        trialDuration = time
-        keyb = keyboard.Keyboard()
+        routine = self.profiler.routine('wait')
+        routine.begin()
 
-        # reset timers
-        trialClock.reset()
-        continueRoutine = True
+        def poll():
+            routine.tick()
+            self.checkQuit(routine)
 
-        while continueRoutine:
-            # get current time
-            t = trialClock.getTime()
-            
-            # check for quit (typically the Esc key)
-            if self.endExpNow or event.getKeys(keyList=["escape"]):
-                core.quit()
-            
-            if t > trialDuration:
-                continueRoutine = False    
-
-            # refresh the screen (needed to show the fixation cross at the beginning)
-            if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
-                self.win.flip() 
+        # refresh the screen once (needed to show the fixation cross at the beginning). The content does not
+        # change while waiting, so the thread sleeps and only spins for the final spinWindow seconds
+        self.win.flip()
+        routine.flip()
+        end = waitUntil(time, trialClock.getTime, spinWindow=self.spinWindow, pollInterval=self.pollInterval, onPoll=poll)
+        routine.add('overshoot', end - time)
 
         # -------Ending Routine -------
         self.routineTimer.reset()
 
-experiment = Experiment()
-experiment.start()
+    def checkQuit(self, routine=None):
+        """
+        Quit the experiment if requested (typically by the Esc key).
+        """
+        if self.endExpNow or self.getKeys(["escape"], routine):
+            core.quit()
 
+    def getKeys(self, keyList, routine=None):
+        """
+        Return the keys of keyList pressed since the last call and record the key-poll latency of the routine.
+
+        Parameters
+        ----------
+        keyList : list of str
+            keys to check
+        routine : RoutineProfiler
+            profiler of the calling routine (default: None, the latency is not recorded)
+        """
+        if routine is None:
+            return event.getKeys(keyList=keyList)
+        start = self.profiler.clock()
+        keys = event.getKeys(keyList=keyList)
+        routine.since('keyPoll', start)
+        return keys
+
+if __name__ == '__main__':
+    experiment = Experiment()
+    experiment.start()
@@ -0,0 +1,304 @@
+import numpy as np
+
+
+class SequenceSampler:
+    """
+    Draws condition sequences with a fixed number of trials per condition directly from the set of
+    valid sequences, instead of shuffling until a sequence happens to be valid (rejection sampling).
+
+    A sequence is valid if no condition is repeated more than maxRun times in a row and no forbidden
+    transition (pair of consecutive conditions) occurs. For every state (remaining trials per condition,
+    last condition, length of the current run), the number of valid completions is counted by dynamic
+    programming over the lattice of remaining trial counts (rescaled per number of remaining trials). Sampling each next condition
+    proportionally to the number of completions it leaves yields every valid sequence with the same
+    probability.
+
+    The lattice grows with the product of the trial counts per condition. Longer sequences are therefore
+    split into consecutive chunks with proportional trial counts per condition (at most maxCells states
+    per chunk). Chunks are coupled by the condition and run length at their boundaries, so the result is
+    exactly uniform over all valid sequences with these per-chunk counts.
+
+    The tables only depend on the trial counts, so the tables of the last drawn counts are kept and
+    drawing further sequences with the same counts (e.g. for a cohort of participants) only costs the
+    sampling itself.
+    """
+
+    def __init__(self, conditions, maxRun=2, forbidden=(), maxCells=2000000):
+        """
+        Parameters
+        ----------
+        conditions : list of str
+            labels of the conditions
+        maxRun : int or dict
+            maximum number of consecutive trials of the same condition, either for all conditions
+            or per condition label (default: 2, i.e. no condition three times in a row)
+        forbidden : list of tuples
+            pairs of condition labels (previous, next) which must not follow each other (default: none)
+        maxCells : int
+            maximum number of states of the dynamic programming table per chunk (default: 2e6, i.e. 16 MB)
+        """
+        self.conditions = list(conditions)
+        self.index = dict((c, i) for i, c in enumerate(self.conditions))
+        m = len(self.conditions)
+        if isinstance(maxRun, dict):
+            self.maxRun = np.array([maxRun[c] for c in self.conditions], dtype=int)
+        else:
+            self.maxRun = np.full(m, maxRun, dtype=int)
+        if np.any(self.maxRun < 1):
+            raise ValueError('maxRun must be at least 1')
+        self.allowed = np.ones((m, m), dtype=bool)
+        for previous, following in forbidden:
+            self.allowed[self.index[previous], self.index[following]] = False
+        self.maxCells = maxCells
+        self.lattices = {}
+        self.tables = None
+
+    def check(self, sequence):
+        """
+        Check if a sequence of condition labels is valid (run lengths and transitions).
+
+        Parameters
+        ----------
+        sequence : list of str
+            sequence of condition labels
+        """
+        run = 0
+        for i in range(0, len(sequence)):
+            if i > 0 and sequence[i] == sequence[i-1]:
+                run = run + 1
+            else:
+                run = 1
+            current = self.index.get(sequence[i])
+            if current is None:
+                continue
+            if run > self.maxRun[current]:
+                return False
+            if i > 0:
+                previous = self.index.get(sequence[i-1])
+                if previous is not None and not self.allowed[previous, current]:
+                    return False
+        return True
+
+    def count(self, counts):
+        """
+        Return the natural logarithm of the number of valid sequences with the specified trial counts
+        (-inf if there is none). The counts are treated as a single chunk, regardless of maxCells.
+
+        Parameters
+        ----------
+        counts : dict
+            number of trials per condition label
+        """
+        counts = self.getCounts(counts)
+        if counts.sum() == 0:
+            return 0.0
+        table, scales = self.buildTable(counts, np.ones((len(counts), self.maxRun.max())))
+        total = self.getNextWeights(table, counts, counts, None).sum()
+        if total == 0:
+            return -np.inf
+        return np.log(total) + scales[counts.sum() - 1]
+
+    def sample(self, counts, rng=None, chunks=None):
+        """
+        Draw a valid sequence uniformly at random.
+
+        Parameters
+        ----------
+        counts : dict
+            number of trials per condition label
+        rng : numpy.random.Generator
+            random number generator (default: numpy's global random state)
+        chunks : int
+            number of chunks to split the sequence into (default: as few as maxCells allows)
+
+        Returns
+        -------
+        list of condition labels
+        """
+        if rng is None:
+            rng = np.random
+        counts = self.getCounts(counts)
+        if chunks is None:
+            chunks = self.getNumberOfChunks(counts)
+        chunkCounts, tables = self.getTables(counts, chunks)
+
+        sequence = []
+        tail = None
+        for c, table in zip(chunkCounts, tables):
+            tail = self.sampleChunk(table, c, tail, rng, sequence)
+        return [self.conditions[i] for i in sequence]
+
+    def getTables(self, counts, chunks):
+        """
+        Return the trial counts and the table of each chunk (see buildTable). The tables of the last
+        counts and number of chunks are cached.
+        """
+        key = (tuple(counts), chunks)
+        if self.tables is not None and self.tables[0] == key:
+            return self.tables[1], self.tables[2]
+
+        chunkCounts = self.splitCounts(counts, chunks)
+
+        # number of valid completions for every boundary state (condition, run length), from the last chunk backwards
+        m = len(counts)
+        tables = []
+        terminal = np.ones((m, self.maxRun.max()))
+        for c in reversed(chunkCounts):
+            table, scales = self.buildTable(c, terminal)
+            tables.insert(0, table)
+            terminal = table[self.getFullIndex(c)]
+        self.tables = (key, chunkCounts, tables)
+        return chunkCounts, tables
+
+    def getCounts(self, counts):
+        return np.array([counts.get(c, 0) for c in self.conditions], dtype=int)
+
+    def getNumberOfChunks(self, counts):
+        states = len(counts) * self.maxRun.max()
+        chunks = 1
+        while np.prod(np.ceil(counts / chunks) + 1) * states > self.maxCells and chunks < counts.sum():
+            chunks = chunks + 1
+        return chunks
+
+    def splitCounts(self, counts, chunks):
+        bounds = [np.round(counts * k / chunks).astype(int) for k in range(chunks + 1)]
+        return [bounds[k + 1] - bounds[k] for k in range(chunks) if (bounds[k + 1] - bounds[k]).sum() > 0]
+
+    def getStrides(self, counts):
+        shape = counts + 1
+        return np.concatenate([np.cumprod(shape[::-1])[::-1][1:], [1]]).astype(np.int64)
+
+    def getFullIndex(self, counts):
+        return int(np.dot(counts, self.getStrides(counts)))
+
+    def buildTable(self, counts, terminal):
+        """
+        Count the valid completions for all states of a chunk.
+
+        Parameters
+        ----------
+        counts : numpy array
+            number of trials per condition in the chunk
+        terminal : numpy array (conditions x maxRun)
+            relative number of completions after the chunk, per last condition and run length
+
+        Returns
+        -------
+        table : numpy array (lattice points x conditions x maxRun)
+            relative number of valid completions given the remaining trials (flattened lattice index),
+            the last condition and its run length - 1. All states with the same number of remaining
+            trials share a common scale factor.
+        scales : numpy array
+            natural logarithm of the scale factor per number of remaining trials
+        """
+        m = len(counts)
+        r = self.maxRun.max()
+        strides = self.getStrides(counts)
+        coords, order, bounds, position = self.getLattice(counts)
+
+        # states are stored ordered by the number of remaining trials, so each level is a contiguous block.
+        # The additional last row is zero and used for conditions without remaining trials
+        empty = len(order)
+        table = np.zeros((len(order) + 1, m, r))
+        scales = np.zeros(counts.sum() + 1)
+        peak = terminal.max()
+        table[0] = terminal / peak if peak > 0 else terminal
+        switching = (self.allowed & ~np.eye(m, dtype=bool)).T.astype(float)
+        for total in range(1, counts.sum() + 1):
+            rows = order[bounds[total]:bounds[total + 1]]
+            children = []
+            switched = np.empty((len(rows), m))
+            for following in range(m):
+                child = np.where(coords[rows, following] > 0, position[rows - strides[following]], empty)
+                children.append(child)
+                switched[:, following] = table[child, following, 0]
+            # switch to another condition: its run starts with length 1
+            level = np.repeat(np.dot(switched, switching)[:, :, None], r, axis=2)
+            # continue the run of the same condition: length L -> L + 1
+            for following in range(m):
+                if self.allowed[following, following]:
+                    run = self.maxRun[following]
+                    level[:, following, 0:run - 1] += table[children[following], following, 1:run]
+            peak = level.max()
+            scales[total] = scales[total - 1]
+            if peak > 0:
+                level /= peak
+                scales[total] = scales[total] + np.log(peak)
+            table[bounds[total]:bounds[total + 1]] = level
+        return table[position], scales
+
+    def getLattice(self, counts):
+        """
+        Return the coordinates of all lattice points of a chunk, their order by number of remaining trials,
+        the bounds of each level in this order and the position of each lattice point in this order.
+        Lattices are cached, as consecutive chunks mostly have the same trial counts.
+        """
+        key = tuple(counts)
+        if key not in self.lattices:
+            coords = np.indices(counts + 1).reshape(len(counts), -1).T
+            totals = coords.sum(axis=1)
+            order = np.argsort(totals, kind='stable')
+            bounds = np.searchsorted(totals[order], np.arange(counts.sum() + 2))
+            position = np.empty(len(order), dtype=np.int64)
+            position[order] = np.arange(len(order))
+            if len(self.lattices) > 8:
+                self.lattices.clear()
+            self.lattices[key] = (coords, order, bounds, position)
+        return self.lattices[key]
+
+    def getNextWeights(self, table, counts, remaining, tail):
+        """
+        Return the relative number of valid completions for each possible next condition.
+
+        Parameters
+        ----------
+        table : numpy array
+            table of the current chunk, see buildTable
+        counts : numpy array
+            number of trials per condition in the current chunk
+        remaining : numpy array
+            remaining number of trials per condition in the current chunk
+        tail : tuple
+            (last condition, run length) or None at the start of the sequence
+        """
+        strides = self.getStrides(counts)
+        index = int(np.dot(remaining, strides))
+        weights = np.zeros(len(counts))
+        for following in range(len(counts)):
+            if remaining[following] == 0:
+                continue
+            child = index - strides[following]
+            if tail is None:
+                weights[following] = table[child, following, 0]
+            else:
+                previous, run = tail
+                if previous != following:
+                    if self.allowed[previous, following]:
+                        weights[following] = table[child, following, 0]
+                elif self.allowed[following, following] and run < self.maxRun[following]:
+                    weights[following] = table[child, following, run]
+        return weights
+
+    def sampleChunk(self, table, counts, tail, rng, sequence):
+        """
+        Draw the conditions of a chunk and append them to sequence.
+
+        Returns
+        -------
+        the tail (last condition, run length) at the end of the chunk
+        """
+        remaining = counts.copy()
+        for n in range(counts.sum()):
+            weights = self.getNextWeights(table, counts, remaining, tail)
+            total = weights.sum()
+            if total <= 0:
+                raise ValueError('There is no valid sequence for the specified counts and constraints')
+            following = int(np.searchsorted(np.cumsum(weights), rng.random() * total, side='right'))
+            following = min(following, len(weights) - 1)
+            remaining[following] = remaining[following] - 1
+            if tail is not None and tail[0] == following:
+                tail = (following, tail[1] + 1)
+            else:
+                tail = (following, 1)
+            sequence.append(following)
+        return tail
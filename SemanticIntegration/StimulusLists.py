@@ -0,0 +1,290 @@
+import csv
+import os
+
+import numpy as np
+
+from ResponseTimeIndex import getResponseTimeIndex
+from SequenceSampler import SequenceSampler
+
+# condition labels used for the sequence of a run
+CONDITIONS = ['exp', 'an', 'unexp', 'pseudo']
+
+# condition label of each wavefile prefix (e.g. expected_1.wav)
+PREFIXES = {'expected': 'exp', 'anomalous': 'an', 'unexpected': 'unexp', 'pseudoword': 'pseudo'}
+
+# states of the sampler table of one run (31 * 31 * 31 * 61 lattice points x 4 conditions x 2 run lengths), so each
+# run is drawn in a single chunk, i.e. uniformly over all valid orders. Building the tables takes about 1 s and
+# 0.3 GB once per sampler (see benchmarks/SequenceSampling.py), further lists with the same counts only cost the sampling.
+RUN_CELLS = 15000000
+
+# memory of a process which has built the tables of a sampler (with the temporary arrays of the build)
+SAMPLER_MEMORY = 400 * 1024 * 1024
+
+# number of worker processes if the available memory cannot be determined (e.g. on Windows)
+DEFAULT_WORKERS = 4
+
+
+def getSequenceSampler():
+    """
+    Return a sampler of the condition sequences of the stimuli lists (no condition three times in a row, each run
+    in a single chunk).
+    """
+    return SequenceSampler(CONDITIONS, maxRun=2, maxCells=RUN_CELLS)
+
+
+def getWorkerCount(workers=None):
+    """
+    Return the number of worker processes for tools which build a sampler in every worker: workers if specified,
+    otherwise the number of CPUs, limited to the number of samplers which fit into the available memory (or to
+    DEFAULT_WORKERS if it cannot be determined).
+    """
+    if workers:
+        return workers
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        limit = max(1, available // SAMPLER_MEMORY)
+    except (AttributeError, ValueError, OSError):
+        limit = DEFAULT_WORKERS
+    return max(1, min(os.cpu_count() or 1, limit))
+
+
+def readStimulusList(filename):
+    """
+    Read the specified stimuli list (csv-file with wavefile in the first and response time (in ms) in the second column) 
+    
+    Parameters
+    ----------
+    filename : str
+        file to read (either absolute path or relative to the current directory)
+    """
+    filenames = []
+    responseTimes = []
+    with open(filename, newline='') as csvfile:
+        reader = csv.reader(csvfile, dialect='excel')
+        for row in reader:
+            tokens = row[0].split(';')
+            filenames.append(tokens[0])
+            responseTimes.append(int(tokens[1]))
+
+    return filenames, responseTimes
+
+
+def writeStimulusList(filename, stimuli, responseTimes):
+    """
+    Write a stimuli list (see readStimulusList).
+
+    Parameters
+    ----------
+    filename : str
+        file to write
+    stimuli : list of str
+        wavefiles
+    responseTimes : list of int
+        response times in ms
+    """
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';', dialect='excel')
+        for i in range(0, len(stimuli)):
+            writer.writerow([stimuli[i], responseTimes[i]])
+
+
+def getResponseTimeList(stimFiles, responseTimesFile):
+    """
+    Look up the response time (in ms) of each of the specified wavefiles (see ResponseTimeIndex).
+
+    Parameters
+    ----------
+    stimFiles : list of str
+        wavefiles
+    responseTimesFile : str
+        csv-file with the response time of each wavefile (responseTimes.csv)
+    """
+    return getResponseTimeIndex(responseTimesFile).lookup(stimFiles)
+
+
+def getCondition(filename):
+    """
+    Return the condition label of a wavefile (None for unknown prefixes).
+
+    Parameters
+    ----------
+    filename : str
+        wavefile, e.g. expected_1.wav
+    """
+    return PREFIXES.get(filename.split('_')[0])
+
+
+def getRunDuration(filenames, responseTimes, manifest):
+    """
+    Return the duration of a run in seconds: each trial lasts for the duration of the wavefile plus the response time.
+
+    Parameters
+    ----------
+    filenames : list of str
+        wavefiles of the run
+    responseTimes : list of int
+        response times in ms
+    manifest : WavManifest
+        manifest of the wav folder (see Utils/WavManifest.py)
+    """
+    return manifest.getTotalDuration(filenames) + sum(responseTimes) / 1000
+
+
+def getStimListPath(directory, participant, session, expName='SemanticIntegration'):
+    """
+    Return the path of the generated stimuli list of a participant and session.
+
+    Parameters
+    ----------
+    directory : str
+        folder of the paradigm (the list is stored in its subfolder 'stim_lists')
+    participant : str
+        participant ID
+    session : str
+        session, e.g. '001'
+    """
+    return os.path.join(directory, 'stim_lists', '%s_%s_stim_%s.csv' % (participant, session, expName))
+
+
+def selectRun(filenames, responseTimes, run):
+    """
+    Select the half of a stimuli list corresponding to run 1 or 2.
+
+    Parameters
+    ----------
+    filenames : list of str
+        wavefiles of the whole list
+    responseTimes : list of int
+        response times of the whole list
+    run : int
+        run (1 or 2)
+    """
+    center = int(len(filenames)/2)
+    length = len(filenames)
+    if run == 1:
+        return filenames[0:center], responseTimes[0:center]
+    else:
+        return filenames[center:length], responseTimes[center:length]
+
+
+def generateStimulusList(responseTimesFile, sampler=None, rng=None):
+    """
+    Generate a randomized stimuli list for one participant and session. Each half (run 1 and 2) contains
+    30 expected, anomalous and unexpected sentences and 60 pseudowords, with no condition three times in a row.
+    The halves present complementary items; the a and b versions of the pseudowords are split between them.
+    The order of the conditions is drawn uniformly from all valid orders with these counts per half if the
+    sampler holds a half in a single chunk (getSequenceSampler). A sampler with a smaller maxCells splits each half
+    into chunks with proportional counts per condition (e.g. 15/15/15/30 trials), which restricts the orders.
+
+    Parameters
+    ----------
+    responseTimesFile : str
+        csv-file with the response time (in ms) of each wavefile (responseTimes.csv)
+    sampler : SequenceSampler
+        sampler for the sequence of conditions (default: getSequenceSampler())
+    rng : numpy.random.Generator
+        random number generator (default: numpy's global random state)
+
+    Returns
+    -------
+    filenames : list of str
+        wavefiles
+    responseTimes : list of int
+        response times in ms
+    """
+    if sampler is None:
+        sampler = getSequenceSampler()
+    if rng is None:
+        rng = np.random
+    sequenceA = []
+    sequenceB = []
+    
+    expectedA = []
+    expectedB = []
+    inds = list(range(1, 61))
+    rng.shuffle(inds)
+    for i in range(0, 30):
+        expectedA.append('expected_' + str(inds[i]) + '.wav')
+        sequenceA.append('exp')
+    for i in range(30, 60):
+        expectedB.append('expected_' + str(inds[i]) + '.wav')
+        sequenceB.append('exp')
+    
+    anomalousA = []
+    anomalousB = []
+    inds = list(range(1, 61))
+    rng.shuffle(inds)
+    for i in range(0, 30):
+        anomalousA.append('anomalous_' + str(inds[i]) + '.wav')
+        sequenceA.append('an')
+    for i in range(30, 60):
+        anomalousB.append('anomalous_' + str(inds[i]) + '.wav')
+        sequenceB.append('an')
+        
+    unexpectedA = []
+    unexpectedB = []
+    inds = list(range(1, 61))
+    rng.shuffle(inds)
+    for i in range(0, 30):
+        unexpectedA.append('unexpected_' + str(inds[i]) + '.wav')
+        sequenceA.append('unexp')
+    for i in range(30, 60):
+        unexpectedB.append('unexpected_' + str(inds[i]) + '.wav')
+        sequenceB.append('unexp')
+        
+    pseudowordA = []
+    pseudowordB = []
+    inds = list(range(1, 61))
+    rng.shuffle(inds)
+    for i in range(0, 60):
+        if rng.random() < 0.5:
+            pseudowordA.append('pseudoword_' + str(inds[i]) + 'a.wav')
+            pseudowordB.append('pseudoword_' + str(inds[i]) + 'b.wav')
+        else:
+            pseudowordA.append('pseudoword_' + str(inds[i]) + 'b.wav')
+            pseudowordB.append('pseudoword_' + str(inds[i]) + 'a.wav')
+            
+        sequenceA.append('pseudo')
+        sequenceB.append('pseudo')
+        
+    
+    # draw both halves as one sequence without a condition three times in a row (also across the
+    # boundary between the halves), with each half containing the conditions of sequenceA/sequenceB
+    counts = dict((c, sequenceA.count(c) + sequenceB.count(c)) for c in sampler.conditions)
+    chunks = 2 * sampler.getNumberOfChunks(sampler.getCounts(counts) // 2)
+    sequence = sampler.sample(counts, rng, chunks)
+    sequenceA = sequence[0:len(sequenceA)]
+    sequenceB = sequence[len(sequenceA):]
+
+    sequence = []
+    expectedA = iter(expectedA)
+    unexpectedA = iter(unexpectedA)
+    anomalousA = iter(anomalousA)
+    pseudowordA = iter(pseudowordA)
+    for i in range(0, len(sequenceA)):
+        if sequenceA[i] == 'exp':
+            sequence.append(next(expectedA))
+        if sequenceA[i] == 'unexp':
+            sequence.append(next(unexpectedA))
+        if sequenceA[i] == 'an':
+            sequence.append(next(anomalousA))
+        if sequenceA[i] == 'pseudo':
+            sequence.append(next(pseudowordA))
+    
+    expectedB = iter(expectedB)
+    unexpectedB = iter(unexpectedB)
+    anomalousB = iter(anomalousB)
+    pseudowordB = iter(pseudowordB)
+    for i in range(0, len(sequenceB)):
+        if sequenceB[i] == 'exp':
+            sequence.append(next(expectedB))
+        if sequenceB[i] == 'unexp':
+            sequence.append(next(unexpectedB))
+        if sequenceB[i] == 'an':
+            sequence.append(next(anomalousB))
+        if sequenceB[i] == 'pseudo':
+            sequence.append(next(pseudowordB))
+
+    responseTimes = getResponseTimeList(sequence, responseTimesFile)
+    
+    return sequence, responseTimes
@@ -0,0 +1,231 @@
+"""
+Validate the stimuli lists before a session: the shipped lists (stimuli_list*.csv) and the generated lists
+(stim_lists/*.csv). The lists are checked in parallel without starting PsychoPy.
+
+Errors (the list would crash or play the wrong files during a recording):
+- a wavefile does not exist in wav/ (skipped if there is no wav/ folder)
+- a wavefile has no entry in responseTimes.csv (except for the training list, which has its own stimuli)
+- a wavefile has an unknown condition prefix
+
+Warnings (design checks):
+- a condition occurs more than twice in a row (per run for the generated lists, which hold both runs)
+- the conditions are not balanced between the halves of a list (the run 1/run 2 split at the center)
+- a pseudoword is presented in the same version (a/b) in session 1 and 2 of a shipped list, or in both runs
+  of a generated list
+
+The result of each list is cached by the hash of its content, responseTimes.csv and the listing of wav/,
+so re-validating an unchanged bank only reads and hashes the files.
+
+Usage: python ValidateStimulusLists.py [lists ...] [--workers N] [--strict] [--no-cache]
+"""
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import StimulusLists
+from ResponseTimeIndex import getResponseTimeIndex
+from SequenceSampler import SequenceSampler
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+
+# increment if the checks change, to invalidate cached results
+VERSION = 1
+
+CACHE_FILE = os.path.join(_thisDir, '.validation_cache.json')
+
+PSEUDOWORD = re.compile(r'pseudoword_(.+?)([ab])\.wav$')
+
+
+def getKind(path):
+    """
+    Return the kind of a stimuli list: 'generated' (stim_lists/), 'training' (stimuli_list_training.csv, with
+    its own training stimuli and response times) or 'shipped'.
+    """
+    if os.path.basename(os.path.dirname(os.path.abspath(path))) == 'stim_lists':
+        return 'generated'
+    if os.path.basename(path) == 'stimuli_list_training.csv':
+        return 'training'
+    return 'shipped'
+
+
+def getPseudowordVersions(filenames):
+    """
+    Return the versions (a/b) of each pseudoword in a list of wavefiles as dictionary item -> list of versions.
+    """
+    versions = {}
+    for f in filenames:
+        match = PSEUDOWORD.match(f)
+        if match:
+            versions.setdefault(match.group(1), []).append(match.group(2))
+    return versions
+
+
+def getSameVersions(first, second):
+    """
+    Return the pseudowords which are presented in the same version in both dictionaries (see getPseudowordVersions).
+    """
+    return sorted(item for item in first if item in second and set(first[item]) & set(second[item]))
+
+
+def validateList(job):
+    """
+    Validate a single stimuli list.
+
+    Parameters
+    ----------
+    job : tuple
+        (path of the list, set of wavefiles in wav/ or None to skip the check, responseTimes.csv)
+
+    Returns
+    -------
+    dictionary with the errors, warnings and pseudoword versions of each half of the list
+    """
+    path, wavfiles, responseTimesFile = job
+    errors = []
+    warnings = []
+    try:
+        filenames, responseTimes = StimulusLists.readStimulusList(path)
+    except (ValueError, IndexError) as e:
+        return {'errors': ['cannot be read: %s' % e], 'warnings': [], 'versions': [{}, {}]}
+
+    if wavfiles is not None:
+        missing = sorted(set(f for f in filenames if f not in wavfiles))
+        if missing:
+            errors.append('%d wavefiles not in wav/: %s' % (len(missing), ', '.join(missing)))
+    kind = getKind(path)
+    missing = getResponseTimeIndex(responseTimesFile).getMissing(filenames) if kind != 'training' else []
+    if missing:
+        errors.append('%d wavefiles not in responseTimes.csv: %s' % (len(missing), ', '.join(missing)))
+    sequence = [StimulusLists.getCondition(f) for f in filenames]
+    unknown = sorted(set(f for f, c in zip(filenames, sequence) if c is None))
+    if unknown:
+        errors.append('%d wavefiles with unknown condition: %s' % (len(unknown), ', '.join(unknown)))
+
+    center = int(len(filenames)/2)
+    halves = [sequence[0:center], sequence[center:]]
+    sampler = SequenceSampler(StimulusLists.CONDITIONS, maxRun=2)
+    if kind == 'generated':
+        # both runs of a generated list start with a pause, so the rule applies per run
+        for run, half in enumerate(halves, 1):
+            if not sampler.check(half):
+                warnings.append('run %d: a condition occurs more than twice in a row' % run)
+    elif not sampler.check(sequence):
+        warnings.append('a condition occurs more than twice in a row')
+
+    counts = [collections.Counter(half) for half in halves]
+    if counts[0] != counts[1]:
+        warnings.append('conditions not balanced between the halves: %s' % ', '.join(
+            '%s %d/%d' % (c, counts[0][c], counts[1][c]) for c in StimulusLists.CONDITIONS if counts[0][c] != counts[1][c]))
+
+    versions = [getPseudowordVersions(filenames[0:center]), getPseudowordVersions(filenames[center:])]
+    if kind == 'generated':
+        same = getSameVersions(versions[0], versions[1])
+        if same:
+            warnings.append('%d pseudowords in the same version in both runs: %s' % (len(same), ', '.join(same)))
+    return {'errors': errors, 'warnings': warnings, 'versions': versions}
+
+
+def getSessionPairs(paths):
+    """
+    Return the pairs of shipped lists of session 1 and 2 (stimuli_listN_session1.csv and stimuli_listN_session2.csv).
+    """
+    pairs = []
+    for path in paths:
+        match = re.match(r'(.*)session1\.csv$', path)
+        if match and match.group(1) + 'session2.csv' in paths:
+            pairs.append((path, match.group(1) + 'session2.csv'))
+    return pairs
+
+
+def getHash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate the stimuli lists')
+    parser.add_argument('lists', nargs='*', help='lists to validate (default: stimuli_list*.csv and stim_lists/*.csv)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--strict', action='store_true', help='exit with status 1 on warnings as well')
+    parser.add_argument('--no-cache', action='store_true', help='ignore and do not update cached results')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = args.lists
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(_thisDir, 'stimuli_list*.csv'))) + sorted(glob.glob(os.path.join(_thisDir, 'stim_lists', '*.csv')))
+
+    responseTimesFile = os.path.join(_thisDir, 'responseTimes.csv')
+    wavDir = os.path.join(_thisDir, 'wav')
+    wavfiles = None
+    if os.path.isdir(wavDir):
+        wavfiles = frozenset(os.listdir(wavDir))
+    else:
+        print('No wav folder found, the wavefiles are not checked for existence')
+    with open(responseTimesFile, 'rb') as f:
+        context = getHash(f.read() + b'\n' + '\n'.join(sorted(wavfiles) if wavfiles is not None else ['-']).encode('utf-8') + b'\n%d' % VERSION)
+
+    cache = {}
+    if not args.no_cache and os.path.exists(CACHE_FILE):
+        try:
+            with open(CACHE_FILE) as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}
+
+    # hash the lists and validate the ones without cached result in parallel
+    keys = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            keys[path] = getHash(f.read()) + ':' + context + ':' + getKind(path)
+    pending = [path for path in paths if keys[path] not in cache]
+    if len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            jobs = [(path, wavfiles, responseTimesFile) for path in pending]
+            for path, result in zip(pending, executor.map(validateList, jobs, chunksize=max(1, len(jobs) // 64))):
+                cache[keys[path]] = result
+    elif pending:
+        cache[keys[pending[0]]] = validateList((pending[0], wavfiles, responseTimesFile))
+    results = dict((path, cache[keys[path]]) for path in paths)
+
+    # session 1 and 2 of the shipped lists should present each shared pseudoword in the other version
+    warnings = dict((path, list(results[path]['warnings'])) for path in paths)
+    for first, second in getSessionPairs(paths):
+        versions = [dict(v for half in results[path]['versions'] for v in half.items()) for path in (first, second)]
+        same = getSameVersions(versions[0], versions[1])
+        if same:
+            warnings[second].append('%d pseudowords in the same version as in %s: %s' % (len(same), os.path.basename(first), ', '.join(same)))
+
+    numErrors = 0
+    numWarnings = 0
+    for path in paths:
+        name = os.path.relpath(path, _thisDir)
+        for e in results[path]['errors']:
+            print('%s: error: %s' % (name, e))
+        for w in warnings[path]:
+            print('%s: warning: %s' % (name, w))
+        numErrors = numErrors + len(results[path]['errors'])
+        numWarnings = numWarnings + len(warnings[path])
+
+    if not args.no_cache and pending:
+        if not args.lists:
+            # drop the results of lists which no longer exist or changed
+            current = set(keys.values())
+            cache = dict((k, v) for k, v in cache.items() if k in current)
+        with open(CACHE_FILE + '.tmp', 'w') as f:
+            json.dump(cache, f)
+        os.replace(CACHE_FILE + '.tmp', CACHE_FILE)
+
+    print('%d lists (%d validated, %d cached): %d errors, %d warnings, %.2f s' % (
+        len(paths), len(pending), len(paths) - len(pending), numErrors, numWarnings, time.perf_counter() - start))
+    sys.exit(1 if numErrors > 0 or (args.strict and numWarnings > 0) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import time
+from collections import OrderedDict
+
+
+def loadSound(wavfile):
+    """
+    Decode a wav file into a PsychoPy sound, using the same settings as the trial code.
+
+    Parameters
+    ----------
+    wavfile : str
+        wave file to load (either absolute path or relative to the current directory)
+    """
+    from psychopy import sound
+    return sound.Sound(wavfile, secs=-1, stereo=True, hamming=True, name="sound stimulus")
+
+
+def soundSize(snd):
+    """
+    Estimate the number of bytes held by a decoded sound.
+
+    Parameters
+    ----------
+    snd : PsychoPy sound
+        sound to estimate the size of. The decoded array (sndArr) is used if available,
+        otherwise the size is derived from duration, sample rate and channels.
+    """
+    sndArr = getattr(snd, 'sndArr', None)
+    if sndArr is not None and hasattr(sndArr, 'nbytes'):
+        return int(sndArr.nbytes)
+    channels = getattr(snd, 'channels', 2)
+    if not isinstance(channels, int) or channels <= 0:
+        channels = 2
+    return int(snd.getDuration() * snd.sampleRate * channels * 4)
+
+
+class AudioCache:
+    """
+    Cache of decoded sounds with a byte budget and least-recently-used eviction.
+
+    All sounds of a run are meant to be decoded once during setup (see preload), so that
+    the trial code only reads from the cache. Requests for files that are not (or no longer)
+    cached are decoded on demand and counted as misses.
+    """
+
+    def __init__(self, maxBytes=1024 * 1024 * 1024, loader=loadSound, sizeOf=soundSize):
+        """
+        Parameters
+        ----------
+        maxBytes : int
+            byte budget of the cache (default: 1 GiB). The least recently used sounds are evicted
+            once the budget is exceeded. A single sound larger than the budget is still kept.
+        loader : callable
+            function decoding a wav file into a sound (default: loadSound)
+        sizeOf : callable
+            function returning the number of bytes held by a sound (default: soundSize)
+        """
+        self.maxBytes = maxBytes
+        self.loader = loader
+        self.sizeOf = sizeOf
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.currentBytes = 0
+        self.decodeTimes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def preload(self, wavfiles):
+        """
+        Decode all specified wav files (duplicates are decoded only once).
+
+        Parameters
+        ----------
+        wavfiles : list of str
+            wave files to load
+
+        Returns
+        -------
+        total decoding time in seconds
+        """
+        start = time.perf_counter()
+        for wavfile in wavfiles:
+            if wavfile not in self.entries:
+                self.load(wavfile)
+        return time.perf_counter() - start
+
+    def load(self, wavfile):
+        """
+        Decode a wav file and store it in the cache, evicting old entries if necessary.
+
+        Parameters
+        ----------
+        wavfile : str
+            wave file to load
+        """
+        start = time.perf_counter()
+        snd = self.loader(wavfile)
+        self.decodeTimes[wavfile] = time.perf_counter() - start
+
+        if wavfile in self.entries:
+            self.remove(wavfile)
+        size = self.sizeOf(snd)
+        self.entries[wavfile] = snd
+        self.sizes[wavfile] = size
+        self.currentBytes = self.currentBytes + size
+
+        while self.currentBytes > self.maxBytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.evictions = self.evictions + 1
+
+        return snd
+
+    def get(self, wavfile):
+        """
+        Return the decoded sound for a wav file. Files which are not cached are decoded on demand.
+
+        Parameters
+        ----------
+        wavfile : str
+            wave file to get
+        """
+        snd = self.entries.get(wavfile)
+        if snd is None:
+            self.misses = self.misses + 1
+            return self.load(wavfile)
+        self.hits = self.hits + 1
+        self.entries.move_to_end(wavfile)
+        return snd
+
+    def remove(self, wavfile):
+        """
+        Remove a wav file from the cache.
+
+        Parameters
+        ----------
+        wavfile : str
+            wave file to remove
+        """
+        del self.entries[wavfile]
+        self.currentBytes = self.currentBytes - self.sizes.pop(wavfile)
+
+    def clear(self):
+        """
+        Remove all sounds from the cache (statistics are kept).
+        """
+        self.entries.clear()
+        self.sizes.clear()
+        self.currentBytes = 0
+
+    def __contains__(self, wavfile):
+        return wavfile in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def summary(self):
+        """
+        Return a one-line summary of the cache state and statistics (e.g. for logging).
+        """
+        decodeTimes = list(self.decodeTimes.values())
+        total = sum(decodeTimes)
+        longest = max(decodeTimes) if decodeTimes else 0
+        return 'Audio cache\t%d files\t%.1f MB\thits %d\tmisses %d\tevictions %d\tdecode total %.3f s\tdecode max %.3f s' % (
+            len(self.entries), self.currentBytes / (1024 * 1024), self.hits, self.misses, self.evictions, total, longest)
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import numpy as np
+
+
+class ContinuousStream:
+    """
+    Plays a sequence of segments (preloaded sounds and silences) as one continuous output stream, so the
+    audio device is started only once per run and the onsets of the segments are exact sample offsets.
+
+    The audio callback copies the segments into the output buffer one after the other. When a block of the
+    callback contains the onset of a segment with a trigger, the time at which this sample reaches the
+    output (DAC time of the block plus the offset of the sample) is converted to time.perf_counter and the
+    trigger is scheduled for this time, so triggers follow the sample clock of the stream instead of the
+    frame loop.
+    """
+
+    def __init__(self, sampleRate, channels=2, blockSize=1024, device=None):
+        """
+        Parameters
+        ----------
+        sampleRate : int
+            sample rate of the stream (all sounds need to have this sample rate)
+        channels : int
+            number of output channels (default: 2)
+        blockSize : int
+            frames per audio callback (default: 1024)
+        device : int or str
+            output device (default: sounddevice's default device)
+        """
+        self.sampleRate = sampleRate
+        self.channels = channels
+        self.blockSize = blockSize
+        self.device = device
+        self.segments = []
+        self.frames = 0
+        self.onsets = []
+        self.underruns = 0
+        self.onTrigger = None
+        self.stream = None
+        self.CallbackStop = StopIteration
+        self.finished = threading.Event()
+
+    def add(self, samples=None, duration=0, trigger=0, label=''):
+        """
+        Append a segment to the stream.
+
+        Parameters
+        ----------
+        samples : numpy array
+            samples of a sound (frames x channels, float32 at the sample rate of the stream).
+            If None, a silence of the specified duration is appended.
+        duration : double
+            duration in seconds of a silence (only used without samples)
+        trigger : int
+            trigger value sent at the onset of the segment (default: 0, no trigger)
+        label : str
+            name of the segment, e.g. the wav file (default: '')
+
+        Returns
+        -------
+        the onset of the segment in frames from the start of the stream
+        """
+        if samples is not None:
+            if samples.ndim != 2 or samples.shape[1] != self.channels:
+                raise ValueError('Expected %d channels, got an array of shape %s' % (self.channels, samples.shape))
+            frames = len(samples)
+        else:
+            frames = int(round(duration * self.sampleRate))
+        onset = self.frames
+        self.segments.append((onset, frames, samples, trigger, label))
+        self.frames = self.frames + frames
+        return onset
+
+    def getDuration(self):
+        return self.frames / self.sampleRate
+
+    def play(self, onTrigger=None):
+        """
+        Open the output stream and start playback. Returns immediately.
+
+        Parameters
+        ----------
+        onTrigger : callable
+            function onTrigger(value, at) called for the trigger of a segment, at is the time of the onset
+            in the time base of time.perf_counter (e.g. TriggerScheduler.pulse with at=at)
+        """
+        import sounddevice as sd
+        self.CallbackStop = sd.CallbackStop
+        self.onTrigger = onTrigger
+        self.position = 0
+        self.segment = 0
+        self.stream = sd.OutputStream(samplerate=self.sampleRate, blocksize=self.blockSize, channels=self.channels,
+                                      dtype='float32', device=self.device, callback=self.callback,
+                                      finished_callback=self.finished.set)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def isFinished(self):
+        return self.finished.is_set()
+
+    def callback(self, outdata, frames, timeInfo, status):
+        """
+        Audio callback of the output stream: copy the next block of the segments into the output buffer.
+        """
+        if status.output_underflow:
+            self.underruns = self.underruns + 1
+        # time.perf_counter of the first sample of this block
+        blockTime = timeInfo.outputBufferDacTime + time.perf_counter() - timeInfo.currentTime
+        start = self.position
+        end = min(start + frames, self.frames)
+        while self.segment < len(self.segments):
+            onset, length, samples, trigger, label = self.segments[self.segment]
+            if onset >= end:
+                break
+            if onset >= start:
+                at = blockTime + (onset - start) / self.sampleRate
+                self.onsets.append((label, onset, at))
+                if trigger and self.onTrigger is not None:
+                    self.onTrigger(trigger, at)
+            a = max(start, onset)
+            b = min(end, onset + length)
+            if samples is None:
+                outdata[a - start:b - start] = 0
+            else:
+                outdata[a - start:b - start] = samples[a - onset:b - onset]
+            if onset + length > end:
+                break
+            self.segment = self.segment + 1
+        outdata[end - start:] = 0
+        self.position = end
+        if end >= self.frames:
+            raise self.CallbackStop()
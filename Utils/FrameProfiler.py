@@ -0,0 +1,262 @@
+import time
+
+import numpy as np
+
+# edges of the histogram bins in milliseconds
+HISTOGRAM_EDGES = [0, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 15, 20, 30, 50, 100, np.inf]
+
+# a flip interval longer than this factor times the frame period counts as dropped frame
+DROPPED_FACTOR = 1.5
+
+
+class RingBuffer:
+    """
+    Preallocated buffer of the last capacity values of a metric (older values are overwritten).
+    """
+
+    __slots__ = ['values', 'capacity', 'count']
+
+    def __init__(self, capacity):
+        self.values = np.zeros(capacity)
+        self.capacity = capacity
+        self.count = 0
+
+    def add(self, value):
+        self.values[self.count % self.capacity] = value
+        self.count = self.count + 1
+
+    def getValues(self):
+        """
+        Return the stored values in the order in which they were added.
+        """
+        if self.count <= self.capacity:
+            return self.values[0:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate([self.values[start:], self.values[0:start]])
+
+
+class RoutineProfiler:
+    """
+    Records the timing of one routine (e.g. presentSound) of a FrameProfiler. All times are durations in seconds.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.clock = profiler.clock
+        self.buffers = {}
+        self.lastTick = None
+        self.lastFlip = None
+
+    def getBuffer(self, metric):
+        buffer = self.buffers.get(metric)
+        if buffer is None:
+            buffer = self.profiler.getBuffer(self.name, metric)
+            self.buffers[metric] = buffer
+        return buffer
+
+    def begin(self):
+        """
+        Start a new run of the routine (the first iteration and flip have no previous one).
+        """
+        self.lastTick = None
+        self.lastFlip = None
+
+    def tick(self):
+        """
+        Call at the beginning of every iteration of the frame loop: records the loop latency (time since the last iteration).
+        """
+        now = self.clock()
+        if self.lastTick is not None:
+            self.getBuffer('loop').add(now - self.lastTick)
+        self.lastTick = now
+
+    def flip(self):
+        """
+        Call right after a flip of the window returned: records the interval since the last flip.
+        """
+        now = self.clock()
+        if self.lastFlip is not None:
+            self.getBuffer('flip').add(now - self.lastFlip)
+        self.lastFlip = now
+
+    def add(self, metric, value):
+        self.getBuffer(metric).add(value)
+
+    def since(self, metric, start):
+        """
+        Record the time since start (a time of the clock of the profiler) and return the current time.
+        """
+        now = self.clock()
+        self.getBuffer(metric).add(now - start)
+        return now
+
+
+class NullRoutineProfiler:
+    """
+    Routine profiler of a disabled FrameProfiler, which records nothing.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def begin(self):
+        pass
+
+    def tick(self):
+        pass
+
+    def flip(self):
+        pass
+
+    def add(self, metric, value):
+        pass
+
+    def since(self, metric, start):
+        return self.clock()
+
+
+class FrameProfiler:
+    """
+    Low-overhead timing instrumentation of the frame loops of a paradigm.
+
+    Each routine (e.g. presentSound, wait, waitForButton) records durations per metric, e.g. the loop
+    latency (time between two iterations), the flip interval, the key-poll latency or the delay between the
+    start of a sound and its trigger, into preallocated ring buffers. Recording a value only writes one
+    array element, so the profiler can stay enabled during real sessions. At the end of a run, report
+    returns the percentiles and histograms of all metrics per routine.
+    """
+
+    def __init__(self, enabled=True, capacity=65536, framePeriod=1 / 60, clock=time.perf_counter):
+        """
+        Parameters
+        ----------
+        enabled : bool
+            record the timing (if False, all recording calls are no-ops)
+        capacity : int
+            maximum number of values per metric and routine (older values are overwritten, default: 65536)
+        framePeriod : double
+            frame period of the monitor in seconds, to count dropped frames (default: 1/60)
+        clock : callable
+            function returning the current time in seconds (default: time.perf_counter, like the trigger scheduler)
+        """
+        self.enabled = enabled
+        self.capacity = capacity
+        self.framePeriod = framePeriod
+        self.clock = clock
+        self.buffers = {}
+        self.routines = {}
+        self.nullRoutine = NullRoutineProfiler(clock)
+
+    def routine(self, name):
+        """
+        Return the profiler of a routine.
+        """
+        if not self.enabled:
+            return self.nullRoutine
+        routine = self.routines.get(name)
+        if routine is None:
+            routine = RoutineProfiler(self, name)
+            self.routines[name] = routine
+        return routine
+
+    def getBuffer(self, routine, metric):
+        key = (routine, metric)
+        if key not in self.buffers:
+            self.buffers[key] = RingBuffer(self.capacity)
+        return self.buffers[key]
+
+    def getValues(self, routine, metric):
+        """
+        Return the recorded values of a metric in seconds (an empty array if nothing was recorded).
+        """
+        buffer = self.buffers.get((routine, metric))
+        return buffer.getValues() if buffer is not None else np.zeros(0)
+
+    def addTriggerLog(self, routine, log, metric='audio.start'):
+        """
+        Record the delay of the trigger onsets and offsets relative to the preceding audio start of a routine.
+
+        Parameters
+        ----------
+        routine : str
+            name of the routine
+        log : list of tuples
+            (scheduled, actual, value) of the trigger writes, see TriggerScheduler.log
+        metric : str
+            metric holding the absolute times at which the sounds were started (clock of the profiler)
+        """
+        if not self.enabled:
+            return
+        starts = self.getValues(routine, metric)
+        if len(starts) == 0:
+            return
+        onset = None
+        for scheduled, actual, value in log:
+            if value != 0 and onset is None:
+                onset = actual
+            elif value == 0 and onset is not None:
+                i = np.searchsorted(starts, onset, side='right') - 1
+                if i >= 0:
+                    self.getBuffer(routine, 'trigger.on').add(onset - starts[i])
+                    self.getBuffer(routine, 'trigger.off').add(actual - starts[i])
+                onset = None
+
+    def summary(self):
+        """
+        Return a one-line summary of the flip intervals and loop latencies of all routines (e.g. for logging).
+        """
+        flips = [self.getValues(name, 'flip') for name, metric in self.buffers if metric == 'flip']
+        loops = [self.getValues(name, 'loop') for name, metric in self.buffers if metric == 'loop']
+        flips = np.concatenate(flips) if flips else np.zeros(0)
+        loops = np.concatenate(loops) if loops else np.zeros(0)
+        return 'Frame timing\t%d flips\tdropped %d\tflip interval p99 %.3f ms\tloop latency p99 %.3f ms\tloop latency max %.3f ms' % (
+            len(flips), np.count_nonzero(flips > DROPPED_FACTOR * self.framePeriod),
+            1000 * np.percentile(flips, 99) if len(flips) else 0,
+            1000 * np.percentile(loops, 99) if len(loops) else 0,
+            1000 * loops.max() if len(loops) else 0)
+
+    def report(self, width=40):
+        """
+        Return the timing report of the run: count, percentiles and histogram of every metric per routine.
+
+        Parameters
+        ----------
+        width : int
+            number of characters of the longest histogram bar (default: 40)
+        """
+        lines = ['Frame timing report (frame period %.3f ms)' % (1000 * self.framePeriod)]
+        for routine in sorted(set(name for name, metric in self.buffers)):
+            lines.append('')
+            lines.append('== %s' % routine)
+            for metric in sorted(metric for name, metric in self.buffers if name == routine):
+                buffer = self.buffers[(routine, metric)]
+                if metric == 'audio.start':
+                    # absolute times, only used to match the triggers
+                    continue
+                values = 1000 * buffer.getValues()
+                if len(values) == 0:
+                    continue
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                lines.append('')
+                lines.append('%s\tn %d%s\tmean %.3f ms\tp50 %.3f ms\tp95 %.3f ms\tp99 %.3f ms\tmax %.3f ms' % (
+                    metric, buffer.count, ' (last %d)' % len(values) if buffer.count > len(values) else '',
+                    values.mean(), p50, p95, p99, values.max()))
+                if metric == 'flip':
+                    lines.append('dropped frames\t%d' % np.count_nonzero(values > DROPPED_FACTOR * 1000 * self.framePeriod))
+                counts, edges = np.histogram(values, bins=HISTOGRAM_EDGES)
+                first = np.flatnonzero(counts)[0]
+                last = np.flatnonzero(counts)[-1]
+                for i in range(first, last + 1):
+                    lines.append('%8g - %-8g ms %7d  %s' % (edges[i], edges[i + 1], counts[i],
+                                                            '#' * int(np.ceil(width * counts[i] / counts.max()))))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename):
+        """
+        Write the report (<filename>_timing.txt) and the recorded values in seconds (<filename>_timing.npz,
+        one array per routine and metric named <routine>/<metric>).
+        """
+        with open(filename + '_timing.txt', 'w') as f:
+            f.write(self.report())
+        np.savez(filename + '_timing.npz', **{'%s/%s' % key: buffer.getValues() for key, buffer in self.buffers.items()})
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from AudioCache import loadSound
+
+
+class Prefetcher:
+    """
+    Background worker which decodes the sounds of upcoming blocks while the current block is running.
+
+    Files are decoded in the order in which they are requested. At most maxBuffers decoded sounds are
+    held at any time (by default the sound that is currently playing and the next one), so the worker
+    only starts decoding the next file after a used sound has been released. If a queued file is needed
+    while the buffers are full, a decoded sound which has not been handed out yet is dropped (and queued
+    again) to make room for it. The cap is only exceeded if all buffers are in use (returned by get and not
+    released yet) or a file is needed which has not been requested; such files are decoded by the caller.
+    For every file, the time needed to decode it is recorded together with the time that was available
+    for it, i.e. the time from the start of decoding until the sound was needed.
+    """
+
+    def __init__(self, loader=loadSound, maxBuffers=2):
+        """
+        Parameters
+        ----------
+        loader : callable
+            function decoding a wav file into a sound (default: AudioCache.loadSound)
+        maxBuffers : int
+            maximum number of decoded sounds held at the same time (default: 2)
+        """
+        self.loader = loader
+        self.maxBuffers = maxBuffers
+        self.queue = deque()
+        self.buffers = OrderedDict()
+        self.inUse = set()
+        self.errors = {}
+        self.records = OrderedDict()
+        self.loading = None
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self, wavfiles=()):
+        """
+        Start the worker thread.
+
+        Parameters
+        ----------
+        wavfiles : list of str
+            wave files to decode, in the order in which they will be needed
+        """
+        with self.condition:
+            self.queue.extend(wavfiles)
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name='Prefetcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the worker thread and drop all buffers.
+        """
+        with self.condition:
+            self.running = False
+            self.queue.clear()
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.buffers.clear()
+        self.inUse.clear()
+
+    def request(self, wavfile):
+        """
+        Add a wave file to the end of the queue of files to decode.
+
+        Parameters
+        ----------
+        wavfile : str
+            wave file to decode
+        """
+        with self.condition:
+            self.queue.append(wavfile)
+            self.condition.notify_all()
+
+    def get(self, wavfile):
+        """
+        Return the decoded sound of a wave file, waiting for the worker if it is not ready yet (a queued file is
+        decoded next, see the class description). Files that have not been requested are decoded in the calling
+        thread.
+
+        Parameters
+        ----------
+        wavfile : str
+            wave file to get
+        """
+        neededAt = time.perf_counter()
+        with self.condition:
+            while self.running and wavfile not in self.buffers and wavfile not in self.errors:
+                if wavfile == self.loading:
+                    self.condition.wait()
+                elif wavfile in self.queue and (len(self.buffers) < self.maxBuffers or self.evict()):
+                    # the worker decodes it next
+                    if self.queue[0] != wavfile:
+                        self.queue.remove(wavfile)
+                        self.queue.appendleft(wavfile)
+                    self.condition.notify_all()
+                    self.condition.wait()
+                else:
+                    # not requested (or all buffers in use): decode it here
+                    if wavfile in self.queue:
+                        self.queue.remove(wavfile)
+                    break
+            if wavfile in self.errors:
+                raise self.errors.pop(wavfile)
+            snd = self.buffers.get(wavfile)
+
+        if snd is None:
+            loadStart = time.perf_counter()
+            snd = self.loader(wavfile)
+            self.records[wavfile] = {'loadStart': loadStart, 'loadEnd': time.perf_counter()}
+            with self.condition:
+                self.buffers[wavfile] = snd
+
+        with self.condition:
+            self.inUse.add(wavfile)
+        record = self.records[wavfile]
+        record['neededAt'] = neededAt
+        record['waited'] = time.perf_counter() - neededAt
+        return snd
+
+    def release(self, wavfile):
+        """
+        Drop the decoded sound of a wave file, so the worker can decode the next one.
+
+        Parameters
+        ----------
+        wavfile : str
+            wave file to release
+        """
+        with self.condition:
+            self.buffers.pop(wavfile, None)
+            self.inUse.discard(wavfile)
+            self.condition.notify_all()
+
+    def evict(self):
+        """
+        Drop the oldest decoded sound which has not been handed out by get and queue its file again (at the front,
+        it was requested before the rest of the queue). Returns False if all buffers are in use.
+        """
+        for wavfile in self.buffers:
+            if wavfile not in self.inUse:
+                del self.buffers[wavfile]
+                self.queue.appendleft(wavfile)
+                return True
+        return False
+
+    def run(self):
+        """
+        Main loop of the worker thread.
+        """
+        while True:
+            with self.condition:
+                while self.running and (not self.queue or len(self.buffers) >= self.maxBuffers):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                wavfile = self.queue.popleft()
+                self.loading = wavfile
+
+            loadStart = time.perf_counter()
+            try:
+                snd = self.loader(wavfile)
+            except Exception as e:
+                with self.condition:
+                    self.loading = None
+                    self.errors[wavfile] = e
+                    self.condition.notify_all()
+                continue
+            loadEnd = time.perf_counter()
+
+            with self.condition:
+                self.loading = None
+                self.records[wavfile] = {'loadStart': loadStart, 'loadEnd': loadEnd}
+                self.buffers[wavfile] = snd
+                self.condition.notify_all()
+
+    def report(self):
+        """
+        Return one line per decoded file with the time the decoding took, the time that was available
+        for it and the time the trial code had to wait for it (all in seconds).
+        """
+        lines = []
+        for wavfile, record in self.records.items():
+            took = record['loadEnd'] - record['loadStart']
+            if 'neededAt' in record:
+                available = record['neededAt'] - record['loadStart']
+                waited = record['waited']
+            else:
+                available = float('nan')
+                waited = float('nan')
+            lines.append('Prefetch\t%.4f\t%.4f\t%.4f\t%s' % (took, available, waited, wavfile))
+        return lines
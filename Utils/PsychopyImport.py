@@ -0,0 +1,25 @@
+def importPsychopy(namespace):
+    """
+    Import PsychoPy (with the PTB audio backend) and its hardware modules into the globals of a paradigm module.
+    PsychoPy takes seconds to import, so the paradigms call this when an experiment is created instead of importing
+    it at the top of the module (see benchmarks/ImportTime.py).
+
+    Parameters
+    ----------
+    namespace : dict
+        globals() of the calling module; prefs, gui, visual, core, data, event, logging, clock, sound, keyboard and
+        the constants NOT_STARTED, STARTED, PLAYING, PAUSED, STOPPED, FINISHED, PRESSED, RELEASED and FOREVER are
+        bound in it
+    """
+    from psychopy import locale_setup
+    from psychopy import prefs
+    prefs.hardware['audioLib'] = ['PTB']
+    from psychopy import gui, visual, core, data, event, logging, clock
+    from psychopy.constants import (NOT_STARTED, STARTED, PLAYING, PAUSED,
+                                    STOPPED, FINISHED, PRESSED, RELEASED, FOREVER)
+    from psychopy import sound
+    from psychopy.hardware import keyboard
+    namespace.update(prefs=prefs, gui=gui, visual=visual, core=core, data=data, event=event, logging=logging,
+                     clock=clock, sound=sound, keyboard=keyboard, NOT_STARTED=NOT_STARTED, STARTED=STARTED,
+                     PLAYING=PLAYING, PAUSED=PAUSED, STOPPED=STOPPED, FINISHED=FINISHED, PRESSED=PRESSED,
+                     RELEASED=RELEASED, FOREVER=FOREVER)
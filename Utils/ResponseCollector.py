@@ -0,0 +1,98 @@
+def getSoundOnset(sound, default):
+    """
+    Return the actual onset of a started sound as reported by the PTB audio backend (time base of core.getTime and
+    of the keyboard events), or default if it is not available.
+
+    Parameters
+    ----------
+    sound : PsychoPy sound
+        sound which has been started with play()
+    default : double
+        onset to return if the backend does not report it, e.g. the time of the play() call
+    """
+    try:
+        onset = sound.track.status['StartTime']
+    except (AttributeError, KeyError, TypeError):
+        return default
+    return onset if onset > 0 else default
+
+
+class ResponseCollector:
+    """
+    Collects the key presses of a trial from the event queue of a PsychoPy keyboard (psychopy.hardware.keyboard).
+
+    With the PTB backend, every press is timestamped by PsychHID when it happens instead of when the queue is
+    polled, so response times are not quantized to the frame period. Response keys and quit keys (escape) are
+    drained from the same queue with a single call per frame.
+    """
+
+    def __init__(self, keyboard, keyList, quitKeys=('escape',)):
+        """
+        Parameters
+        ----------
+        keyboard : psychopy.hardware.keyboard.Keyboard
+            keyboard to read the presses from
+        keyList : list of str
+            response keys
+        quitKeys : list of str
+            keys which quit the experiment (default: escape)
+        """
+        self.keyboard = keyboard
+        self.keyList = list(keyList)
+        self.quitKeys = list(quitKeys)
+        self.allKeys = self.keyList + self.quitKeys
+        self.presses = []
+        self.quit = False
+
+    def start(self):
+        """
+        Discard all pending events and presses, e.g. at the beginning of a trial.
+        """
+        self.keyboard.clearEvents()
+        self.presses = []
+        self.quit = False
+
+    def poll(self):
+        """
+        Drain the event queue of the keyboard.
+
+        Returns
+        -------
+        new presses of response keys as list of (key, time of the press) tuples (time base of core.getTime)
+        """
+        presses = []
+        for key in self.keyboard.getKeys(keyList=self.allKeys, waitRelease=False):
+            if key.name in self.quitKeys:
+                self.quit = True
+            else:
+                presses.append((key.name, key.tDown))
+        self.presses.extend(presses)
+        return presses
+
+    def getPresses(self, after=None, before=None):
+        """
+        Return the presses of response keys in a time window as list of (key, time of the press).
+
+        Parameters
+        ----------
+        after : double
+            start of the window (default: None, all presses since start)
+        before : double
+            end of the window, exclusive (default: None, all presses until now)
+        """
+        return [(key, t) for key, t in self.presses if (after is None or t >= after) and (before is None or t < before)]
+
+    def getFirstPress(self, after, before=None):
+        """
+        Return the first press of a response key at or after the specified time (and before the end of the window)
+        as (key, time of the press), or (None, None) if there is none.
+        """
+        presses = self.getPresses(after, before)
+        return presses[0] if presses else (None, None)
+
+    def format(self, reference, after=None, before=None):
+        """
+        Return the presses of a time window (default: all) as str (key@time relative to reference in seconds,
+        separated by spaces).
+        """
+        return ' '.join('%s@%.4f' % (key, t - reference) for key, t in self.getPresses(after, before))
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+
+def getListHash(items):
+    """
+    Return a hash of a list of str (e.g. the wav files of a run), to check that a resumed run presents the same list.
+    """
+    return hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()
+
+
+def toJson(value):
+    # numpy scalars (e.g. onsets) are stored as Python numbers, everything else as str
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class RunCheckpoint:
+    """
+    Append-only journal of the progress of a run, so an interrupted run (crash or break) can be resumed at the next
+    trial instead of starting again from the beginning.
+
+    The first line describes the run (e.g. stimulus list, run half, seed, data file and a hash of the trial list),
+    every further line a completed trial with its index and the data needed to merge it into the data files of the
+    resumed run. Each line is a json object which is written and synced to disk (fsync) by complete. The paradigms
+    call it between trials, never inside a frame loop. A last line which was only partially written (crash during
+    the write) is ignored by readCheckpoint.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            file of the checkpoint, e.g. data/<participant>_<session>_<expName>_<run>_checkpoint.jsonl
+        """
+        self.filename = filename
+        self.file = None
+
+    def start(self, info=None):
+        """
+        Open the checkpoint. A new checkpoint starts with the description of the run (info), a resumed one (info is
+        None) is continued.
+        """
+        if info is not None:
+            self.file = open(self.filename, 'w')
+            self.write({'run': info})
+        else:
+            self.file = open(self.filename, 'a')
+            self.write({'resumed': True})
+        return self
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, default=toJson) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def complete(self, index, **data):
+        """
+        Record a completed trial and sync the checkpoint to disk.
+
+        Parameters
+        ----------
+        index : int
+            index of the trial in the run
+        data : dict
+            data of the trial, e.g. entries (rows of the data file) and onset (trigger onset)
+        """
+        entry = {'trial': index}
+        entry.update(data)
+        self.write(entry)
+
+    def finish(self):
+        """
+        Mark the run as completed and close the checkpoint.
+        """
+        if self.file is not None:
+            self.write({'finished': True})
+            self.file.close()
+            self.file = None
+
+
+def readCheckpoint(filename):
+    """
+    Read a checkpoint written by RunCheckpoint.
+
+    Parameters
+    ----------
+    filename : str
+        file of the checkpoint
+
+    Returns
+    -------
+    None if there is no checkpoint, otherwise a dictionary with the description of the run (info), the completed
+    trials in the order of completion (trials, list of dictionaries with index and data), the index of the next
+    trial (next) and whether the run was completed (finished)
+    """
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        lines = f.read().split('\n')
+    state = {'info': None, 'trials': [], 'next': 0, 'finished': False}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue  # empty or partially written line
+        if 'run' in entry:
+            state['info'] = entry['run']
+        elif 'trial' in entry:
+            state['trials'].append(entry)
+            state['next'] = max(state['next'], entry['trial'] + 1)
+        elif entry.get('finished'):
+            state['finished'] = True
+    if state['info'] is None:
+        return None
+    return state
@@ -0,0 +1,314 @@
+import os
+import select
+import threading
+import time
+
+import numpy as np
+
+from Timing import sleepUntil
+
+
+class SerialBackend:
+    """
+    Scanner input using pyserial (e.g. COM1 on Windows or a USB serial adapter).
+    """
+
+    def __init__(self, device='COM1', baudrate=19200):
+        """
+        Parameters
+        ----------
+        device : str
+            serial port (default: COM1)
+        baudrate : int
+            baud rate of the port (default: 19200)
+        """
+        import serial
+        self.serial = serial.Serial(device, baudrate, timeout=0)
+
+    def read(self, timeout):
+        """
+        Wait up to timeout seconds for input and return all bytes available (empty if there were none).
+        """
+        self.serial.timeout = timeout
+        data = self.serial.read(1)
+        if data and self.serial.in_waiting:
+            data = data + self.serial.read(self.serial.in_waiting)
+        return data
+
+    def close(self):
+        self.serial.close()
+
+
+class TtyBackend:
+    """
+    Scanner input reading a POSIX terminal device (e.g. /dev/ttyUSB0 or the pty of a FakeScanner) without pyserial.
+    """
+
+    def __init__(self, device='/dev/ttyS0'):
+        """
+        Parameters
+        ----------
+        device : str
+            terminal device (default: /dev/ttyS0)
+        """
+        import tty
+        self.fd = os.open(device, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+
+    def read(self, timeout):
+        """
+        Wait up to timeout seconds for input and return all bytes available (empty if there were none).
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return b''
+        try:
+            return os.read(self.fd, 4096)
+        except BlockingIOError:
+            return b''
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FakeScanner:
+    """
+    Stand-in for an MRI scanner: writes a pulse byte to a pseudo terminal every TR seconds, so the scanner
+    synchronization can be run and its latency measured on a machine without scanner (POSIX only). The
+    send time of every pulse is recorded.
+    """
+
+    def __init__(self, tr=2.0, pulses=None, pulseByte=b'5', clock=time.perf_counter, delay=0.5):
+        """
+        Parameters
+        ----------
+        tr : double
+            interval between two pulses in seconds (default: 2s)
+        pulses : int
+            number of pulses to send (default: None, until stop is called)
+        pulseByte : bytes
+            byte sent for a pulse (default: b'5')
+        clock : callable
+            function returning the current time in seconds (default: time.perf_counter)
+        delay : double
+            time in seconds between start and the first pulse (default: 0.5s)
+        """
+        self.tr = tr
+        self.pulses = pulses
+        self.pulseByte = pulseByte
+        self.clock = clock
+        self.delay = delay
+        self.sent = []
+        self.running = False
+        self.thread = None
+        self.master, self.slave = os.openpty()
+        self.device = os.ttyname(self.slave)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='FakeScanner', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
+
+    def run(self):
+        origin = self.clock() + self.delay
+        n = 0
+        while self.running and (self.pulses is None or n < self.pulses):
+            at = origin + n * self.tr
+            while self.running and at - self.clock() > 0.05:
+                time.sleep(0.05)  # stay responsive to stop
+            if not self.running:
+                return
+            sleepUntil(at, self.clock)
+            self.sent.append(self.clock())
+            os.write(self.master, self.pulseByte)
+            n = n + 1
+
+
+def openScannerPort(backend='serial', device='COM1', baudrate=19200, tr=2.0):
+    """
+    Create the input of the scanner pulses.
+
+    Parameters
+    ----------
+    backend : str
+        'serial' (pyserial), 'tty' (POSIX terminal device) or 'simulated' (FakeScanner on a pseudo terminal)
+    device : str
+        serial port or terminal device (not used by the 'simulated' backend)
+    baudrate : int
+        baud rate (only used by the 'serial' backend)
+    tr : double
+        interval between two pulses in seconds (only used by the 'simulated' backend)
+
+    Returns
+    -------
+    the port, and the FakeScanner for the 'simulated' backend (None otherwise)
+    """
+    if backend == 'serial':
+        return SerialBackend(device, baudrate), None
+    elif backend == 'tty':
+        return TtyBackend(device), None
+    elif backend == 'simulated':
+        scanner = FakeScanner(tr)
+        port = TtyBackend(scanner.device)
+        return port, scanner.start()
+    raise ValueError('Unknown scanner backend "%s". Use either "serial", "tty" or "simulated"' % backend)
+
+
+class ScannerPulseReader:
+    """
+    Reads the pulses of an MRI scanner from a serial port on a background thread.
+
+    The thread blocks on the port and drains all available bytes at once when input arrives, so the main thread
+    never reads the port. Every pulse byte is timestamped when the read returns (in the time base of clock, e.g.
+    the clock of the trigger scheduler) and appended to the list of pulses, which is shared with the paradigm via
+    a condition: waitForPulse blocks until the Nth pulse of the run has been received instead of polling the port.
+    Pulses which arrive in the same read (i.e. the thread was delayed by more than a TR) share a timestamp.
+
+    The latency between a pulse and the event synchronized to it (e.g. the onset of a block) is recorded with
+    addLatency and reported by summary.
+    """
+
+    def __init__(self, port, clock=time.perf_counter, pulseBytes=None, readTimeout=0.1):
+        """
+        Parameters
+        ----------
+        port : scanner port
+            object with read(timeout) and close() methods, see openScannerPort
+        clock : callable
+            function returning the current time in seconds (default: time.perf_counter)
+        pulseBytes : bytes
+            bytes which are pulses, e.g. b'5' (default: None, every non-zero byte is a pulse)
+        readTimeout : double
+            maximum time in seconds the thread blocks on the port before checking whether it should stop
+        """
+        self.port = port
+        self.clock = clock
+        self.pulseBytes = pulseBytes
+        self.readTimeout = readTimeout
+        self.pulses = []
+        self.reads = 0
+        self.latencies = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='ScannerPulseReader', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the reader thread and close the port.
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.port.close()
+
+    def run(self):
+        """
+        Main loop of the reader thread.
+        """
+        while self.running:
+            data = self.port.read(self.readTimeout)
+            if not data:
+                continue
+            now = self.clock()
+            if self.pulseBytes is None:
+                count = sum(1 for value in data if value > 0)
+            else:
+                count = sum(1 for value in data if value in self.pulseBytes)
+            if count:
+                with self.condition:
+                    self.pulses.extend([now] * count)
+                    self.reads = self.reads + 1
+                    self.condition.notify_all()
+
+    def getCount(self):
+        """
+        Return the number of pulses received so far.
+        """
+        return len(self.pulses)
+
+    def waitForPulse(self, n, onPoll=None, pollInterval=0.02, timeout=None):
+        """
+        Wait until the Nth pulse (counted from 1 since the reader was started) has been received.
+
+        Parameters
+        ----------
+        n : int
+            number of the pulse
+        onPoll : callable
+            function without arguments called at least every pollInterval seconds while waiting, e.g. to check
+            for the escape key (default: None)
+        pollInterval : double
+            maximum time in seconds between two calls of onPoll (default: 20ms)
+        timeout : double
+            maximum time in seconds to wait (default: None, no limit)
+
+        Returns
+        -------
+        the time of the pulse (in the time base of clock), or None if the timeout expired
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.condition:
+            while len(self.pulses) < n:
+                if deadline is not None and self.clock() >= deadline:
+                    return None
+                self.condition.wait(pollInterval)
+                if onPoll is not None and len(self.pulses) < n:
+                    self.condition.release()
+                    try:
+                        onPoll()
+                    finally:
+                        self.condition.acquire()
+            return self.pulses[n - 1]
+
+    def waitForNext(self, count=1, onPoll=None, pollInterval=0.02, timeout=None):
+        """
+        Wait for count further pulses (see waitForPulse).
+        """
+        return self.waitForPulse(self.getCount() + count, onPoll, pollInterval, timeout)
+
+    def addLatency(self, pulse, onset):
+        """
+        Record the latency between a pulse and the event synchronized to it (both in the time base of clock).
+        Events without onset (None) are ignored.
+        """
+        if onset is not None:
+            self.latencies.append(onset - pulse)
+
+    def getIntervals(self):
+        """
+        Return the intervals between consecutive pulses in seconds.
+        """
+        return np.diff(self.pulses)
+
+    def summary(self):
+        """
+        Return a one-line summary of the pulses and the synchronization latency (e.g. for logging).
+        """
+        intervals = self.getIntervals()
+        latencies = np.array(self.latencies)
+        return 'Scanner\t%d pulses\t%d reads\tTR mean %.4f s\tTR sd %.3f ms\tpulse-to-onset latency mean %.3f ms\tmax %.3f ms' % (
+            len(self.pulses), self.reads,
+            intervals.mean() if len(intervals) else 0,
+            1000 * intervals.std() if len(intervals) else 0,
+            1000 * latencies.mean() if len(latencies) else 0,
+            1000 * latencies.max() if len(latencies) else 0)
@@ -0,0 +1,284 @@
+import glob
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from StreamingSound import getSampleType
+from WavManifest import readWavHeader
+
+# byte alignment of the arrays in the bank file
+ALIGNMENT = 64
+
+# version of the bank format and of the processing, stored in the index (a bank with another version is rebuilt)
+VERSION = 1
+
+
+def makeRamp(frames):
+    """
+    Return a raised-cosine onset ramp of the specified number of frames (reverse it for the offset).
+    """
+    return (0.5 - 0.5 * np.cos(np.pi * np.arange(frames) / max(frames, 1))).astype(np.float32)
+
+
+def resample(samples, sourceRate, targetRate):
+    """
+    Resample an array of samples (frames x channels) to another sample rate, using a polyphase filter
+    if scipy is available and linear interpolation otherwise.
+    """
+    if sourceRate == targetRate:
+        return samples
+    try:
+        from scipy.signal import resample_poly
+        divisor = math.gcd(int(sourceRate), int(targetRate))
+        return resample_poly(samples, targetRate // divisor, sourceRate // divisor, axis=0).astype(np.float32)
+    except ImportError:
+        frames = int(round(len(samples) * targetRate / sourceRate))
+        positions = np.arange(frames) * (sourceRate / targetRate)
+        source = np.arange(len(samples))
+        return np.stack([np.interp(positions, source, samples[:, c]) for c in range(samples.shape[1])], axis=1).astype(np.float32)
+
+
+def bakeFile(job):
+    """
+    Read a wav file and convert it to the format of the bank: float32 at the target sample rate with
+    the target number of channels and onset/offset ramps applied.
+
+    Parameters
+    ----------
+    job : tuple
+        (wav file, target sample rate, channels, ramp duration in seconds)
+
+    Returns
+    -------
+    numpy array (frames x channels)
+    """
+    wavfile, sampleRate, channels, rampDuration = job
+    header = readWavHeader(wavfile)
+    dtype, scale = getSampleType(header)
+    count = header['frames'] * header['channels']
+    samples = np.fromfile(wavfile, dtype=dtype, count=count, offset=header['dataOffset'])
+    samples = samples.reshape(-1, header['channels']).astype(np.float32) * np.float32(scale)
+    samples = resample(samples, header['sampleRate'], sampleRate)
+    if samples.shape[1] != channels:
+        # mono to stereo: the same signal on all channels, otherwise the mean of all channels
+        samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1)
+    ramp = makeRamp(min(int(rampDuration * sampleRate), len(samples) // 2))
+    samples[0:len(ramp)] *= ramp[:, None]
+    if len(ramp):
+        samples[-len(ramp):] *= ramp[::-1, None]
+    return np.ascontiguousarray(samples, dtype=np.float32)
+
+
+def findWavfiles(directories):
+    """
+    Return all wav files in the specified folders (without subfolders), sorted by path.
+    """
+    wavfiles = []
+    for directory in directories:
+        for item in os.scandir(directory):
+            if item.is_file() and item.name.lower().endswith('.wav'):
+                wavfiles.append(item.path)
+    return sorted(wavfiles)
+
+
+class StimulusBank:
+    """
+    Packed bank of preprocessed stimuli: all wav files of the stimulus folders converted once (see bake) to
+    float32 at the sample rate of the output device, with the channels of the output and onset/offset ramps
+    already applied. The samples are stored in a single binary file (<name>.bin) and located by an index
+    (<name>.json), so the trial code gets a ready-to-play array by memory-mapping the bank instead of decoding,
+    resampling and ramping the same file for every presentation.
+
+    Entries are keyed by the path of the wav file relative to the folder of the bank.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            bank file without extension, e.g. stimulus_bank (creates stimulus_bank.bin and stimulus_bank.json)
+        """
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.index = None
+        self.data = None
+
+    def exists(self):
+        return os.path.exists(self.filename + '.json') and os.path.exists(self.filename + '.bin')
+
+    def getKey(self, wavfile):
+        return os.path.relpath(os.path.abspath(wavfile), self.directory).replace(os.sep, '/')
+
+    def readIndex(self):
+        if not self.exists():
+            return None
+        try:
+            with open(self.filename + '.json') as f:
+                index = json.load(f)
+        except ValueError:
+            return None
+        return index if index.get('version') == VERSION else None
+
+    def bake(self, directories, sampleRate=48000, channels=2, rampDuration=0.015, workers=None):
+        """
+        Convert all wav files of the specified folders into the bank. Files which did not change since the
+        last bake (same size and modification time, same parameters) are copied from the existing bank.
+
+        Parameters
+        ----------
+        directories : list of str
+            folders with wav files (subfolders are not included), e.g. SemanticIntegration/wav
+        sampleRate : int
+            sample rate of the output device (default: 48000)
+        channels : int
+            number of output channels (default: 2)
+        rampDuration : double
+            duration in seconds of the onset and offset ramps (default: 15ms, like hamming=True)
+        workers : int
+            number of worker processes (default: number of CPUs)
+
+        Returns
+        -------
+        number of baked and number of reused files
+        """
+        params = {'sampleRate': sampleRate, 'channels': channels, 'rampDuration': rampDuration}
+        old = self.readIndex()
+        if old is not None and any(old[k] != v for k, v in params.items()):
+            old = None
+        self.close()
+
+        wavfiles = findWavfiles(directories)
+        sources = {}
+        pending = []
+        for wavfile in wavfiles:
+            stat = os.stat(wavfile)
+            key = self.getKey(wavfile)
+            sources[key] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+            entry = old['files'].get(key) if old is not None else None
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                pending.append(wavfile)
+        if old is not None and not pending and set(old['files']) == set(sources):
+            return 0, len(wavfiles)
+
+        oldData = None
+        if old is not None:
+            oldData = np.memmap(self.filename + '.bin', dtype=np.float32, mode='r')
+        index = dict(params, version=VERSION, files={})
+        offset = 0
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # baked files are written in order as they come in, so the bank is never held in memory as a whole
+        jobs = [(wavfile, sampleRate, channels, rampDuration) for wavfile in pending]
+        baked = executor.map(bakeFile, jobs)
+        pending = set(pending)
+        with executor, open(self.filename + '.bin.tmp', 'wb') as f:
+            for wavfile in wavfiles:
+                key = self.getKey(wavfile)
+                if wavfile in pending:
+                    samples = next(baked)
+                    frames = len(samples)
+                else:
+                    entry = old['files'][key]
+                    frames = entry['frames']
+                    start = entry['offset'] // 4
+                    samples = oldData[start:start + frames * channels]
+                f.write(np.ascontiguousarray(samples).tobytes())
+                index['files'][key] = dict(sources[key], offset=offset, frames=frames)
+                offset = offset + frames * channels * 4
+                padding = -offset % ALIGNMENT
+                f.write(b'\0' * padding)
+                offset = offset + padding
+        del oldData
+
+        os.replace(self.filename + '.bin.tmp', self.filename + '.bin')
+        with open(self.filename + '.json.tmp', 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(self.filename + '.json.tmp', self.filename + '.json')
+        return len(pending), len(wavfiles) - len(pending)
+
+    def open(self):
+        """
+        Memory-map the bank for reading.
+        """
+        self.index = self.readIndex()
+        if self.index is None:
+            raise IOError('%s is not a stimulus bank (run StimulusBank.py to create it)' % self.filename)
+        self.sampleRate = self.index['sampleRate']
+        self.channels = self.index['channels']
+        self.data = np.memmap(self.filename + '.bin', dtype=np.float32, mode='r')
+
+    def close(self):
+        self.data = None
+        self.index = None
+
+    def contains(self, wavfile):
+        """
+        Check if the bank holds a wav file which did not change since it was baked.
+        """
+        if self.data is None:
+            self.open()
+        entry = self.index['files'].get(self.getKey(wavfile))
+        if entry is None:
+            return False
+        stat = os.stat(wavfile)
+        return entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+
+    def get(self, wavfile):
+        """
+        Return the samples of a wav file as read-only array (frames x channels), without copying.
+
+        Parameters
+        ----------
+        wavfile : str
+            wav file (either absolute path or relative to the current directory)
+        """
+        if self.data is None:
+            self.open()
+        key = self.getKey(wavfile)
+        if key not in self.index['files']:
+            raise KeyError('%s is not in the stimulus bank %s' % (key, self.filename))
+        entry = self.index['files'][key]
+        start = entry['offset'] // 4
+        return self.data[start:start + entry['frames'] * self.channels].reshape(-1, self.channels)
+
+    def getLoader(self, fallback):
+        """
+        Return a function creating a PsychoPy sound from the bank (without resampling or ramps, which are
+        already applied). Files which are not in the bank or changed since it was baked are loaded by fallback.
+
+        Parameters
+        ----------
+        fallback : callable
+            function decoding a wav file into a sound, e.g. AudioCache.loadSound
+        """
+        def load(wavfile):
+            if not self.contains(wavfile):
+                return fallback(wavfile)
+            from psychopy import sound
+            return sound.Sound(self.get(wavfile), sampleRate=self.sampleRate, stereo=self.channels == 2,
+                               hamming=False, name="sound stimulus")
+        return load
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description='Bake the stimulus folders into a packed bank at the device sample rate')
+    parser.add_argument('directories', nargs='*', help='folders with wav files (default: SemanticIntegration/wav and Localizer/stimuli/*Mono)')
+    parser.add_argument('--bank', default=os.path.join(root, 'stimulus_bank'), help='bank file without extension (default: stimulus_bank in the repository)')
+    parser.add_argument('--rate', type=int, default=48000, help='sample rate of the output device (default: 48000)')
+    parser.add_argument('--channels', type=int, default=2, help='number of output channels (default: 2)')
+    parser.add_argument('--ramp', type=float, default=0.015, help='onset/offset ramp in seconds (default: 0.015)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+    directories = args.directories
+    if not directories:
+        directories = [d for d in [os.path.join(root, 'SemanticIntegration', 'wav')] +
+                       sorted(glob.glob(os.path.join(root, 'Localizer', 'stimuli', '*Mono'))) if os.path.isdir(d)]
+    start = time.perf_counter()
+    baked, reused = StimulusBank(args.bank).bake(directories, args.rate, args.channels, args.ramp, args.workers)
+    print('%d files baked, %d unchanged, %.2f s' % (baked, reused, time.perf_counter() - start))
@@ -0,0 +1,190 @@
+import mmap
+import os
+import threading
+
+import numpy as np
+
+from WavManifest import WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, readWavHeader
+
+
+def getResidentMemory():
+    """
+    Return the resident memory (RSS) of the process in bytes, or None if it cannot be determined.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def getSampleType(header):
+    """
+    Return the numpy type of the samples of a wav file (see WavManifest.readWavHeader) and the
+    factor scaling them to [-1, 1].
+    """
+    if header['formatTag'] == WAVE_FORMAT_PCM and header['bitsPerSample'] == 16:
+        return np.dtype('<i2'), 1 / 32768
+    if header['formatTag'] == WAVE_FORMAT_PCM and header['bitsPerSample'] == 32:
+        return np.dtype('<i4'), 1 / 2147483648
+    if header['formatTag'] == WAVE_FORMAT_IEEE_FLOAT and header['bitsPerSample'] == 32:
+        return np.dtype('<f4'), 1.0
+    raise ValueError('Unsupported wav format (format %d, %d bits)' % (header['formatTag'], header['bitsPerSample']))
+
+
+class StreamingSound:
+    """
+    Plays a wav file by streaming its samples from a memory map to a sounddevice output stream,
+    instead of decoding the whole file into memory first.
+
+    The audio callback reads each block directly from the mapped file (the only copy is the conversion
+    into the output buffer). Pages ahead of the playback position are requested from the operating
+    system (read-ahead window) and pages that have been played are released again, so the resident
+    memory stays at about the read-ahead window regardless of the length and number of files.
+    Mono files are played on both channels and onset/offset ramps are applied while streaming
+    (like hamming=True for PsychoPy sounds).
+    """
+
+    def __init__(self, wavfile, channels=2, blockSize=1024, readAhead=1.0, rampDuration=0.015, device=None):
+        """
+        Parameters
+        ----------
+        wavfile : str
+            wave file to play (PCM 16/32 bit or float 32 bit)
+        channels : int
+            number of output channels (default: 2)
+        blockSize : int
+            frames per audio callback (default: 1024)
+        readAhead : double
+            duration in seconds of the read-ahead window (default: 1s)
+        rampDuration : double
+            duration in seconds of the onset and offset ramps (default: 15ms)
+        device : int or str
+            output device (default: sounddevice's default device)
+        """
+        self.wavfile = wavfile
+        self.channels = channels
+        self.blockSize = blockSize
+        self.device = device
+        self.header = readWavHeader(wavfile)
+        self.sampleRate = self.header['sampleRate']
+        self.dtype, self.scale = getSampleType(self.header)
+        self.fileChannels = self.header['channels']
+        self.frames = self.header['frames']
+
+        self.file = open(wavfile, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.samples = np.frombuffer(self.map, dtype=self.dtype, count=self.frames * self.fileChannels,
+                                     offset=self.header['dataOffset']).reshape(self.frames, self.fileChannels)
+        self.advise(mmap.MADV_SEQUENTIAL if hasattr(mmap, 'MADV_SEQUENTIAL') else None, 0, len(self.map))
+
+        self.pageSize = mmap.PAGESIZE
+        self.frameBytes = self.dtype.itemsize * self.fileChannels
+        self.readAheadFrames = max(blockSize, int(readAhead * self.sampleRate))
+        self.advisedUntil = 0
+        self.releasedUntil = 0
+
+        rampFrames = min(int(rampDuration * self.sampleRate), self.frames // 2)
+        self.ramp = (0.5 - 0.5 * np.cos(np.pi * np.arange(rampFrames) / max(rampFrames, 1))).astype(np.float32)
+        self.block = np.zeros((blockSize, self.fileChannels), dtype=np.float32)
+
+        self.position = 0
+        self.underruns = 0
+        self.onset = None
+        self.startTime = None
+        self.stream = None
+        self.CallbackStop = StopIteration
+        self.finished = threading.Event()
+
+    def advise(self, advice, start, length):
+        """
+        Give the operating system a hint on the use of a range of the memory map (ignored if madvise
+        is not available, e.g. on Windows).
+        """
+        if advice is None or not hasattr(self.map, 'madvise') or length <= 0:
+            return
+        try:
+            self.map.madvise(advice, start, length)
+        except (OSError, ValueError):
+            pass
+
+    def getDuration(self):
+        return self.frames / self.sampleRate
+
+    def play(self):
+        """
+        Open the output stream and start playback. Returns immediately.
+        """
+        import sounddevice as sd
+        self.CallbackStop = sd.CallbackStop
+        self.stream = sd.OutputStream(samplerate=self.sampleRate, blocksize=self.blockSize, channels=self.channels,
+                                      dtype='float32', device=self.device, callback=self.callback,
+                                      finished_callback=self.finished.set)
+        self.updateWindow()
+        self.startTime = self.stream.time
+        self.stream.start()
+
+    def stop(self):
+        """
+        Stop playback (if running) and release the memory map.
+        """
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        if self.map is not None:
+            self.samples = None
+            self.map.close()
+            self.map = None
+            self.file.close()
+
+    def isFinished(self):
+        return self.finished.is_set()
+
+    def updateWindow(self):
+        """
+        Request the pages of the read-ahead window and release the pages that have been played.
+        """
+        offset = self.header['dataOffset']
+        ahead = min(self.frames, self.position + self.readAheadFrames)
+        if ahead > self.advisedUntil:
+            start = (offset + self.advisedUntil * self.frameBytes) // self.pageSize * self.pageSize
+            self.advise(getattr(mmap, 'MADV_WILLNEED', None), start, offset + ahead * self.frameBytes - start)
+            self.advisedUntil = min(self.frames, ahead + self.readAheadFrames // 2)
+        played = (offset + self.position * self.frameBytes) // self.pageSize * self.pageSize
+        if played - self.releasedUntil >= self.readAheadFrames * self.frameBytes // 2:
+            self.advise(getattr(mmap, 'MADV_DONTNEED', None), self.releasedUntil, played - self.releasedUntil)
+            self.releasedUntil = played
+
+    def callback(self, outdata, frames, timeInfo, status):
+        """
+        Audio callback of the output stream: copy the next block from the memory map into the output buffer.
+        """
+        if status.output_underflow:
+            self.underruns = self.underruns + 1
+        if self.onset is None:
+            self.onset = timeInfo.outputBufferDacTime
+
+        start = self.position
+        end = min(start + frames, self.frames)
+        n = end - start
+        block = self.block[0:n]
+        np.multiply(self.samples[start:end], np.float32(self.scale), out=block)
+        if start < len(self.ramp):
+            k = min(end, len(self.ramp))
+            block[0:k - start] *= self.ramp[start:k, None]
+        offsetStart = self.frames - len(self.ramp)
+        if end > offsetStart:
+            k = max(start, offsetStart)
+            block[k - start:n] *= self.ramp[::-1][k - offsetStart:end - offsetStart, None]
+        outdata[0:n] = block
+        outdata[n:] = 0
+        self.position = end
+        self.updateWindow()
+        if end >= self.frames:
+            raise self.CallbackStop()
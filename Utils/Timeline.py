@@ -0,0 +1,163 @@
+import numpy as np
+
+from Timing import waitUntil
+
+
+class Timeline:
+    """
+    Run of a paradigm compiled into events with absolute onsets, offsets and triggers before it starts.
+
+    Events are appended one after the other (add), each followed by a pause, e.g. the response window of a
+    trial or the ITI of a block. After compile, all times are arrays relative to the start of the run, so
+    run executes every event at origin + onset of the same clock instead of deriving the timing of a trial
+    from the end of the previous one, and timing errors cannot add up over the run. The scheduled and actual
+    onset of every event are recorded (see report).
+    """
+
+    def __init__(self):
+        self.items = []
+        self.labels = []
+        self.triggerList = []
+        self.durationList = []
+        self.pauses = []
+        self.compiled = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, duration, item=None, trigger=0, label='', pause=0.0):
+        """
+        Append an event.
+
+        Parameters
+        ----------
+        duration : double
+            duration of the event in seconds (e.g. of the sound)
+        item : str
+            stimulus of the event, e.g. a wav file (default: None, e.g. for fixation blocks)
+        trigger : int
+            trigger value sent at the onset (default: 0, no trigger)
+        label : str
+            name of the event, e.g. condition or block type (default: '')
+        pause : double
+            time in seconds between the end of the event and the onset of the next one (default: 0)
+        """
+        self.items.append(item)
+        self.labels.append(label)
+        self.triggerList.append(trigger)
+        self.durationList.append(duration)
+        self.pauses.append(pause)
+        self.compiled = False
+
+    def compile(self):
+        """
+        Compute the onsets (relative to the start of the run), offsets and ends (onset of the next event)
+        of all events. Returns the timeline.
+        """
+        self.durations = np.array(self.durationList, dtype=float)
+        self.triggers = np.array(self.triggerList, dtype=int)
+        slots = self.durations + np.array(self.pauses, dtype=float)
+        self.ends = np.cumsum(slots)
+        self.onsets = self.ends - slots
+        self.offsets = self.onsets + self.durations
+        self.actual = np.full(len(self), np.nan)
+        self.origin = None
+        self.compiled = True
+        return self
+
+    def getDuration(self):
+        if not self.compiled:
+            self.compile()
+        return self.ends[-1] if len(self) else 0.0
+
+    def run(self, clock, origin, prepare=None, started=None, finished=None, onPoll=None, lead=0.0,
+            spinWindow=0.002, pollInterval=0.02):
+        """
+        Execute the events against a single clock.
+
+        For every event, prepare is called lead seconds before its onset (e.g. to start a sound at the onset with
+        PTB's scheduling and to schedule its trigger), the loop waits until the onset and then calls started.
+        Once the next event has started (or the run has ended), finished is called for the event. Between the
+        events, the thread sleeps and calls onPoll at least every pollInterval seconds (see Timing.waitUntil).
+
+        Parameters
+        ----------
+        clock : callable
+            function returning the current time in seconds, e.g. psychtoolbox.GetSecs
+        origin : double
+            time of the start of the run (in the time base of clock), at least lead seconds in the future
+        prepare : callable
+            function prepare(index, at) with at the absolute onset of the event (default: None)
+        started : callable
+            function started(index, at, now) returning the actual onset of the event, with now the time at which
+            the wait for the onset returned (default: None, now is the actual onset)
+        finished : callable
+            function finished(index) (default: None)
+        onPoll : callable
+            function without arguments called while waiting, e.g. to check for the escape key (default: None)
+        lead : double
+            time in seconds between prepare and the onset (default: 0)
+        spinWindow : double
+            duration in seconds of the final busy-wait before an onset (default: 2ms). Use 0 if the onsets are
+            executed by other threads (e.g. scheduled sounds and triggers), which would have to wait for the GIL.
+        pollInterval : double
+            maximum time in seconds between two calls of onPoll (default: 20ms)
+        """
+        if not self.compiled:
+            self.compile()
+        self.origin = origin
+        for i in range(len(self)):
+            at = origin + self.onsets[i]
+            waitUntil(at - lead, clock, spinWindow, pollInterval, onPoll)
+            if prepare is not None:
+                prepare(i, at)
+            now = waitUntil(at, clock, spinWindow, pollInterval, onPoll)
+            self.actual[i] = started(i, at, now) if started is not None else now
+            if i > 0 and finished is not None:
+                finished(i - 1)
+        waitUntil(origin + self.getDuration(), clock, spinWindow, pollInterval, onPoll)
+        if len(self) and finished is not None:
+            finished(len(self) - 1)
+
+    def getErrors(self):
+        """
+        Return the difference between the actual and the scheduled onset of every event in seconds.
+        """
+        return self.actual - (self.origin + self.onsets)
+
+    def getDrift(self):
+        """
+        Return the drift of the onsets in seconds per second: slope of the onset errors over the run (0 if there
+        are less than two events with an actual onset).
+        """
+        errors = self.getErrors()
+        valid = np.isfinite(errors)
+        if np.count_nonzero(valid) < 2:
+            return 0.0
+        return float(np.polyfit(self.onsets[valid], errors[valid], 1)[0])
+
+    def summary(self):
+        """
+        Return a one-line summary of the onset errors of the run (e.g. for logging).
+        """
+        errors = self.getErrors()
+        errors = errors[np.isfinite(errors)]
+        return 'Timeline\t%d events\t%.3f s\terror mean %.3f ms\terror max %.3f ms\tdrift %.4f ms/min' % (
+            len(self), self.getDuration(),
+            1000 * errors.mean() if len(errors) else 0,
+            1000 * errors[np.argmax(np.abs(errors))] if len(errors) else 0,
+            1000 * 60 * self.getDrift())
+
+    def report(self):
+        """
+        Return one line per event (index, label, trigger, scheduled and actual onset relative to the start of the
+        run, error in ms, item) and the summary.
+        """
+        lines = []
+        errors = self.getErrors()
+        for i in range(len(self)):
+            lines.append('Event\t%d\t%s\t%d\t%.6f\t%.6f\t%.3f\t%s' % (
+                i, self.labels[i], self.triggers[i], self.onsets[i], self.actual[i] - self.origin, 1000 * errors[i],
+                self.items[i] if self.items[i] is not None else ''))
+        lines.append(self.summary())
+        return lines
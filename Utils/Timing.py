@@ -0,0 +1,63 @@
+import time
+
+
+def waitUntil(deadline, clock=time.perf_counter, spinWindow=0.002, pollInterval=0.05, onPoll=None):
+    """
+    Wait until the specified time. The thread sleeps for most of the interval and only
+    busy-waits (spins) during the final spinWindow seconds, where the sleep granularity of
+    the operating system would otherwise add an error of up to a few milliseconds.
+    While sleeping, the thread wakes up at least every pollInterval seconds to call onPoll
+    (e.g. to check for the escape key).
+
+    Parameters
+    ----------
+    deadline : double
+        time to wait for (in the time base of clock)
+    clock : callable
+        function returning the current time in seconds (default: time.perf_counter)
+    spinWindow : double
+        duration in seconds of the final busy-wait (default: 2ms)
+    pollInterval : double
+        maximum time in seconds between two calls of onPoll (default: 50ms)
+    onPoll : callable
+        function without arguments called while waiting (default: None)
+
+    Returns
+    -------
+    the time at which the function returned
+    """
+    now = clock()
+    while deadline - now > spinWindow:
+        if onPoll is not None:
+            onPoll()
+        time.sleep(min(pollInterval, deadline - now - spinWindow))
+        now = clock()
+    if onPoll is not None:
+        onPoll()
+    while now < deadline:
+        now = clock()
+    return now
+
+
+def preciseWait(duration, clock=time.perf_counter, spinWindow=0.002, pollInterval=0.05, onPoll=None):
+    """
+    Wait for the specified duration, see waitUntil.
+
+    Parameters
+    ----------
+    duration : double
+        time in seconds to wait
+    """
+    return waitUntil(clock() + duration, clock, spinWindow, pollInterval, onPoll)
+
+
+def sleepUntil(deadline, clock=time.perf_counter, spinWindow=0.002):
+    """
+    Wait until the specified time without polling, see waitUntil.
+
+    Parameters
+    ----------
+    deadline : double
+        time to wait for (in the time base of clock)
+    """
+    return waitUntil(deadline, clock, spinWindow, pollInterval=float('inf'))
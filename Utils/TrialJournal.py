@@ -0,0 +1,179 @@
+import atexit
+import csv
+import os
+import threading
+from collections import deque
+
+
+class TrialJournal:
+    """
+    Crash-safe journal of the trials of a run, written by a background thread.
+
+    The trial code only appends tuples to a deque (atomic, no lock and no formatting), for trial records
+    with a fixed set of fields as well as for log messages. The worker formats the records, appends them
+    to a csv-file and syncs it to disk every interval seconds, so the trials of a crashed run can be
+    recovered from the journal (see readJournal). Log messages are formatted and passed on to a logging
+    function with the time at which they were pushed by flushLog, which the trial code calls between trials
+    (the logging of PsychoPy is not thread-safe).
+    """
+
+    def __init__(self, filename, fields, log=None, interval=0.25):
+        """
+        Parameters
+        ----------
+        filename : str
+            csv-file of the journal (records are appended if it exists)
+        fields : list of str
+            names of the fields of a trial record
+        log : callable
+            function log(msg, t) called by flushLog for every log message (default: None, messages are dropped)
+        interval : double
+            time in seconds between two writes of the worker (default: 250ms)
+        """
+        self.filename = filename
+        self.fields = list(fields)
+        self.log = log
+        self.interval = interval
+        self.records = deque()
+        self.messages = deque()
+        self.written = 0
+        self.running = False
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.file = None
+
+    def start(self):
+        """
+        Open the journal and start the worker thread.
+        """
+        exists = os.path.exists(self.filename) and os.path.getsize(self.filename) > 0
+        self.file = open(self.filename, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(self.fields)
+            self.sync()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='TrialJournal', daemon=True)
+        self.thread.start()
+        # also write the pending records if the experiment is quit (e.g. by core.quit)
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """
+        Write all pending records and messages, stop the worker thread and close the journal.
+        """
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flushLog()
+        if self.file is not None:
+            self.drain()
+            self.file.close()
+            self.file = None
+
+    def push(self, *values):
+        """
+        Add a trial record (one value per field, in the order of the fields).
+        """
+        if len(values) != len(self.fields):
+            raise ValueError('Expected %d values (%s), got %d' % (len(self.fields), ', '.join(self.fields), len(values)))
+        self.records.append(values)
+
+    def pushLog(self, t, msg, args=()):
+        """
+        Add a log message. It is formatted (msg % args) and logged by flushLog.
+
+        Parameters
+        ----------
+        t : double
+            time of the event (passed to the logging function)
+        msg : str
+            message or format string
+        args : tuple
+            arguments of the format string (default: none)
+        """
+        self.messages.append((t, msg, args))
+
+    def flush(self):
+        """
+        Ask the worker to write the pending records now (e.g. at the end of a trial).
+        """
+        self.wakeup.set()
+
+    def flushLog(self):
+        """
+        Format all pending log messages and pass them on to the logging function (in the calling thread).
+        """
+        while self.messages:
+            t, msg, args = self.messages.popleft()
+            if self.log is not None:
+                self.log(msg % args if args else msg, t)
+
+    def run(self):
+        """
+        Main loop of the worker thread.
+        """
+        while self.running:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.drain()
+
+    def drain(self):
+        """
+        Append all pending records to the journal.
+        """
+        if not self.records:
+            return
+        while self.records:
+            self.writer.writerow(self.records.popleft())
+            self.written = self.written + 1
+        self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+def readJournal(filename):
+    """
+    Read the trial records of a journal, e.g. to recover the data of a crashed run.
+    A last line which was only partially written is ignored.
+
+    Parameters
+    ----------
+    filename : str
+        csv-file of the journal
+
+    Returns
+    -------
+    list of dictionaries (field -> value as str)
+    """
+    with open(filename, newline='') as f:
+        content = f.read()
+    complete = content.endswith('\n')
+    rows = list(csv.reader(content.splitlines()))
+    if not rows:
+        return []
+    fields = rows[0]
+    records = rows[1:]
+    if records and not complete:
+        records = records[:-1]
+    return [dict(zip(fields, r)) for r in records if len(r) == len(fields)]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Recover the trials of a (crashed) run from its journal')
+    parser.add_argument('journal', help='csv-file of the journal, e.g. data/<participant>_SemanticIntegration_<run>_<date>_trials.csv')
+    parser.add_argument('--output', default=None, help='write the complete records to this csv-file')
+    args = parser.parse_args()
+    records = readJournal(args.journal)
+    print('%d complete trials' % len(records))
+    if args.output is not None and records:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0].keys()))
+            writer.writeheader()
+            writer.writerows(records)
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+
+import numpy as np
+
+
+def getItemNumber(wavfile):
+    """
+    Return the item code of a wav file from the number at the end of its name: the number itself (e.g. 17 for
+    expected_17.wav or pseudoword_17a.wav) or the number + 128 for the b variant of an item (pseudoword_17b.wav),
+    0 if the name does not end with a number.
+    """
+    match = re.search(r'(\d+)([ab]?)$', os.path.splitext(os.path.basename(wavfile))[0])
+    if not match:
+        return 0
+    number = int(match.group(1))
+    if number >= 128:
+        raise ValueError('Item number of %s does not fit into 7 bits' % wavfile)
+    return number + 128 if match.group(2) == 'b' else number
+
+
+class TriggerPlan:
+    """
+    Trigger codes of the trials of a run, resolved from the stimulus list before the run starts.
+
+    The condition code of every trial is looked up once when the plan is created and stored in an integer array
+    (codes), so sending the trigger of a trial is a single array lookup and port write. Optionally, the item
+    number of every trial (see getItemNumber) is sent as a second pulse itemDelay seconds after the condition
+    code (itemCodes), so the EEG file alone identifies the stimulus of every trial: a pulse which follows a
+    condition code after itemDelay is an item number, not a condition. itemDelay has to be larger than the pulse
+    width of the trigger scheduler.
+
+    The onsets of the triggers are recorded while the run is going on and written to a BIDS-style events file
+    after the run (see save).
+    """
+
+    def __init__(self, wavfiles, conditions, conditionCodes, durations=None, itemCodes=False, itemDelay=0.15):
+        """
+        Parameters
+        ----------
+        wavfiles : list of str
+            wav file of each trial
+        conditions : list of str
+            condition of each trial
+        conditionCodes : dict
+            trigger code of each condition (trials of other conditions get code 0 and no trigger)
+        durations : list of double
+            duration of each trial's sound in seconds (default: None, not known)
+        itemCodes : bool
+            send the item number of each trial as a second pulse (default: False)
+        itemDelay : double
+            time in seconds between the condition code and the item number (default: 150ms)
+        """
+        self.wavfiles = list(wavfiles)
+        self.conditions = list(conditions)
+        self.conditionCodes = dict(conditionCodes)
+        self.codes = np.array([self.conditionCodes.get(c, 0) for c in self.conditions], dtype=int)
+        if itemCodes:
+            self.itemCodes = np.array([getItemNumber(w) for w in self.wavfiles], dtype=int)
+        else:
+            self.itemCodes = np.zeros(len(self.wavfiles), dtype=int)
+        self.itemDelay = itemDelay
+        self.durations = np.full(len(self.wavfiles), np.nan) if durations is None else np.array(durations, dtype=float)
+        self.onsets = np.full(len(self.wavfiles), np.nan)
+
+    def __len__(self):
+        return len(self.wavfiles)
+
+    def send(self, i, triggers, at=None):
+        """
+        Send the trigger of trial i (and its item number) and record its onset.
+
+        Parameters
+        ----------
+        i : int
+            index of the trial
+        triggers : TriggerScheduler
+            scheduler sending the pulses
+        at : double
+            time of the onset (in the time base of the scheduler, default: None, now)
+
+        Returns
+        -------
+        the (scheduled) onset of the trigger, or None if the trial has no trigger code
+        """
+        code = self.codes[i]
+        if not code:
+            return None
+        onset = triggers.pulse(int(code), at=at)
+        if self.itemCodes[i]:
+            triggers.pulse(int(self.itemCodes[i]), at=onset + self.itemDelay)
+        self.onsets[i] = onset
+        return onset
+
+    def save(self, filename):
+        """
+        Write the events of the run to filename + '_events.tsv' (one row per trial: onset relative to the first
+        trigger of the run, duration, condition, trigger codes and wav file) and the description of the columns
+        and codes to filename + '_events.json'.
+        """
+        valid = np.isfinite(self.onsets)
+        reference = self.onsets[valid].min() if np.any(valid) else 0.0
+        with open(filename + '_events.tsv', 'w') as f:
+            f.write('onset\tduration\ttrial_type\tvalue\titem_value\tstim_file\n')
+            for i in range(len(self)):
+                f.write('%s\t%s\t%s\t%d\t%d\t%s\n' % (
+                    '%.6f' % (self.onsets[i] - reference) if valid[i] else 'n/a',
+                    '%.6f' % self.durations[i] if np.isfinite(self.durations[i]) else 'n/a',
+                    self.conditions[i], self.codes[i], self.itemCodes[i], self.wavfiles[i]))
+        description = {
+            'onset': {'Description': 'onset of the trigger relative to the first trigger of the run', 'Units': 's'},
+            'duration': {'Description': 'duration of the sound', 'Units': 's'},
+            'trial_type': {'Description': 'condition of the trial'},
+            'value': {'Description': 'trigger code of the condition (0: no trigger)',
+                      'Levels': {str(code): condition for condition, code in sorted(self.conditionCodes.items())}},
+            'item_value': {'Description': 'item number sent as second trigger %.3f s after the condition code, '
+                                          '+128 for the b variant of an item (0: not sent)' % self.itemDelay},
+            'stim_file': {'Description': 'wav file of the trial'},
+        }
+        with open(filename + '_events.json', 'w') as f:
+            json.dump(description, f, indent=2)
+
+    def summary(self):
+        """
+        Return a one-line summary of the plan (e.g. for logging).
+        """
+        return 'Trigger plan\t%d trials\t%d triggers\t%d item codes\t%d sent' % (
+            len(self), np.count_nonzero(self.codes), np.count_nonzero(self.itemCodes), np.count_nonzero(np.isfinite(self.onsets)))
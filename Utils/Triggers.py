@@ -0,0 +1,292 @@
+import heapq
+import os
+import struct
+import threading
+import time
+
+from Timing import sleepUntil
+
+
+class ParallelPortBackend:
+    """
+    Trigger port using PsychoPy's parallel port implementation (e.g. inpoutx64.dll on Windows).
+    """
+
+    def __init__(self, address=0x0378):
+        """
+        Parameters
+        ----------
+        address : int
+            address of the parallel port (default: 0x0378)
+        """
+        from psychopy import parallel
+        self.port = parallel.ParallelPort(address=address)
+
+    def setData(self, value):
+        self.port.setData(value)
+
+    def close(self):
+        pass
+
+
+class LinuxParportBackend:
+    """
+    Trigger port writing to a Linux parallel port device (/dev/parportN) via ppdev ioctls.
+    """
+
+    # ioctl request codes from linux/ppdev.h
+    PPCLAIM = 0x708b
+    PPRELEASE = 0x708c
+    PPWDATA = 0x40017086
+
+    def __init__(self, device='/dev/parport0'):
+        """
+        Parameters
+        ----------
+        device : str
+            parallel port device (default: /dev/parport0)
+        """
+        import fcntl
+        self.fcntl = fcntl
+        self.fd = os.open(device, os.O_RDWR)
+        self.fcntl.ioctl(self.fd, self.PPCLAIM)
+
+    def setData(self, value):
+        self.fcntl.ioctl(self.fd, self.PPWDATA, struct.pack('B', value))
+
+    def close(self):
+        if self.fd is not None:
+            self.fcntl.ioctl(self.fd, self.PPRELEASE)
+            os.close(self.fd)
+            self.fd = None
+
+
+class SimulatedPort:
+    """
+    In-memory trigger port which timestamps every write. This allows to run the paradigms and
+    to measure pulse timing on a machine without a parallel port.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        """
+        Parameters
+        ----------
+        clock : callable
+            function returning the current time in seconds (default: time.perf_counter)
+        """
+        self.clock = clock
+        self.writes = []
+
+    def setData(self, value):
+        self.writes.append((self.clock(), value))
+
+    def close(self):
+        pass
+
+    def getPulses(self):
+        """
+        Return all completed pulses as a list of (onset, width, value) tuples.
+        A pulse starts with a non-zero write and ends with the next write of 0.
+        """
+        pulses = []
+        onset = None
+        value = 0
+        for t, v in self.writes:
+            if v != 0 and onset is None:
+                onset = t
+                value = v
+            elif v == 0 and onset is not None:
+                pulses.append((onset, t - onset, value))
+                onset = None
+        return pulses
+
+
+def openTriggerPort(backend='parallel', address=0x0378, device='/dev/parport0'):
+    """
+    Create a trigger port.
+
+    Parameters
+    ----------
+    backend : str
+        'parallel' (PsychoPy parallel port), 'parport' (Linux /dev/parport device) or 'simulated' (in-memory)
+    address : int
+        address of the parallel port (only used by the 'parallel' backend)
+    device : str
+        parallel port device (only used by the 'parport' backend)
+    """
+    if backend == 'parallel':
+        return ParallelPortBackend(address)
+    elif backend == 'parport':
+        return LinuxParportBackend(device)
+    elif backend == 'simulated':
+        return SimulatedPort()
+    raise ValueError('Unknown trigger backend "%s". Use either "parallel", "parport" or "simulated"' % backend)
+
+
+class TriggerScheduler:
+    """
+    Sends trigger pulses with a fixed width, independent of the frame rate of the render loop.
+
+    The onset of a pulse is written immediately by the calling thread (or at a scheduled time),
+    while the reset to 0 is written by a timer thread which sleeps until shortly before the
+    scheduled time and spins for the remaining interval.
+    The scheduled and actual time of every write are recorded to measure the timing jitter.
+    """
+
+    def __init__(self, port, pulseWidth=0.1, clock=time.perf_counter, spinWindow=0.002):
+        """
+        Parameters
+        ----------
+        port : trigger port
+            object with a setData(value) method, see openTriggerPort
+        pulseWidth : double
+            default width of a pulse in seconds (default: 100ms)
+        clock : callable
+            function returning the current time in seconds (default: time.perf_counter)
+        spinWindow : double
+            duration in seconds of the final busy-wait before a scheduled write (default: 2ms)
+        """
+        self.port = port
+        self.pulseWidth = pulseWidth
+        self.clock = clock
+        self.spinWindow = spinWindow
+        self.events = []
+        self.counter = 0
+        self.log = []
+        self.portLock = threading.Lock()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start the timer thread and reset the port to 0.
+        """
+        self.write(0)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='TriggerScheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Execute all pending writes, stop the timer thread and close the port.
+        """
+        with self.condition:
+            while self.events:
+                self.condition.wait(0.01)
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.port.close()
+
+    def pulse(self, value, width=None, at=None):
+        """
+        Send a trigger pulse.
+
+        Parameters
+        ----------
+        value : int
+            trigger value
+        width : double
+            width of the pulse in seconds (default: pulseWidth of the scheduler)
+        at : double
+            time of the pulse onset (in the time base of the clock). If None, the onset is written immediately.
+
+        Returns
+        -------
+        the (scheduled) onset time of the pulse
+        """
+        if width is None:
+            width = self.pulseWidth
+        if at is None:
+            at = self.write(value)
+        else:
+            self.schedule(value, at)
+        self.schedule(0, at + width)
+        return at
+
+    def schedule(self, value, at):
+        """
+        Schedule a write of value to the port at the specified time.
+
+        Parameters
+        ----------
+        value : int
+            value to write
+        at : double
+            time of the write (in the time base of the clock)
+        """
+        with self.condition:
+            heapq.heappush(self.events, (at, self.counter, value))
+            self.counter = self.counter + 1
+            self.condition.notify_all()
+
+    def write(self, value, scheduled=None):
+        """
+        Write a value to the port and record the time of the write.
+
+        Parameters
+        ----------
+        value : int
+            value to write
+        scheduled : double
+            time at which the write was scheduled (None for immediate writes)
+        """
+        with self.portLock:
+            self.port.setData(value)
+            actual = self.clock()
+        if scheduled is None:
+            scheduled = actual
+        self.log.append((scheduled, actual, value))
+        return actual
+
+    def run(self):
+        """
+        Main loop of the timer thread.
+        """
+        while True:
+            with self.condition:
+                while self.running and not self.events:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                at, _, value = self.events[0]
+                remaining = at - self.clock()
+                if remaining > self.spinWindow:
+                    # wake up early if an earlier write is scheduled in the meantime
+                    self.condition.wait(remaining - self.spinWindow)
+                    continue
+                heapq.heappop(self.events)
+
+            sleepUntil(at, self.clock, self.spinWindow)
+            self.write(value, at)
+            with self.condition:
+                self.condition.notify_all()
+
+    def getPulseWidths(self):
+        """
+        Return the actual widths of all completed pulses in seconds, based on the recorded writes.
+        """
+        widths = []
+        onset = None
+        for scheduled, actual, value in self.log:
+            if value != 0 and onset is None:
+                onset = actual
+            elif value == 0 and onset is not None:
+                widths.append(actual - onset)
+                onset = None
+        return widths
+
+    def summary(self):
+        """
+        Return a one-line summary of the write latency and pulse-width error (e.g. for logging).
+        """
+        latencies = [actual - scheduled for scheduled, actual, value in self.log]
+        errors = [w - self.pulseWidth for w in self.getPulseWidths()]
+        return 'Triggers\t%d pulses\twidth error mean %.3f ms\twidth error max %.3f ms\twrite latency max %.3f ms' % (
+            len(errors),
+            1000 * sum(errors) / len(errors) if errors else 0,
+            1000 * max(errors, key=abs) if errors else 0,
+            1000 * max(latencies) if latencies else 0)
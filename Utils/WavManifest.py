@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import struct
+
+# format tags of the fmt chunk
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# fields of a manifest entry, in the order in which they are stored
+FIELDS = ['mtime', 'size', 'duration', 'sampleRate', 'channels', 'bitsPerSample', 'frames', 'dataOffset', 'headerChecksum']
+
+
+def readWavHeader(wavfile):
+    """
+    Read the format of a wav file from its RIFF header without decoding the audio data.
+
+    Parameters
+    ----------
+    wavfile : str
+        wave file to read
+
+    Returns
+    -------
+    dictionary with sampleRate, channels, bitsPerSample, formatTag, frames, dataOffset (byte offset of
+    the samples), dataBytes and duration (in seconds)
+    """
+    with open(wavfile, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            raise ValueError('%s is not a RIFF/WAVE file' % wavfile)
+        header = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError('%s has no data chunk' % wavfile)
+            chunkId, chunkSize = struct.unpack('<4sI', chunk)
+            if chunkId == b'fmt ':
+                fmt = f.read(chunkSize)
+                formatTag, channels, sampleRate, byteRate, blockAlign, bitsPerSample = struct.unpack('<HHIIHH', fmt[0:16])
+                if formatTag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    formatTag = struct.unpack('<H', fmt[24:26])[0]
+                header = {'sampleRate': sampleRate, 'channels': channels, 'bitsPerSample': bitsPerSample,
+                          'formatTag': formatTag, 'blockAlign': blockAlign}
+                if chunkSize % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunkId == b'data':
+                if header is None:
+                    raise ValueError('%s has no fmt chunk before the data chunk' % wavfile)
+                dataOffset = f.tell()
+                # some writers leave the size of a streamed data chunk at 0 or 0xFFFFFFFF
+                fileSize = os.fstat(f.fileno()).st_size
+                if chunkSize == 0 or dataOffset + chunkSize > fileSize:
+                    chunkSize = fileSize - dataOffset
+                header['frames'] = chunkSize // header['blockAlign'] if header['blockAlign'] else 0
+                header['dataOffset'] = dataOffset
+                header['dataBytes'] = chunkSize
+                header['duration'] = header['frames'] / header['sampleRate'] if header['sampleRate'] else 0.0
+                return header
+            else:
+                f.seek(chunkSize + chunkSize % 2, os.SEEK_CUR)
+
+
+def getHeaderChecksum(wavfile, header=None):
+    """
+    Return the SHA-1 checksum of the chunks before the samples of a wav file (RIFF header, fmt chunk and any
+    metadata) and of the size of its data chunk. The samples are not read, so the checksum identifies a version
+    of the file (e.g. a re-exported stimulus) at the cost of the header only, but not a change of samples alone.
+
+    Parameters
+    ----------
+    wavfile : str
+        wave file to read
+    header : dict
+        header returned by readWavHeader (read if not specified)
+    """
+    if header is None:
+        header = readWavHeader(wavfile)
+    checksum = hashlib.sha1()
+    with open(wavfile, 'rb') as f:
+        checksum.update(f.read(header['dataOffset']))
+    checksum.update(struct.pack('<Q', header['dataBytes']))
+    return checksum.hexdigest()
+
+
+class WavManifest:
+    """
+    Index of the wav files of a stimulus folder with their duration, sample rate, channels and header checksum
+    (see getHeaderChecksum), read from the wav headers only (the samples are neither read nor decoded). The index is stored in a json file in the folder
+    (.wavmanifest.json) and updated incrementally: only files whose modification time or size changed are
+    read again. This allows to plan runs (e.g. their exact duration) before any sound is loaded.
+    """
+
+    def __init__(self, directory, filename=None):
+        """
+        Parameters
+        ----------
+        directory : str
+            folder with the wav files (subfolders are not included)
+        filename : str
+            manifest file (default: .wavmanifest.json in directory)
+        """
+        self.directory = directory
+        self.filename = filename if filename is not None else os.path.join(directory, '.wavmanifest.json')
+        self.entries = {}
+        self.loaded = False
+
+    def load(self):
+        """
+        Read the stored manifest (if any).
+        """
+        self.entries = {}
+        self.loaded = True
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                stored = json.load(f)
+        except ValueError:
+            return
+        if stored.get('fields') != FIELDS:
+            return
+        for name, values in stored['files'].items():
+            self.entries[name] = dict(zip(FIELDS, values))
+
+    def save(self):
+        """
+        Write the manifest (atomically, so an interrupted write does not corrupt it).
+        """
+        stored = {'fields': FIELDS, 'files': dict((name, [entry[k] for k in FIELDS]) for name, entry in sorted(self.entries.items()))}
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(stored, f, separators=(',', ':'))
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def update(self):
+        """
+        Add new and changed wav files of the folder to the manifest and remove deleted ones.
+        The manifest file is only written if anything changed.
+
+        Returns
+        -------
+        number of files which were (re-)read
+        """
+        if not self.loaded:
+            self.load()
+        entries = {}
+        updated = 0
+        for item in os.scandir(self.directory):
+            if not item.is_file() or not item.name.lower().endswith('.wav'):
+                continue
+            stat = item.stat()
+            entry = self.entries.get(item.name)
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                header = readWavHeader(item.path)
+                entry = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'headerChecksum': getHeaderChecksum(item.path, header)}
+                for k in FIELDS[2:-1]:
+                    entry[k] = header[k]
+                updated = updated + 1
+            entries[item.name] = entry
+        changed = updated > 0 or len(entries) != len(self.entries)
+        self.entries = entries
+        if changed:
+            self.save()
+        return updated
+
+    def get(self, wavfile):
+        """
+        Return the entry of a wav file (see FIELDS).
+
+        Parameters
+        ----------
+        wavfile : str
+            name or path of the wav file (only the file name is used)
+        """
+        if not self.loaded:
+            self.update()
+        name = os.path.basename(wavfile)
+        if name not in self.entries:
+            raise KeyError('%s is not in the manifest of %s' % (name, self.directory))
+        return self.entries[name]
+
+    def getDuration(self, wavfile):
+        """
+        Return the duration of a wav file in seconds.
+        """
+        return self.get(wavfile)['duration']
+
+    def getTotalDuration(self, wavfiles):
+        """
+        Return the total duration of the specified wav files in seconds.
+        """
+        return sum(self.getDuration(w) for w in wavfiles)
+
+    def __len__(self):
+        if not self.loaded:
+            self.update()
+        return len(self.entries)
+
+    def summary(self):
+        """
+        Return a one-line summary of the manifest (e.g. for logging).
+        """
+        if not self.loaded:
+            self.update()
+        rates = sorted(set(e['sampleRate'] for e in self.entries.values()))
+        channels = sorted(set(e['channels'] for e in self.entries.values()))
+        return 'Wav manifest\t%s\t%d files\t%.1f s\tsample rates %s\tchannels %s' % (
+            self.directory, len(self.entries), sum(e['duration'] for e in self.entries.values()),
+            ','.join(str(r) for r in rates), ','.join(str(c) for c in channels))
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Build or update the wav manifest of stimulus folders')
+    parser.add_argument('directories', nargs='+', help='folders with wav files, e.g. SemanticIntegration/wav Localizer/stimuli/GermanMono')
+    args = parser.parse_args()
+    for directory in args.directories:
+        start = time.perf_counter()
+        manifest = WavManifest(directory)
+        updated = manifest.update()
+        print('%s\t%d read\t%.3f s' % (manifest.summary(), updated, time.perf_counter() - start))
@@ -0,0 +1,322 @@
+"""
+Stand-ins for the parts of PsychoPy (and psychtoolbox) used by the paradigms, to run them on a machine without
+display, sound card or parallel port (see HeadlessRun.py):
+
+- visual.Window is a virtual window with a fixed refresh rate: flip() waits for the next virtual vertical blank
+  and records the Python time spent between two consecutive frames
+- sound.Sound takes the duration from the wav header (no decoding) and finishes after this duration
+- parallel.ParallelPort records every write with its time (see Triggers.SimulatedPort)
+- event.getKeys answers every request for response keys immediately, hardware.keyboard.Keyboard presses the first
+  requested key every pressInterval seconds (the escape key is never pressed)
+
+All times are based on time.perf_counter, the clock of the trigger scheduler. Call install() before the
+paradigm modules create an experiment.
+"""
+import os
+import sys
+import time
+import types
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from Timing import sleepUntil
+from Triggers import SimulatedPort
+from WavManifest import readWavHeader
+
+NOT_STARTED = 0
+STARTED = PLAYING = PRESSED = 1
+PAUSED = 2
+STOPPED = FINISHED = RELEASED = -1
+FOREVER = 1000000000
+
+
+class Stats:
+    """
+    Measurements of the stand-ins, reset by HeadlessRun.py before every run.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frameTimes = []  # Python time between the return of a flip and the next flip (consecutive frames only)
+        self.flips = 0
+        self.plays = []  # times at which sounds were started (scheduled time for play(when=...))
+        self.ports = []
+        self.log = []
+
+
+stats = Stats()
+
+
+def getTime():
+    return time.perf_counter()
+
+
+class Clock:
+
+    def __init__(self):
+        self._timeAtLastReset = getTime()
+
+    def getTime(self):
+        return getTime() - self._timeAtLastReset
+
+    def reset(self, newT=0.0):
+        self._timeAtLastReset = getTime() + newT
+
+    def add(self, t):
+        self._timeAtLastReset = self._timeAtLastReset + t
+
+    def getLastResetTime(self):
+        return self._timeAtLastReset
+
+
+class CountdownTimer(Clock):
+
+    def __init__(self, start=0):
+        Clock.__init__(self)
+        self.start = start
+
+    def getTime(self):
+        return self.start - Clock.getTime(self)
+
+    def reset(self, t=None):
+        if t is not None:
+            self.start = t
+        Clock.reset(self)
+
+
+def quit():
+    raise SystemExit('core.quit()')
+
+
+class Window:
+    """
+    Virtual window: the vertical blanks are at multiples of the frame period since the creation of the window.
+    """
+
+    refreshRate = 60
+
+    def __init__(self, *args, **kwargs):
+        self.monitorFramePeriod = 1 / self.refreshRate
+        self.origin = getTime()
+        self.lastFrame = None
+        self.lastReturn = None
+        self.onFlip = []
+        self.timesOnFlip = []
+
+    def getNextFlip(self, now):
+        return int((now - self.origin) / self.monitorFramePeriod) + 1
+
+    def getFutureFlipTime(self, targetTime=0, clock=None):
+        now = getTime()
+        flip = self.origin + self.getNextFlip(now) * self.monitorFramePeriod
+        if clock == 'now':
+            return flip - now
+        if clock is None:
+            return flip
+        return clock.getTime() + flip - now
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.onFlip.append((function, args, kwargs))
+
+    def timeOnFlip(self, obj, attrib):
+        self.timesOnFlip.append((obj, attrib))
+
+    def flip(self, clearBuffer=True):
+        now = getTime()
+        frame = self.getNextFlip(now)
+        if self.lastFrame is not None and frame == self.lastFrame + 1:
+            stats.frameTimes.append(now - self.lastReturn)
+        flipTime = self.origin + frame * self.monitorFramePeriod
+        sleepUntil(flipTime, getTime)
+        for function, args, kwargs in self.onFlip:
+            function(*args, **kwargs)
+        for obj, attrib in self.timesOnFlip:
+            setattr(obj, attrib, flipTime)
+        self.onFlip = []
+        self.timesOnFlip = []
+        stats.flips = stats.flips + 1
+        self.lastFrame = frame
+        self.lastReturn = getTime()
+        return flipTime
+
+    def close(self):
+        pass
+
+
+class TextStim:
+
+    def __init__(self, win=None, text='', **kwargs):
+        self.win = win
+        self.text = text
+        self.autoDraw = False
+
+    def setAutoDraw(self, value):
+        self.autoDraw = value
+
+    def draw(self):
+        pass
+
+
+class Sound:
+    """
+    Sound with the duration of a wav file (or array), which is never decoded or played.
+    """
+
+    def __init__(self, value='A', secs=-1, stereo=True, hamming=True, name='', sampleRate=44100, **kwargs):
+        self.sampleRate = sampleRate
+        self.channels = 2 if stereo else 1
+        self.sndArr = None
+        if isinstance(value, str):
+            self.duration = readWavHeader(value)['duration']
+        else:
+            self.duration = len(value) / sampleRate
+        self._status = NOT_STARTED
+        self.startTime = None
+        self.track = types.SimpleNamespace(status={})
+
+    @property
+    def status(self):
+        if self._status == STARTED and getTime() >= self.startTime + self.duration:
+            self._status = FINISHED
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+
+    def play(self, loops=None, when=None):
+        self.startTime = when if when is not None else getTime()
+        self.track.status['StartTime'] = self.startTime
+        stats.plays.append(self.startTime)
+        self._status = STARTED
+
+    def stop(self):
+        if self._status == STARTED:
+            self._status = FINISHED
+
+    def setVolume(self, volume):
+        pass
+
+    def getDuration(self):
+        return self.duration
+
+
+class ParallelPort(SimulatedPort):
+
+    def __init__(self, address=0x0378):
+        SimulatedPort.__init__(self)
+        self.address = address
+        stats.ports.append(self)
+
+
+def getKeys(keyList=None, **kwargs):
+    """
+    Answer every request for keys with the first requested key (any key: space), but never with escape.
+    """
+    if keyList is None:
+        return ['space']
+    keys = [k for k in keyList if k != 'escape']
+    return keys[0:1]
+
+
+class KeyPress:
+
+    def __init__(self, name, tDown):
+        self.name = name
+        self.tDown = tDown
+        self.rt = 0
+        self.duration = None
+
+
+class Keyboard:
+
+    pressInterval = 0.5
+
+    def __init__(self, *args, **kwargs):
+        self.clock = Clock()
+        self.keys = []
+        self.rt = []
+        self.status = NOT_STARTED
+        self.lastPress = getTime()
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True):
+        keys = [k for k in keyList or [] if k != 'escape']
+        now = getTime()
+        if not keys or now - self.lastPress < self.pressInterval:
+            return []
+        self.lastPress = now
+        return [KeyPress(keys[0], now)]
+
+    def clearEvents(self, eventType=None):
+        pass
+
+
+class DlgFromDict:
+    """
+    Dialog which is always confirmed. The values of HeadlessRun.py (answers) are filled in, lists are
+    replaced by their first entry.
+    """
+
+    answers = {}
+
+    def __init__(self, dictionary, **kwargs):
+        for key, value in dictionary.items():
+            if key in self.answers:
+                dictionary[key] = self.answers[key]
+            elif isinstance(value, list):
+                dictionary[key] = value[0]
+        self.OK = True
+
+
+class ExperimentHandler:
+
+    def __init__(self, *args, **kwargs):
+        self.entries = []
+        self.entry = {}
+
+    def addData(self, name, value):
+        self.entry[name] = value
+
+    def nextEntry(self):
+        self.entries.append(self.entry)
+        self.entry = {}
+
+
+def log(msg, level=None, t=None, obj=None):
+    stats.log.append(msg)
+
+
+def makeModule(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """
+    Register the stand-ins as psychopy and psychtoolbox modules (replacing the real ones if loaded).
+    """
+    constants = dict(NOT_STARTED=NOT_STARTED, STARTED=STARTED, PLAYING=PLAYING, PAUSED=PAUSED, STOPPED=STOPPED,
+                     FINISHED=FINISHED, PRESSED=PRESSED, RELEASED=RELEASED, FOREVER=FOREVER)
+    psychopy = makeModule('psychopy', __path__=[])
+    psychopy.locale_setup = makeModule('psychopy.locale_setup')
+    psychopy.prefs = types.SimpleNamespace(hardware={}, general={})
+    psychopy.constants = makeModule('psychopy.constants', **constants)
+    psychopy.core = makeModule('psychopy.core', Clock=Clock, MonotonicClock=Clock, CountdownTimer=CountdownTimer,
+                               getTime=getTime, quit=quit, wait=time.sleep)
+    psychopy.clock = makeModule('psychopy.clock', Clock=Clock, getTime=getTime)
+    psychopy.visual = makeModule('psychopy.visual', Window=Window, TextStim=TextStim)
+    psychopy.sound = makeModule('psychopy.sound', Sound=Sound)
+    psychopy.parallel = makeModule('psychopy.parallel', ParallelPort=ParallelPort)
+    psychopy.event = makeModule('psychopy.event', getKeys=getKeys, clearEvents=lambda eventType=None: None)
+    psychopy.gui = makeModule('psychopy.gui', DlgFromDict=DlgFromDict)
+    psychopy.data = makeModule('psychopy.data', ExperimentHandler=ExperimentHandler,
+                               getDateStr=lambda: time.strftime('%Y_%b_%d_%H%M'))
+    psychopy.logging = makeModule('psychopy.logging', log=log, EXP=22, DATA=25, WARNING=30, INFO=20, DEBUG=10,
+                                  LogFile=lambda *args, **kwargs: None, flush=lambda: None, defaultClock=Clock(),
+                                  console=types.SimpleNamespace(setLevel=lambda level: None))
+    psychopy.hardware = makeModule('psychopy.hardware', __path__=[])
+    psychopy.hardware.keyboard = makeModule('psychopy.hardware.keyboard', Keyboard=Keyboard)
+    makeModule('psychtoolbox', GetSecs=getTime)
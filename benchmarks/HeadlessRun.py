@@ -0,0 +1,239 @@
+"""
+Run the SemanticIntegration and Alice localizer paradigms headless, against the stand-ins of HeadlessPsychoPy.py
+(virtual window at a fixed refresh rate, sounds with the durations of the wav headers, recording parallel port),
+and measure the overhead of their loops:
+
+- Python time per frame: time between the return of a flip and the next flip in the frame loops
+- setup latency: time from the start of a trial (presentSound) to the start of its sound
+- trigger vs. sound: time between the trigger onset and the start of the sound
+- width error: error of the trigger pulse widths
+- wall time and CPU time of the whole run
+
+The paradigms run in a temporary copy of their folders (the scripts are linked, the wav files are written as
+sparse files with realistic durations), so nothing is written to the repository. All durations (sounds,
+response windows, fixation blocks and ITIs) are multiplied by --time-scale to shorten the runs. The streaming and
+continuous playback modes of the localizer need an audio device (sounddevice) and are not included.
+
+Usage: python HeadlessRun.py [--paradigms semantic-frame semantic-timeline alice-frame alice-scheduled] [--refresh 60 120 144]
+                             [--trials 20] [--blocks 5] [--time-scale 0.2] [--repeat 1]
+                             [--save results.json] [--compare results.json] [--tolerance 0.5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(_root, 'Utils'))
+sys.path.append(os.path.join(_root, 'SemanticIntegration'))
+import HeadlessPsychoPy
+from HeadlessPsychoPy import getTime, stats
+from StimulusLists import readStimulusList
+
+PARADIGMS = ['semantic-frame', 'semantic-timeline', 'alice-frame', 'alice-scheduled']
+
+
+def writeWav(filename, duration, sampleRate=44100):
+    """
+    Write a silent mono 16 bit wav file of the specified duration as sparse file (only the header is written).
+    """
+    dataBytes = int(duration * sampleRate) * 2
+    with open(filename, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 36 + dataBytes) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sampleRate, sampleRate * 2, 2, 16))
+        f.write(b'data' + struct.pack('<I', dataBytes))
+        f.truncate(44 + dataBytes)
+
+
+def linkFiles(source, target, extensions):
+    os.makedirs(target)
+    for name in os.listdir(source):
+        if os.path.splitext(name)[1] in extensions:
+            os.symlink(os.path.abspath(os.path.join(source, name)), os.path.join(target, name))
+
+
+def makeTree(directory, rng, timeScale=1.0):
+    """
+    Create the folders of the paradigms in directory: links to the scripts and lists of the repository and
+    sparse wav files (sentences 1.5-3.5 s, instructions 20 s, Alice passages 17-20 s, multiplied by timeScale).
+    """
+    os.symlink(os.path.abspath(os.path.join(_root, 'Utils')), os.path.join(directory, 'Utils'))
+
+    semantic = os.path.join(directory, 'SemanticIntegration')
+    linkFiles(os.path.join(_root, 'SemanticIntegration'), semantic, ['.py', '.csv'])
+    for name in ['wav', 'data', 'stim_lists']:
+        os.makedirs(os.path.join(semantic, name))
+    wavfiles = set(readStimulusList(os.path.join(semantic, 'responseTimes.csv'))[0])
+    wavfiles.update(readStimulusList(os.path.join(semantic, 'stimuli_list_training.csv'))[0])
+    for name in sorted(wavfiles):
+        writeWav(os.path.join(semantic, 'wav', name), timeScale * rng.uniform(1.5, 3.5))
+    writeWav(os.path.join(semantic, 'wav', 'Instruktionen.wav'), timeScale * 20)
+
+    alice = os.path.join(directory, 'Localizer')
+    linkFiles(os.path.join(_root, 'Localizer'), alice, ['.py'])
+    os.makedirs(os.path.join(alice, 'data'))
+    stimuli = os.path.join(alice, 'stimuli', 'GermanMono')
+    os.makedirs(stimuli)
+    for n in range(1, 25):
+        for kind in ['intact', 'degraded']:
+            writeWav(os.path.join(stimuli, '%d_%s.wav' % (n, kind)), timeScale * rng.uniform(17, 20))
+
+
+def importParadigms(directory):
+    """
+    Import the paradigm modules from the temporary folders and return the headless subclasses of the experiments.
+    """
+    sys.path.insert(0, os.path.join(directory, 'SemanticIntegration'))
+    sys.path.insert(0, os.path.join(directory, 'Localizer'))
+    import SemanticIntegration
+    import AliceLocalizer
+
+    class HeadlessExperiment(SemanticIntegration.Experiment):
+
+        def generateOrReadStimulusList(self, run):
+            filenames, responseTimes = SemanticIntegration.Experiment.generateOrReadStimulusList(self, run)
+            return filenames[0:self.trials], [rt * self.timeScale for rt in responseTimes[0:self.trials]]
+
+        def presentSound(self, wavfile, *args, **kwargs):
+            entry = getTime()
+            plays = len(stats.plays)
+            SemanticIntegration.Experiment.presentSound(self, wavfile, *args, **kwargs)
+            if len(stats.plays) > plays:
+                self.setupLatencies.append(stats.plays[plays] - entry)
+
+    class HeadlessAlice(AliceLocalizer.AliceLocalizer):
+
+        def setup(self):
+            AliceLocalizer.AliceLocalizer.setup(self)
+            self.blocks = [b[0:self.numBlocks] for b in self.blocks]
+
+        def setupStimuli(self, language, run):
+            AliceLocalizer.AliceLocalizer.setupStimuli(self, language, run)
+            self.itis = [iti * self.timeScale for iti in self.itis]
+
+        def presentSound(self, wavfile, triggerValue):
+            entry = getTime()
+            plays = len(stats.plays)
+            AliceLocalizer.AliceLocalizer.presentSound(self, wavfile, triggerValue)
+            if len(stats.plays) > plays:
+                self.setupLatencies.append(stats.plays[plays] - entry)
+
+    return SemanticIntegration, HeadlessExperiment, AliceLocalizer, HeadlessAlice
+
+
+def runParadigm(paradigm, refresh, args, modules):
+    """
+    Run a paradigm once and return its measurements.
+    """
+    SemanticIntegration, HeadlessExperiment, AliceLocalizer, HeadlessAlice = modules
+    stats.reset()
+    HeadlessPsychoPy.Window.refreshRate = refresh
+    AliceLocalizer.FIXATION_DURATION = 12 * args.time_scale
+    cwd = os.getcwd()
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if paradigm.startswith('semantic'):
+            HeadlessPsychoPy.DlgFromDict.answers = {'mode': 'experiment', 'participant': 'headless', 'run': '1',
+                                                    'list': 'generate', 'Send triggers': 'yes', 'playback': paradigm.split('-')[1]}
+            experiment = HeadlessExperiment()
+            experiment.trials = args.trials
+            experiment.timeScale = args.time_scale
+            experiment.setupLatencies = []
+            experiment.start()
+        else:
+            HeadlessPsychoPy.DlgFromDict.answers = {'participant': 'headless', 'Send triggers': 'yes',
+                                                    'language': 'German', 'playback': paradigm.split('-')[1]}
+            experiment = HeadlessAlice()
+            experiment.numBlocks = args.blocks
+            experiment.timeScale = args.time_scale
+            experiment.setupLatencies = []
+            experiment.startExperiment(1)
+    wall = time.perf_counter() - wallStart
+    cpu = time.process_time() - cpuStart
+    os.chdir(cwd)
+
+    pulses = [p for port in stats.ports for p in port.getPulses()]
+    onsets = np.array(sorted(onset for onset, width, value in pulses))
+    deltas = []
+    for play in stats.plays:
+        if len(onsets):
+            nearest = onsets[np.argmin(np.abs(onsets - play))]
+            if abs(nearest - play) < 0.05:
+                deltas.append(nearest - play)
+    widthErrors = [width - experiment.triggers.pulseWidth for onset, width, value in pulses]
+    frameTimes = np.array(stats.frameTimes)
+    return {
+        'frames': len(frameTimes),
+        'frameMean': 1e6 * frameTimes.mean() if len(frameTimes) else float('nan'),
+        'frameP99': 1e6 * np.percentile(frameTimes, 99) if len(frameTimes) else float('nan'),
+        'setupP50': 1000 * np.median(experiment.setupLatencies) if experiment.setupLatencies else float('nan'),
+        'setupMax': 1000 * max(experiment.setupLatencies) if experiment.setupLatencies else float('nan'),
+        'triggerMean': 1000 * np.mean(deltas) if deltas else float('nan'),
+        'triggerMax': 1000 * max(deltas, key=abs) if deltas else float('nan'),
+        'widthMax': 1000 * max(widthErrors, key=abs) if widthErrors else float('nan'),
+        'wall': wall,
+        'cpu': cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark of the paradigm loops')
+    parser.add_argument('--paradigms', nargs='+', default=PARADIGMS, choices=PARADIGMS, help='paradigms to run (default: all)')
+    parser.add_argument('--refresh', nargs='+', type=int, default=[60, 120, 144], help='refresh rates of the virtual window (default: 60 120 144)')
+    parser.add_argument('--trials', type=int, default=20, help='number of SemanticIntegration trials (default: 20)')
+    parser.add_argument('--blocks', type=int, default=5, help='number of Alice blocks (default: 5)')
+    parser.add_argument('--time-scale', type=float, default=0.2, help='factor of all durations (default: 0.2)')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs per configuration, the median is reported (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the wav durations (default: 0)')
+    parser.add_argument('--save', default=None, help='write the results to a json file')
+    parser.add_argument('--compare', default=None, help='compare with the results of a json file')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slow-down for --compare (default: 0.5)')
+    args = parser.parse_args()
+
+    reference = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            reference = json.load(f)
+
+    HeadlessPsychoPy.install()
+    results = {}
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        makeTree(directory, np.random.default_rng(args.seed), args.time_scale)
+        modules = importParadigms(directory)
+        print('%-22s %7s %21s %19s %19s %9s %8s %7s  %s' % ('configuration', 'frames', 'frame us (mean/p99)', 'setup ms (p50/max)',
+                                                         'trigger ms (mean/max)', 'width ms', 'wall s', 'cpu s', 'status'))
+        for paradigm in args.paradigms:
+            for refresh in args.refresh:
+                name = '%s@%dHz' % (paradigm, refresh)
+                runs = [runParadigm(paradigm, refresh, args, modules) for i in range(args.repeat)]
+                result = {key: float(np.median([r[key] for r in runs])) for key in runs[0]}
+                results[name] = result
+                status = []
+                if name in reference:
+                    if result['frameMean'] > reference[name]['frameMean'] * (1 + args.tolerance) + 5:
+                        status.append('frame regression')
+                    if result['setupP50'] > reference[name]['setupP50'] * (1 + args.tolerance) + 0.1:
+                        status.append('setup regression')
+                failed = failed or len(status) > 0
+                print('%-22s %7d %10.1f/%-10.1f %9.3f/%-9.3f %9.3f/%-9.3f %9.3f %8.2f %7.2f  %s' % (
+                    name, result['frames'], result['frameMean'], result['frameP99'], result['setupP50'], result['setupMax'],
+                    result['triggerMean'], result['triggerMax'], result['widthMax'], result['wall'], result['cpu'],
+                    ', '.join(status) or 'ok'))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Measure the import time of the paradigm modules in fresh interpreters and check that they do not load
+PsychoPy or hardware modules at import time (these are only imported when an experiment is created).
+
+Each module is imported --repeat times in a new process and the median import time is reported. The script
+exits with status 1 if a module loads a forbidden module, exceeds --budget milliseconds or, with --compare,
+is slower than the saved results by more than --tolerance (relative) plus 20ms.
+
+Usage: python ImportTime.py [--repeat 5] [--budget 1000] [--save results.json] [--compare results.json] [--tolerance 0.5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (folder, module) of the modules to import
+MODULES = [
+    ('Utils', 'Timing'),
+    ('Utils', 'Triggers'),
+    ('Utils', 'AudioCache'),
+    ('Utils', 'Prefetcher'),
+    ('Utils', 'WavManifest'),
+    ('Utils', 'StreamingSound'),
+    ('Utils', 'StimulusBank'),
+    ('Utils', 'TrialJournal'),
+    ('Utils', 'FrameProfiler'),
+    ('Utils', 'ResponseCollector'),
+    ('Utils', 'ContinuousStream'),
+    ('Utils', 'Timeline'),
+    ('Utils', 'ScannerPulses'),
+    ('Utils', 'TriggerPlan'),
+    ('Utils', 'RunCheckpoint'),
+    ('Utils', 'PsychopyImport'),
+    ('SemanticIntegration', 'SequenceSampler'),
+    ('SemanticIntegration', 'StimulusLists'),
+    ('SemanticIntegration', 'SemanticIntegration'),
+    ('Localizer', 'PassageSampler'),
+    ('Localizer', 'AliceLocalizer'),
+]
+
+# top-level packages which must not be loaded by importing a module
+FORBIDDEN = ['psychopy', 'psychtoolbox', 'serial', 'pyglet', 'sounddevice']
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import %s
+duration = time.perf_counter() - start
+loaded = sorted(set(m.split('.')[0] for m in sys.modules) & set(%r))
+print(duration)
+print(','.join(loaded))
+'''
+
+
+def measure(folder, module, repeat):
+    """
+    Import a module in repeat fresh interpreters.
+
+    Returns
+    -------
+    the median import time in seconds and the forbidden modules loaded by the import
+    """
+    directory = os.path.join(_root, folder)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([directory, os.path.join(_root, 'Utils')])
+    durations = []
+    loaded = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', SCRIPT % (module, FORBIDDEN)], cwd=directory, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if output.returncode != 0:
+            raise RuntimeError('Importing %s failed:\n%s' % (module, output.stderr))
+        lines = output.stdout.strip('\n').split('\n')
+        durations.append(float(lines[0]))
+        if len(lines) > 1 and lines[1]:
+            loaded = lines[1].split(',')
+    durations.sort()
+    return durations[len(durations) // 2], loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time regression benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='number of imports per module (default: 5)')
+    parser.add_argument('--budget', type=float, default=1000, help='maximum import time per module in ms (default: 1000)')
+    parser.add_argument('--save', default=None, help='write the results to a json file')
+    parser.add_argument('--compare', default=None, help='compare with the results of a json file')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed relative slow-down for --compare (default: 0.5)')
+    args = parser.parse_args()
+
+    reference = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            reference = json.load(f)
+
+    results = {}
+    failed = False
+    print('%-38s %10s %10s  %s' % ('module', 'ms', 'reference', 'status'))
+    for folder, module in MODULES:
+        name = folder + '/' + module
+        duration, loaded = measure(folder, module, args.repeat)
+        ms = 1000 * duration
+        results[name] = ms
+        status = []
+        if loaded:
+            status.append('loads ' + ', '.join(loaded))
+        if ms > args.budget:
+            status.append('over budget')
+        if name in reference and ms > reference[name] * (1 + args.tolerance) + 20:
+            status.append('regression')
+        failed = failed or len(status) > 0
+        print('%-38s %10.1f %10s  %s' % (name, ms, '%.1f' % reference[name] if name in reference else '-', ', '.join(status) or 'ok'))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measure the overhead of the frame profiler (Utils/FrameProfiler.py) per frame: a loop iteration records the
+loop latency, one key poll and one flip interval, like the frame loop of presentSound. The loop is timed with
+the profiler enabled and disabled and without any profiling calls. There is no flip (nor key poll) in the loop,
+so the time per iteration is the cost of the profiling calls alone.
+
+Usage: python ProfilerOverhead.py [--frames 100000] [--capacity 65536]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from FrameProfiler import FrameProfiler
+
+
+def run(frames, profiler):
+    """
+    Run frames loop iterations and return the time per iteration in seconds.
+    """
+    routine = profiler.routine('presentSound') if profiler is not None else None
+    clock = time.perf_counter
+    start = clock()
+    if routine is None:
+        for i in range(frames):
+            pass
+    else:
+        routine.begin()
+        for i in range(frames):
+            routine.tick()
+            routine.since('keyPoll', profiler.clock())
+            routine.flip()
+    return (clock() - start) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overhead of the frame profiler per frame')
+    parser.add_argument('--frames', type=int, default=100000, help='number of loop iterations (default: 100000)')
+    parser.add_argument('--capacity', type=int, default=65536, help='capacity of the ring buffers (default: 65536)')
+    args = parser.parse_args()
+
+    baseline = run(args.frames, None)
+    disabled = run(args.frames, FrameProfiler(enabled=False, capacity=args.capacity))
+    profiler = FrameProfiler(capacity=args.capacity)
+    enabled = run(args.frames, profiler)
+    print('empty loop      %.3f us/frame' % (1e6 * baseline))
+    print('disabled        %.3f us/frame' % (1e6 * (disabled - baseline)))
+    print('enabled         %.3f us/frame (%.4f %% of a 60 Hz frame)' % (1e6 * (enabled - baseline), 100 * (enabled - baseline) * 60))
+    start = time.perf_counter()
+    profiler.report()
+    print('report          %.1f ms' % (1000 * (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main()
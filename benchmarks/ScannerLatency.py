@@ -0,0 +1,68 @@
+"""
+Measure the latency of the scanner synchronization with a fake scanner (pulses written to a pseudo terminal every TR,
+see Utils/ScannerPulses.py, POSIX only). The main thread waits for every pulse and sends a trigger when it wakes up,
+like a block synchronized to the scanner:
+
+- read latency: time between sending a pulse and its timestamp by the reader thread
+- wake latency: time between the timestamp and the return of waitForNext in the main thread
+- pulse-to-onset: time between sending a pulse and the onset of the trigger (simulated port)
+
+Usage: python ScannerLatency.py [--tr SECONDS] [--pulses N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from ScannerPulses import FakeScanner, ScannerPulseReader, TtyBackend
+from Triggers import SimulatedPort, TriggerScheduler
+
+
+def describe(name, values):
+    values = 1000 * np.asarray(values)
+    print('%-16s mean %.4f ms, median %.4f ms, p99 %.4f ms, max %.4f ms' % (
+        name, values.mean(), np.median(values), np.percentile(values, 99), values.max()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of the scanner synchronization (fake scanner on a pty)')
+    parser.add_argument('--tr', type=float, default=0.1, help='interval between two pulses in seconds (default: 0.1)')
+    parser.add_argument('--pulses', type=int, default=100, help='number of pulses (default: 100)')
+    args = parser.parse_args()
+
+    scanner = FakeScanner(args.tr, pulses=args.pulses, delay=0.2)
+    reader = ScannerPulseReader(TtyBackend(scanner.device)).start()
+    port = SimulatedPort()
+    triggers = TriggerScheduler(port, pulseWidth=min(0.01, args.tr / 2))
+    triggers.start()
+    scanner.start()
+    cpuStart = time.process_time()
+    woken = []
+    for n in range(1, args.pulses + 1):
+        pulse = reader.waitForPulse(n, timeout=args.tr + 1)
+        if pulse is None:
+            break
+        woken.append(time.perf_counter())
+        reader.addLatency(pulse, triggers.pulse(1))
+    cpu = time.process_time() - cpuStart
+    triggers.stop()
+    reader.stop()
+    scanner.stop()
+
+    count = min(len(scanner.sent), len(reader.pulses), len(woken))
+    sent = np.array(scanner.sent[0:count])
+    received = np.array(reader.pulses[0:count])
+    onsets = np.array([onset for onset, width, value in port.getPulses()][0:count])
+    print('pulses          %d sent, %d received in %d reads' % (len(scanner.sent), len(reader.pulses), reader.reads))
+    describe('read latency', received - sent)
+    describe('wake latency', np.array(woken[0:count]) - received)
+    describe('pulse-to-onset', onsets - sent[0:len(onsets)])
+    print('cpu time        %.3f s' % cpu)
+    print(reader.summary())
+
+
+if __name__ == '__main__':
+    main()
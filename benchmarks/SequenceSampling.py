@@ -0,0 +1,113 @@
+"""
+Compare the rejection loop formerly used by SemanticIntegration.generateStimulusList (shuffle until no condition
+occurs more than maxRun times in a row) with the constructive SequenceSampler, for 150 to 1000 trials.
+Conditions are distributed like in a run of the paradigm (expected : anomalous : unexpected : pseudoword = 1 : 1 : 1 : 2).
+The rejection loop is given up after --timeout seconds.
+
+The constructive sampler is configured like the one of the stimulus lists (StimulusLists.RUN_CELLS, a run of 150 trials
+in a single chunk). The time and peak memory of building its tables are reported separately from the time per
+sequence drawn with the cached tables. Sequences longer than --max-cells allows are split into chunks and are only
+approximately uniform; the tables of all chunks are kept, about 0.1 GB per chunk.
+
+Usage: python SequenceSampling.py [--trials 150 300 1000] [--max-run 2] [--max-cells N] [--repeat N]
+                                  [--timeout SECONDS]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SemanticIntegration'))
+from SequenceSampler import SequenceSampler
+from StimulusLists import RUN_CELLS
+
+CONDITIONS = ['exp', 'an', 'unexp', 'pseudo']
+
+
+def getCounts(trials):
+    counts = dict((c, trials // 5) for c in CONDITIONS)
+    counts['pseudo'] = trials - 3 * (trials // 5)
+    return counts
+
+
+def rejection(sampler, counts, rng, timeout):
+    sequence = []
+    for c in CONDITIONS:
+        sequence = sequence + [c] * counts[c]
+    start = time.perf_counter()
+    attempts = 0
+    while time.perf_counter() - start < timeout:
+        rng.shuffle(sequence)
+        attempts = attempts + 1
+        if sampler.check(sequence):
+            return attempts, True
+    return attempts, False
+
+
+def buildTables(maxRun, maxCells, counts):
+    """
+    Build the tables of a new sampler for counts. Returns the sampler, the build time and the peak memory in bytes
+    (measured in a second build, as tracing the allocations slows it down).
+    """
+    sampler = SequenceSampler(CONDITIONS, maxRun=maxRun, maxCells=maxCells)
+    c = sampler.getCounts(counts)
+    start = time.perf_counter()
+    sampler.getTables(c, sampler.getNumberOfChunks(c))
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    traced = SequenceSampler(CONDITIONS, maxRun=maxRun, maxCells=maxCells)
+    traced.getTables(c, traced.getNumberOfChunks(c))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sampler, duration, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rejection sampling vs. constructive sampling of condition sequences')
+    parser.add_argument('--trials', type=int, nargs='+', default=[150, 300, 1000], help='sequence lengths')
+    parser.add_argument('--max-run', type=int, default=2, help='maximum number of consecutive trials of a condition')
+    parser.add_argument('--max-cells', type=int, default=RUN_CELLS, help='table cells per chunk of the constructive sampler (default: RUN_CELLS of StimulusLists)')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per length and method')
+    parser.add_argument('--timeout', type=float, default=60, help='time limit of the rejection loop in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    checker = SequenceSampler(CONDITIONS, maxRun=args.max_run)
+    print('%8s %-12s %10s %10s %12s %10s %7s %s' % ('trials', 'method', 'build [s]', 'peak [MB]', 'sample [s]', 'attempts',
+                                                   'chunks', 'uniform'))
+    for trials in args.trials:
+        counts = getCounts(trials)
+
+        times = []
+        attempts = []
+        finished = True
+        for n in range(args.repeat):
+            start = time.perf_counter()
+            a, ok = rejection(checker, counts, rng, args.timeout)
+            times.append(time.perf_counter() - start)
+            attempts.append(a)
+            if not ok:
+                finished = False
+                break
+        if finished:
+            print('%8d %-12s %10s %10s %12.4f %10d %7s %s' % (trials, 'rejection', '-', '-', np.mean(times), np.mean(attempts), '-', 'exact'))
+        else:
+            print('%8d %-12s %10s %10s %12s %10d %7s %s' % (trials, 'rejection', '-', '-', '> %g' % args.timeout, attempts[-1], '-', '-'))
+
+        sampler, build, peak = buildTables(args.max_run, args.max_cells, counts)
+        times = []
+        for n in range(args.repeat):
+            start = time.perf_counter()
+            sequence = sampler.sample(counts, rng)
+            times.append(time.perf_counter() - start)
+            assert sampler.check(sequence) and len(sequence) == trials
+        chunks = sampler.getNumberOfChunks(sampler.getCounts(counts))
+        print('%8d %-12s %10.3f %10.1f %12.4f %10d %7d %s' % (trials, 'constructive', build, peak / 1024 / 1024, np.mean(times), 1, chunks,
+                                                           'exact' if chunks == 1 else 'approx.'))
+
+if __name__ == '__main__':
+    main()
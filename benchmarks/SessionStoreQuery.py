@@ -0,0 +1,80 @@
+"""
+Measure the ingestion of log files into the session store of SemanticIntegration/IngestLogs.py and the time of a
+query over all sessions. Synthetic logs in the format of the paradigm (the playback of the instructions and the EXP
+lines of every trial between other log lines, every 50th run interrupted and resumed) are written to a temporary folder, then ingested three times: all logs, no changes, one new log.
+
+Usage: python SessionStoreQuery.py [--sessions 2000] [--trials 150] [--workers N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SemanticIntegration'))
+import IngestLogs
+
+CONDITIONS = ['anomalous', 'expected', 'pseudoword', 'unexpected']
+
+
+def writeLog(filename, trials, rng, resumeAt=None):
+    """
+    Write a synthetic log of a run with the specified number of trials. If resumeAt is given, the run is interrupted
+    during this trial and resumed at it (appended to the same log, as by the paradigm).
+    """
+    t = 10.0
+    lines = ['%.4f \tEXP \tRun duration\t%d trials\t%.3f' % (t, trials, 6.0 * trials),
+             '%.4f \tEXP \tPlayback started\t%s\t%s' % (t, t - 1, 'wav/Instruktionen.wav')]
+    t = t + 60
+    trial = 0
+    while trial < trials:
+        condition = CONDITIONS[rng.integers(len(CONDITIONS))]
+        wav = 'wav/%s_%d%s.wav' % (condition, rng.integers(1, 61), 'ab'[rng.integers(2)] if condition == 'pseudoword' else '')
+        lines.append('%.4f \tEXP \tPlayback started\t%s\t%s' % (t, t - 1, wav))
+        lines.append('%.4f \tEXP \tsound: autoLog started' % t)
+        duration = rng.uniform(1.5, 3.5)
+        if rng.random() < 0.9:
+            rt = duration + rng.uniform(0.3, 1.5)
+            lines.append('%.4f \tEXP \tResponse\t%s\t%s\t%s\t%.4f' % (t + rt, '12'[rng.integers(2)], rt, rt - 0.004, 0.004))
+        if trial == resumeAt:
+            resumeAt = None
+            t = t + 120
+            lines.append('%.4f \tEXP \tResumed run\t1\tat trial %d of %d' % (t, trial, trials))
+            continue
+        t = t + duration + 2.5
+        lines.append('%.4f \tEXP \tTrial ended\t%s' % (t, t - 1))
+        trial = trial + 1
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingestion and query time of the session store')
+    parser.add_argument('--sessions', type=int, default=2000, help='number of logs (default: 2000)')
+    parser.add_argument('--trials', type=int, default=150, help='trials per log (default: 150)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        for n in range(args.sessions):
+            writeLog(os.path.join(directory, '%04d_SemanticIntegration_%d_2024_Jan_01_1200.log' % (n // 2, 1 + n % 2)), args.trials, rng,
+                     resumeAt=args.trials // 2 if n % 50 == 49 else None)
+        storeFile = os.path.join(directory, 'sessions.npz')
+        for name in ['all logs', 'unchanged', 'one new log']:
+            if name == 'one new log':
+                writeLog(os.path.join(directory, 'new_SemanticIntegration_1_2024_Jan_02_1200.log'), args.trials, rng)
+            start = time.perf_counter()
+            store, parsed = IngestLogs.ingest([directory], storeFile, args.workers)
+            print('%-12s %5d parsed  %8d rows  %8.3f s' % (name, parsed, len(store), time.perf_counter() - start))
+        print('store size   %.1f MB' % (os.path.getsize(storeFile) / 1024 / 1024))
+        start = time.perf_counter()
+        store = IngestLogs.SessionStore.load(storeFile)
+        print('load         %.1f ms' % (1000 * (time.perf_counter() - start)))
+        IngestLogs.printSummary(store)
+
+
+if __name__ == '__main__':
+    main()
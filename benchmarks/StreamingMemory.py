@@ -0,0 +1,83 @@
+"""
+Compare the resident memory of loading a whole wav file (as PsychoPy's decoding does) with streaming it from a
+memory map (Utils/StreamingSound.py). The audio callback is driven directly, as fast as possible, so no audio
+device is needed. A synthetic stereo wav file of --seconds seconds is written to a temporary folder.
+
+Usage: python StreamingMemory.py [--seconds 300] [--read-ahead 1.0] [--files 12]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import types
+import wave
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from StreamingSound import StreamingSound, getResidentMemory
+
+
+def writeWav(filename, seconds, sampleRate=44100):
+    rng = np.random.default_rng(0)
+    with wave.open(filename, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(sampleRate)
+        for i in range(int(seconds)):
+            w.writeframes((rng.uniform(-1, 1, 2 * sampleRate) * 20000).astype(np.int16).tobytes())
+
+
+def stream(wavfile, readAhead):
+    """
+    Play a file through the callback of StreamingSound and return the peak increase of the resident memory.
+    """
+    snd = StreamingSound(wavfile, readAhead=readAhead)
+    outdata = np.zeros((snd.blockSize, snd.channels), dtype=np.float32)
+    status = types.SimpleNamespace(output_underflow=False)
+    timeInfo = types.SimpleNamespace(outputBufferDacTime=0.0)
+    start = getResidentMemory()
+    peak = start
+    while True:
+        try:
+            snd.callback(outdata, snd.blockSize, timeInfo, status)
+        except StopIteration:
+            break
+        finally:
+            peak = max(peak, getResidentMemory())
+    snd.stop()
+    return peak - start
+
+
+def decode(wavfile):
+    """
+    Read a whole file into a float32 array (like a decoded sound) and return the increase of the resident memory.
+    """
+    start = getResidentMemory()
+    with wave.open(wavfile, 'rb') as w:
+        samples = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16).astype(np.float32) / 32768
+    size = getResidentMemory() - start
+    del samples
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident memory of decoded vs. streamed playback')
+    parser.add_argument('--seconds', type=float, default=300, help='duration of the wav file in seconds (default: 300)')
+    parser.add_argument('--read-ahead', type=float, default=1.0, help='read-ahead window in seconds (default: 1)')
+    parser.add_argument('--files', type=int, default=12, help='number of passages played in a row (default: 12)')
+    args = parser.parse_args()
+    if getResidentMemory() is None:
+        sys.exit('The resident memory cannot be determined on this system (install psutil)')
+
+    with tempfile.TemporaryDirectory() as directory:
+        wavfile = os.path.join(directory, 'passage.wav')
+        writeWav(wavfile, args.seconds)
+        print('wav file\t%.1f MB' % (os.path.getsize(wavfile) / 1024 / 1024))
+        print('decoded\t%.1f MB' % (decode(wavfile) / 1024 / 1024))
+        peak = max(stream(wavfile, args.read_ahead) for i in range(args.files))
+        print('streamed (%d passages)\t%.1f MB peak' % (args.files, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Measure the pulse-width jitter of the trigger scheduler on an in-memory (simulated) port.
+
+Usage: python TriggerJitter.py [--pulses N] [--width SECONDS] [--interval SECONDS] [--spin SECONDS]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from Triggers import SimulatedPort, TriggerScheduler
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pulse-width jitter of the trigger scheduler (simulated port)')
+    parser.add_argument('--pulses', type=int, default=200, help='number of pulses to send')
+    parser.add_argument('--width', type=float, default=0.1, help='pulse width in seconds')
+    parser.add_argument('--interval', type=float, default=0.15, help='mean interval between pulse onsets in seconds')
+    parser.add_argument('--spin', type=float, default=0.002, help='busy-wait window of the scheduler in seconds')
+    args = parser.parse_args()
+
+    port = SimulatedPort()
+    scheduler = TriggerScheduler(port, pulseWidth=args.width, spinWindow=args.spin)
+    scheduler.start()
+    cpuStart = time.process_time()
+    for n in range(args.pulses):
+        scheduler.pulse(1 + n % 255)
+        time.sleep(args.width + random.uniform(0.5, 1.5) * (args.interval - args.width))
+    scheduler.stop()
+    cpu = time.process_time() - cpuStart
+
+    errors = [1000 * (width - args.width) for onset, width, value in port.getPulses()]
+    print('pulses          %d' % len(errors))
+    print('width error     mean %.4f ms, median %.4f ms, p99 %.4f ms, max %.4f ms' % (
+        sum(errors) / len(errors), percentile(errors, 50), percentile(errors, 99), max(errors, key=abs)))
+    print('cpu time        %.3f s' % cpu)
+    print(scheduler.summary())
+
+
+if __name__ == '__main__':
+    main()
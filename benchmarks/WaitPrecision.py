@@ -0,0 +1,60 @@
+"""
+Compare the CPU time and wake-up error of a busy-wait loop (as used by the former frame loops in wait())
+with the hybrid sleep/spin wait of Utils/Timing.py for intervals from 100ms to 12s.
+
+Usage: python WaitPrecision.py [--intervals 0.1 0.5 1 2 5 12] [--repeat N] [--spin SECONDS] [--poll SECONDS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utils'))
+from Timing import waitUntil
+
+
+def busyWait(deadline, clock, onPoll):
+    now = clock()
+    while now < deadline:
+        onPoll()
+        now = clock()
+    return now
+
+
+def measure(method, interval, args):
+    polls = [0]
+
+    def onPoll():
+        polls[0] = polls[0] + 1
+
+    clock = time.perf_counter
+    cpuStart = time.process_time()
+    deadline = clock() + interval
+    if method == 'busy':
+        woke = busyWait(deadline, clock, onPoll)
+    else:
+        woke = waitUntil(deadline, clock, spinWindow=args.spin, pollInterval=args.poll, onPoll=onPoll)
+    cpu = time.process_time() - cpuStart
+    return cpu, woke - deadline, polls[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU time and wake-up error of busy vs. hybrid waiting')
+    parser.add_argument('--intervals', type=float, nargs='+', default=[0.1, 0.5, 1, 2, 5, 12], help='intervals in seconds')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per interval and method')
+    parser.add_argument('--spin', type=float, default=0.002, help='busy-wait window of the hybrid wait in seconds')
+    parser.add_argument('--poll', type=float, default=0.02, help='poll interval of the hybrid wait in seconds')
+    args = parser.parse_args()
+
+    print('%-8s %10s %12s %14s %14s %10s' % ('method', 'interval', 'cpu [s]', 'cpu [%]', 'error [us]', 'polls'))
+    for interval in args.intervals:
+        for method in ['busy', 'hybrid']:
+            results = [measure(method, interval, args) for n in range(args.repeat)]
+            cpu = sum(r[0] for r in results) / len(results)
+            error = max((r[1] for r in results), key=abs)
+            polls = sum(r[2] for r in results) / len(results)
+            print('%-8s %10.3f %12.4f %14.1f %14.1f %10d' % (method, interval, cpu, 100 * cpu / interval, 1e6 * error, polls))
+
+
+if __name__ == '__main__':
+    main()